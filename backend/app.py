@@ -2,13 +2,37 @@ from flask import Flask, request, jsonify, send_from_directory
 from flask_cors import CORS
 import sqlite3
 import hashlib
+import heapq
+import ipaddress
+import logging
 import os
+import threading
 from datetime import datetime
-import math
+from itertools import islice
 from werkzeug.utils import secure_filename
 
+from booking import (SlotUnavailable, find_next_available, get_available_slots,
+                     parse_booking_date, reserve_slot)
+from database import add_sample_data, ensure_schema, get_db, get_read_db
+from favorites import (BUSINESS_SNAPSHOT_COLUMNS, business_snapshots, favorited_among,
+                       get_favorite_businesses, user_favorites)
+from geo import bounding_box, calculate_distance
+from geo_notifications import moved, notify_new_location, seen_businesses
+from geocoding import geocode, locate_ip
+from maintenance import start_scheduler
+from photos import (COVER_JOIN, COVER_SELECT, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, MAX_PHOTO_SIZE,
+                    MAX_PHOTOS_PER_UPLOAD, InvalidPhoto, delete_photo, photo_page, save_photos, set_cover)
+from ranking import FIELD_WEIGHTS, rank_businesses, tokenize
+from recorder import init_recorder
+from responses import stream_json, wants_columnar
+from sharding import (business_region, email_taken, enabled, find_by_email, init_shards,
+                      location_region, next_id, regions, regions_for_bbox, scatter, user_region, write_by_id)
+from viewport import (INDIVIDUAL_ZOOM, MAX_VIEWPORT_BUSINESSES, MAX_ZOOM, get_clusters,
+                      get_viewport_businesses)
+
 app = Flask(__name__, static_folder='../static')
 CORS(app)
+init_recorder(app)
 
 # Configuration
 UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), '..', 'uploads')
@@ -16,60 +40,109 @@ ALLOWED_EXTENSIONS_IMAGES = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 ALLOWED_EXTENSIONS_DOCS = {'pdf', 'doc', 'docx', 'jpg', 'jpeg', 'png'}
 MAX_FILE_SIZE = 5 * 1024 * 1024  # 5MB
 
+# Proxies whose X-Forwarded-For header is believed: comma-separated IPs or CIDR ranges
+TRUSTED_PROXIES = [ipaddress.ip_network(network.strip(), strict=False)
+                   for network in os.environ.get('TRUSTED_PROXIES', '').split(',') if network.strip()]
+
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = MAX_FILE_SIZE
 
-# Ensure upload directories exist
-os.makedirs(os.path.join(UPLOAD_FOLDER, 'users'), exist_ok=True)
-os.makedirs(os.path.join(UPLOAD_FOLDER, 'businesses'), exist_ok=True)
+# Explicit business projection for list endpoints (never password_hash or verification_doc)
+BUSINESS_LIST_SELECT = ', '.join(f'b.{column}' for column in BUSINESS_SNAPSHOT_COLUMNS)
+
+# Ranked search: words of the query used for matching, rows fetched per shard, results returned
+MAX_SEARCH_WORDS = 5
+MIN_SEARCH_WORD_LENGTH = 2
+SEARCH_STOPWORDS = frozenset({'a', 'an', 'and', 'at', 'by', 'for', 'in', 'near', 'of', 'on', 'or', 'the', 'to', 'with'})
+# bm25 weight per business_search column, in the same order
+SEARCH_FIELD_WEIGHTS = ', '.join(str(weight) for _, weight in FIELD_WEIGHTS)
+MAX_SEARCH_CANDIDATES = 500
+MAX_RANKED_RESULTS = 200
+
+# One-time setup state for create_app()
+_app_initialized = False
+_app_init_lock = threading.Lock()
+_upload_dirs_ready = set()
+
+def create_app():
+    """Application factory.
 
-DATABASE_PATH = os.path.join(os.path.dirname(__file__), '..', 'database.db')
+    Runs pending schema migrations (and prepares the shard files when
+    SHARDING=1) once per process and returns the app.
+    Gunicorn calls it in the master when preload_app is on, so workers fork
+    from an already-initialized parent; without preload each worker calls
+    it and all but the first find the schema current.
+    """
+    global _app_initialized
+    with _app_init_lock:
+        if not _app_initialized:
+            _configure_logging()
+            ensure_schema()
+            init_shards()
+            _app_initialized = True
+    return app
 
-def get_db():
-    """Get database connection"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+def _configure_logging():
+    """Send app.logger (also used by the maintenance jobs) to gunicorn's error log at its level"""
+    gunicorn_logger = logging.getLogger('gunicorn.error')
+    if gunicorn_logger.handlers:
+        app.logger.handlers = gunicorn_logger.handlers
+        app.logger.setLevel(gunicorn_logger.level)
+    else:
+        app.logger.setLevel(logging.INFO)
+
+def get_upload_dir(kind):
+    """Return an upload subdirectory, creating it on first use"""
+    path = os.path.join(UPLOAD_FOLDER, kind)
+    if kind not in _upload_dirs_ready:
+        os.makedirs(path, exist_ok=True)
+        _upload_dirs_ready.add(kind)
+    return path
 
 def hash_password(password):
     """Hash password using SHA-256"""
     return hashlib.sha256(password.encode()).hexdigest()
 
+def _is_trusted_proxy(address):
+    try:
+        ip = ipaddress.ip_address((address or '').strip())
+    except ValueError:
+        return False
+    return any(ip in network for network in TRUSTED_PROXIES)
+
 def get_client_ip():
-    """Get client IP address"""
-    if request.headers.get('X-Forwarded-For'):
-        return request.headers.get('X-Forwarded-For').split(',')[0]
-    return request.remote_addr
+    """Get client IP address.
+
+    X-Forwarded-For is only believed when the request arrives from one of
+    TRUSTED_PROXIES; the client is then the nearest hop that isn't a proxy.
+    """
+    address = request.remote_addr
+    if not _is_trusted_proxy(address):
+        return address
+    for hop in reversed(request.headers.get('X-Forwarded-For', '').split(',')):
+        hop = hop.strip()
+        if not hop:
+            continue
+        address = hop
+        if not _is_trusted_proxy(hop):
+            break
+    return address
 
 def log_user_activity(user_id, user_type, email, action, latitude=None, longitude=None):
     """Log user activity"""
-    conn = get_db()
+    region = business_region(user_id) if user_type == 'business' else user_region(user_id)
+    conn = get_db(region)
     cursor = conn.cursor()
     ip_address = get_client_ip()
     
     cursor.execute('''
-        INSERT INTO user_activity (user_id, user_type, email, ip_address, latitude, longitude, action)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    ''', (user_id, user_type, email, ip_address, latitude, longitude, action))
+        INSERT INTO user_activity (id, user_id, user_type, email, ip_address, latitude, longitude, action)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (next_id(conn, 'user_activity'), user_id, user_type, email, ip_address, latitude, longitude, action))
     
     conn.commit()
     conn.close()
 
-def calculate_distance(lat1, lon1, lat2, lon2):
-    """Calculate distance between two points using Haversine formula"""
-    R = 6371  # Earth's radius in kilometers
-    
-    lat1_rad = math.radians(lat1)
-    lat2_rad = math.radians(lat2)
-    delta_lat = math.radians(lat2 - lat1)
-    delta_lon = math.radians(lon2 - lon1)
-    
-    a = math.sin(delta_lat/2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(delta_lon/2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-    
-    distance = R * c
-    return round(distance, 2)
-
 def allowed_file(filename, file_type='image'):
     """Check if file extension is allowed"""
     if '.' not in filename:
@@ -83,32 +156,35 @@ def allowed_file(filename, file_type='image'):
 
 def check_nearby_users(business_lat, business_lon, business_id, business_name, radius_km=10):
     """Check for users within radius and create notifications"""
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    # Get all users with location
-    cursor.execute('SELECT id, name, email, latitude, longitude FROM users WHERE latitude IS NOT NULL')
-    users = cursor.fetchall()
-    
-    notifications_created = 0
-    
-    for user in users:
-        distance = calculate_distance(user['latitude'], user['longitude'], business_lat, business_lon)
+    def notify(conn, region):
+        cursor = conn.cursor()
         
-        if distance <= radius_km:
-            # Create notification
-            title = f"New Business Near You! 🎉"
-            message = f"{business_name} just registered {distance}km away from you!"
-            
-            cursor.execute('''
-                INSERT INTO notifications (user_id, business_id, title, message)
-                VALUES (?, ?, ?, ?)
-            ''', (user['id'], business_id, title, message))
+        # Get all users with location
+        cursor.execute('SELECT id, name, email, latitude, longitude FROM users WHERE latitude IS NOT NULL')
+        users = cursor.fetchall()
+        
+        created = 0
+        
+        for user in users:
+            distance = calculate_distance(user['latitude'], user['longitude'], business_lat, business_lon)
             
-            notifications_created += 1
+            if distance <= radius_km:
+                # Create notification
+                title = f"New Business Near You! 🎉"
+                message = f"{business_name} just registered {distance}km away from you!"
+                
+                cursor.execute('''
+                    INSERT INTO notifications (id, user_id, business_id, title, message)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (next_id(conn, 'notifications'), user['id'], business_id, title, message))
+                
+                created += 1
+        
+        conn.commit()
+        return created
     
-    conn.commit()
-    conn.close()
+    # A user who moved stays in their old shard until the next rebalance, so check every shard
+    notifications_created = sum(scatter(notify, read=False))
     
     return notifications_created
 
@@ -142,14 +218,18 @@ def user_register():
         
         password_hash = hash_password(password)
         
-        conn = get_db()
+        # UNIQUE(email) only covers one shard
+        if enabled() and email_taken('users', email):
+            return jsonify({'error': 'Email already exists'}), 400
+        
+        conn = get_db(location_region(latitude, longitude))
         cursor = conn.cursor()
         
         try:
             cursor.execute('''
-                INSERT INTO users (name, email, password_hash, latitude, longitude)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (name, email, password_hash, latitude, longitude))
+                INSERT INTO users (id, name, email, password_hash, latitude, longitude)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (next_id(conn, 'users'), name, email, password_hash, latitude, longitude))
             
             user_id = cursor.lastrowid
             conn.commit()
@@ -190,39 +270,37 @@ def user_login():
         
         password_hash = hash_password(password)
         
-        conn = get_db()
-        cursor = conn.cursor()
-        
         # Case-insensitive search for email, but password hash must match
-        cursor.execute('''
+        user_dict, region = find_by_email('''
             SELECT id, name, email, profile_photo 
             FROM users 
             WHERE LOWER(email) = ? AND password_hash = ?
         ''', (email, password_hash))
         
-        user = cursor.fetchone()
-        
-        if user:
-            user_dict = dict(user)
-            
+        if user_dict:
             # Update user location
             if latitude and longitude:
-                cursor.execute('''
+                conn = get_db(region)
+                previous = conn.execute('SELECT latitude, longitude FROM users WHERE id = ?',
+                                        (user_dict['id'],)).fetchone()
+                conn.execute('''
                     UPDATE users SET latitude = ?, longitude = ? WHERE id = ?
                 ''', (latitude, longitude, user_dict['id']))
                 conn.commit()
+                
+                # Notify about new businesses around the new location
+                if moved(previous['latitude'], previous['longitude'], float(latitude), float(longitude)):
+                    notify_new_location(conn, user_dict['id'], float(latitude), float(longitude))
+                conn.close()
             
             # Log activity
             log_user_activity(user_dict['id'], 'user', email, 'login', latitude, longitude)
             
-            conn.close()
-            
             return jsonify({
                 'message': 'Login successful!',
                 'user': user_dict
             }), 200
         else:
-            conn.close()
             return jsonify({'error': 'Invalid email or password'}), 401
             
     except Exception as e:
@@ -252,12 +330,12 @@ def upload_user_photo():
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         filename = f"user_{user_id}_{timestamp}_{filename}"
         
-        filepath = os.path.join(UPLOAD_FOLDER, 'users', filename)
+        filepath = os.path.join(get_upload_dir('users'), filename)
         file.save(filepath)
         
         # Update database
         photo_path = f"/uploads/users/{filename}"
-        conn = get_db()
+        conn = get_db(user_region(user_id))
         cursor = conn.cursor()
         cursor.execute('UPDATE users SET profile_photo = ? WHERE id = ?', (photo_path, user_id))
         conn.commit()
@@ -282,7 +360,7 @@ def remove_user_photo():
             return jsonify({'error': 'User ID required'}), 400
         
         # Get current photo path
-        conn = get_db()
+        conn = get_db(user_region(user_id))
         cursor = conn.cursor()
         cursor.execute('SELECT profile_photo FROM users WHERE id = ?', (user_id,))
         user = cursor.fetchone()
@@ -316,7 +394,7 @@ def delete_user_account():
         if not user_id:
             return jsonify({'error': 'User ID required'}), 400
             
-        conn = get_db()
+        conn = get_db(user_region(user_id))
         cursor = conn.cursor()
         
         # 1. Get user info to delete photo file
@@ -344,6 +422,15 @@ def delete_user_account():
         conn.commit()
         conn.close()
         
+        if enabled():
+            # Bookings live with the business, which may be in another shard
+            def delete_bookings(shard, region):
+                shard.execute('DELETE FROM bookings WHERE user_id = ?', (user_id,))
+                shard.commit()
+            scatter(delete_bookings, read=False)
+        user_favorites.forget(user_id)
+        seen_businesses.forget(user_id)
+        
         return jsonify({'message': 'Account deleted successfully'}), 200
         
     except Exception as e:
@@ -372,15 +459,19 @@ def business_register():
         
         password_hash = hash_password(password)
         
-        conn = get_db()
+        # UNIQUE(email) only covers one shard
+        if enabled() and email_taken('businesses', email):
+            return jsonify({'error': 'Email already exists'}), 400
+        
+        conn = get_db(location_region(latitude, longitude))
         cursor = conn.cursor()
         
         try:
             cursor.execute('''
-                INSERT INTO businesses (business_name, owner_name, email, phone, business_type,
+                INSERT INTO businesses (id, business_name, owner_name, email, phone, business_type,
                                        address, latitude, longitude, website, password_hash)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (business_name, owner_name, email, phone, business_type, address,
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (next_id(conn, 'businesses'), business_name, owner_name, email, phone, business_type, address,
                   float(latitude), float(longitude), website, password_hash))
             
             business_id = cursor.lastrowid
@@ -388,9 +479,9 @@ def business_register():
             # Add services
             for service in services:
                 cursor.execute('''
-                    INSERT INTO services (business_id, service_name, price)
-                    VALUES (?, ?, ?)
-                ''', (business_id, service['name'], float(service['price'])))
+                    INSERT INTO services (id, business_id, service_name, price)
+                    VALUES (?, ?, ?, ?)
+                ''', (next_id(conn, 'services'), business_id, service['name'], float(service['price'])))
             
             conn.commit()
             
@@ -429,33 +520,23 @@ def business_login():
         
         password_hash = hash_password(password)
         
-        conn = get_db()
-        cursor = conn.cursor()
-        
         # Case-insensitive search for email, but password hash must match
-        cursor.execute('''
+        business_dict, _ = find_by_email('''
             SELECT id, business_name, owner_name, email, phone, business_type, 
                    address, verified, verification_doc
             FROM businesses 
             WHERE LOWER(email) = ? AND password_hash = ?
         ''', (email, password_hash))
         
-        business = cursor.fetchone()
-        
-        if business:
-            business_dict = dict(business)
-            
+        if business_dict:
             # Log activity
             log_user_activity(business_dict['id'], 'business', email, 'login', latitude, longitude)
             
-            conn.close()
-            
             return jsonify({
                 'message': 'Login successful!',
                 'business': business_dict
             }), 200
         else:
-            conn.close()
             return jsonify({'error': 'Invalid email or password'}), 401
             
     except Exception as e:
@@ -485,12 +566,12 @@ def upload_business_document():
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         filename = f"business_{business_id}_{timestamp}_{filename}"
         
-        filepath = os.path.join(UPLOAD_FOLDER, 'businesses', filename)
+        filepath = os.path.join(get_upload_dir('businesses'), filename)
         file.save(filepath)
         
         # Update database
         doc_path = f"/uploads/businesses/{filename}"
-        conn = get_db()
+        conn = get_db(business_region(business_id))
         cursor = conn.cursor()
         cursor.execute('UPDATE businesses SET verification_doc = ? WHERE id = ?', (doc_path, business_id))
         conn.commit()
@@ -515,7 +596,7 @@ def remove_business_document():
             return jsonify({'error': 'Business ID required'}), 400
         
         # Get current document path
-        conn = get_db()
+        conn = get_db(business_region(business_id))
         cursor = conn.cursor()
         cursor.execute('SELECT verification_doc FROM businesses WHERE id = ?', (business_id,))
         business = cursor.fetchone()
@@ -539,60 +620,291 @@ def remove_business_document():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-# ============ SEARCH & DISCOVERY ============
-@app.route('/api/businesses/nearby', methods=['POST'])
-def get_nearby_businesses():
-    """Get businesses near user location"""
+# ============ BUSINESS PHOTOS ============
+@app.route('/api/business/<int:business_id>/photos', methods=['POST'])
+def upload_business_photos(business_id):
+    """Add one or more photos to a business's gallery"""
     try:
-        data = request.get_json()
-        user_lat = data.get('latitude')
-        user_lon = data.get('longitude')
-        radius = data.get('radius', 50)  # Default 50km radius
-        business_type = data.get('business_type')
+        # Several photos per request, each still limited to MAX_PHOTO_SIZE
+        request.max_content_length = MAX_PHOTOS_PER_UPLOAD * MAX_PHOTO_SIZE
+        files = [file for file in request.files.getlist('photos') if file.filename]
         
-        conn = get_db()
-        cursor = conn.cursor()
+        if not files:
+            return jsonify({'error': 'No photos provided'}), 400
         
-        query = '''
-            SELECT b.*, GROUP_CONCAT(s.service_name || ' ($' || s.price || ')') as services
-            FROM businesses b
-            LEFT JOIN services s ON b.id = s.business_id
-            WHERE b.verified = 1
-        '''
+        if len(files) > MAX_PHOTOS_PER_UPLOAD:
+            return jsonify({'error': f'At most {MAX_PHOTOS_PER_UPLOAD} photos per upload'}), 400
         
-        params = []
+        conn = get_db(business_region(business_id))
+        try:
+            if conn.execute('SELECT 1 FROM businesses WHERE id = ?', (business_id,)).fetchone() is None:
+                return jsonify({'error': 'Business not found'}), 404
+            
+            photos = save_photos(conn, business_id, [(secure_filename(file.filename), file.read()) for file in files],
+                                 get_upload_dir('businesses'))
+        except InvalidPhoto as e:
+            return jsonify({'error': str(e)}), 400
+        finally:
+            conn.close()
         
-        if business_type:
-            query += ' AND b.business_type = ?'
-            params.append(business_type)
+        # Listings cached with the old (or no) cover
+        business_snapshots.invalidate(business_id)
         
-        query += ' GROUP BY b.id'
+        return jsonify({
+            'message': f'{len(photos)} photo(s) uploaded successfully!',
+            'photos': photos
+        }), 200
         
-        cursor.execute(query, params)
-        businesses = cursor.fetchall()
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/business/<int:business_id>/photos', methods=['GET'])
+def get_business_photos(business_id):
+    """One page of a business's gallery; pass the returned `next` as `after` for the following page"""
+    try:
+        after = request.args.get('after', type=int)
+        limit = min(request.args.get('limit', DEFAULT_PAGE_SIZE, type=int), MAX_PAGE_SIZE)
         
-        # Calculate distances
-        result = []
-        for biz in businesses:
-            biz_dict = dict(biz)
-            
-            if user_lat and user_lon:
-                distance = calculate_distance(user_lat, user_lon, biz_dict['latitude'], biz_dict['longitude'])
-                
-                if distance <= radius:
-                    biz_dict['distance'] = distance
-                    result.append(biz_dict)
-            else:
-                biz_dict['distance'] = None
-                result.append(biz_dict)
+        conn = get_read_db(region=business_region(business_id))
+        photos, next_after = photo_page(conn, business_id, after, max(limit, 1))
+        conn.close()
         
-        # Sort by distance if available
-        if user_lat and user_lon:
-            result.sort(key=lambda x: x['distance'] if x['distance'] is not None else float('inf'))
+        return jsonify({'photos': photos, 'next': next_after}), 200
         
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/business/<int:business_id>/photos/<int:photo_id>/cover', methods=['POST'])
+def set_business_cover(business_id, photo_id):
+    """Show a photo as the business's cover in listings"""
+    try:
+        conn = get_db(business_region(business_id))
+        updated = set_cover(conn, business_id, photo_id)
         conn.close()
         
-        return jsonify(result), 200
+        if not updated:
+            return jsonify({'error': 'Photo not found'}), 404
+        
+        business_snapshots.invalidate(business_id)
+        
+        return jsonify({'message': 'Cover photo updated'}), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/business/<int:business_id>/photos/<int:photo_id>', methods=['DELETE'])
+def delete_business_photo(business_id, photo_id):
+    """Remove a photo and its resized copies"""
+    try:
+        conn = get_db(business_region(business_id))
+        deleted = delete_photo(conn, business_id, photo_id, UPLOAD_FOLDER)
+        conn.close()
+        
+        if not deleted:
+            return jsonify({'error': 'Photo not found'}), 404
+        
+        business_snapshots.invalidate(business_id)
+        
+        return jsonify({'message': 'Photo removed'}), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# ============ SEARCH & DISCOVERY ============
+def nearby_listings(user_lat, user_lon, radius, business_type=None, user_id=None, sort='distance', limit=None,
+                    conn=None):
+    """Verified businesses around a point as (listings iterator, close callback).
+
+    sort='distance' lists nearest first; sort='relevance' ranks by distance
+    decay and popularity (see ranking.py) and keeps only the top `limit`.
+    conn is an open read connection to reuse instead of opening new ones
+    (the batch endpoint's transaction). It is only used without sharding,
+    when it holds every business.
+    """
+    has_location = bool(user_lat and user_lon)
+    target_regions = regions()
+    shared = conn is not None and not enabled()
+    
+    query = f'''
+        SELECT {BUSINESS_LIST_SELECT}, {COVER_SELECT},
+               GROUP_CONCAT(s.service_name || ' ($' || s.price || ')') as services
+        FROM businesses b
+        {COVER_JOIN}
+        LEFT JOIN services s ON b.id = s.business_id
+        WHERE b.verified = 1
+    '''
+    
+    params = []
+    
+    if business_type:
+        query += ' AND b.business_type = ?'
+        params.append(business_type)
+    
+    # Cheap bounding box prefilter before the exact distance check
+    if has_location:
+        min_lat, max_lat, min_lon, max_lon = bounding_box(user_lat, user_lon, radius)
+        query += ' AND b.latitude BETWEEN ? AND ? AND b.longitude BETWEEN ? AND ?'
+        params.extend([min_lat, max_lat, min_lon, max_lon])
+        target_regions = regions_for_bbox(min_lat, max_lat, min_lon, max_lon)
+    
+    query += ' GROUP BY b.id'
+    close = None
+    
+    if has_location:
+        # Keep only rows inside the radius, sorted by distance, then merge the shards.
+        # The sort needs every match in memory, so only the body is streamed here.
+        def matches_in(conn, region):
+            matches = []
+            for row in conn.execute(query, params):
+                distance = calculate_distance(user_lat, user_lon, row['latitude'], row['longitude'])
+                if distance <= radius:
+                    matches.append((distance, row))
+            matches.sort(key=lambda match: match[0])
+            return matches
+        shard_matches = [matches_in(conn, None)] if shared else scatter(matches_in, target_regions)
+        merged = heapq.merge(*shard_matches, key=lambda match: match[0])
+        rows = ((row, distance) for distance, row in merged)
+    elif shared:
+        rows = ((row, None) for row in conn.execute(query, params))
+    elif len(target_regions) == 1:
+        conn = get_read_db(region=target_regions[0])
+        rows = ((row, None) for row in conn.execute(query, params))
+        close = conn.close
+    else:
+        results = scatter(lambda conn, region: conn.execute(query, params).fetchall(), target_regions)
+        rows = ((row, None) for shard_rows in results for row in shard_rows)
+    
+    # Flag the requesting user's favorites from the cached id set
+    favorites = None
+    if user_id:
+        favorites_conn = conn if shared else get_read_db(region=user_region(user_id))
+        favorites = set(user_favorites.get_ids(favorites_conn, user_id))
+        if not shared:
+            favorites_conn.close()
+    
+    def listings():
+        for row, distance in rows:
+            biz = dict(row)
+            biz['distance'] = distance
+            if favorites is not None:
+                biz['is_favorite'] = biz['id'] in favorites
+            yield biz
+    
+    if sort == 'relevance':
+        ranked = rank_businesses(listings(), limit=limit)
+        if close:
+            close()
+        return iter(ranked), None
+    if limit is not None:
+        return islice(listings(), limit), close
+    return listings(), close
+
+def search_by_name(query, user_lat=None, user_lon=None, limit=20):
+    """Verified businesses matching every significant word of the query, best first.
+
+    Words match the start of a word in the name, type, services or address,
+    ignoring case and accents ('montreal' finds 'Montréal'). Each shard
+    returns its best MAX_SEARCH_CANDIDATES text matches (bm25 from the
+    business_search index) for the final ranking.
+    """
+    words = [word for word in dict.fromkeys(tokenize(query))
+             if len(word) >= MIN_SEARCH_WORD_LENGTH and word not in SEARCH_STOPWORDS]
+    words = words[:MAX_SEARCH_WORDS]
+    if not words:
+        return []
+    # Tokens are [a-z0-9]+, so quoting them is enough to keep FTS5 syntax out
+    match = ' '.join(f'"{word}"*' for word in words)
+    
+    def matches_in(conn, region):
+        return conn.execute(f'''
+            WITH matched AS MATERIALIZED (
+                SELECT rowid AS id, bm25(business_search, {SEARCH_FIELD_WEIGHTS}) AS text_rank
+                FROM business_search
+                WHERE business_search MATCH ?
+            )
+            SELECT {BUSINESS_LIST_SELECT}, {COVER_SELECT},
+                   GROUP_CONCAT(s.service_name || ' ($' || s.price || ')') as services
+            FROM matched m
+            JOIN businesses b ON b.id = m.id
+            {COVER_JOIN}
+            LEFT JOIN services s ON b.id = s.business_id
+            WHERE b.verified = 1
+            GROUP BY b.id
+            ORDER BY m.text_rank
+            LIMIT ?
+        ''', (match, MAX_SEARCH_CANDIDATES)).fetchall()
+    
+    has_location = bool(user_lat and user_lon)
+    
+    def candidates():
+        for shard_rows in scatter(matches_in):
+            for row in shard_rows:
+                biz = dict(row)
+                if has_location:
+                    biz['distance'] = calculate_distance(user_lat, user_lon, biz['latitude'], biz['longitude'])
+                yield biz
+    
+    return rank_businesses(candidates(), query=' '.join(words), limit=limit)
+
+@app.route('/api/businesses/nearby', methods=['POST'])
+def get_nearby_businesses():
+    """Get businesses near user location"""
+    try:
+        data = request.get_json()
+        limit = data.get('limit')
+        listings, close = nearby_listings(
+            data.get('latitude'), data.get('longitude'),
+            data.get('radius', 50),  # Default 50km radius
+            data.get('business_type'), data.get('user_id'),
+            sort=data.get('sort', 'distance'),
+            limit=min(int(limit), MAX_RANKED_RESULTS) if limit else None)
+        
+        return stream_json(listings, columnar=wants_columnar(data), on_close=close)
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/businesses/viewport', methods=['GET'])
+def get_viewport():
+    """Get map markers for the visible bounds: clusters when zoomed out, businesses when zoomed in"""
+    try:
+        try:
+            north = float(request.args['north'])
+            south = float(request.args['south'])
+            east = float(request.args['east'])
+            west = float(request.args['west'])
+            zoom = int(request.args.get('zoom', INDIVIDUAL_ZOOM))
+        except (KeyError, ValueError):
+            return jsonify({'error': 'north, south, east, west and zoom are required'}), 400
+        
+        business_type = request.args.get('business_type') or None
+        south, north = max(south, -90.0), min(north, 90.0)
+        west, east = max(west, -180.0), min(east, 180.0)
+        zoom = max(0, min(zoom, MAX_ZOOM))
+        
+        if south > north or west > east:
+            return jsonify({'error': 'Invalid bounds'}), 400
+        
+        target_regions = regions_for_bbox(south, north, west, east)
+        
+        if zoom >= INDIVIDUAL_ZOOM:
+            results = scatter(lambda conn, region: get_viewport_businesses(
+                conn, south, west, north, east, business_type), target_regions)
+            businesses = [biz for shard_businesses, _ in results for biz in shard_businesses]
+            truncated = any(shard_truncated for _, shard_truncated in results)
+            if len(businesses) > MAX_VIEWPORT_BUSINESSES:
+                businesses, truncated = businesses[:MAX_VIEWPORT_BUSINESSES], True
+            return jsonify({'zoom': zoom, 'mode': 'businesses', 'businesses': businesses,
+                            'truncated': truncated}), 200
+        
+        try:
+            results = scatter(lambda conn, region: get_clusters(
+                conn, south, west, north, east, zoom, business_type, region), target_regions)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        clusters = [cluster for shard_clusters in results for cluster in shard_clusters]
+        
+        return jsonify({'zoom': zoom, 'mode': 'clusters', 'clusters': clusters}), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -606,48 +918,123 @@ def search_businesses():
         if not query:
             return jsonify([]), 200
         
-        conn = get_db()
-        cursor = conn.cursor()
+        businesses = search_by_name(query, request.args.get('latitude', type=float),
+                                    request.args.get('longitude', type=float))
         
-        cursor.execute('''
-            SELECT b.*, GROUP_CONCAT(s.service_name || ' ($' || s.price || ')') as services
-            FROM businesses b
-            LEFT JOIN services s ON b.id = s.business_id
-            WHERE b.verified = 1 
-            AND (b.business_name LIKE ? OR b.address LIKE ? OR b.business_type LIKE ?)
-            GROUP BY b.id
-            LIMIT 20
-        ''', (f'%{query}%', f'%{query}%', f'%{query}%'))
+        return stream_json(businesses, columnar=wants_columnar())
         
-        businesses = [dict(row) for row in cursor.fetchall()]
-        conn.close()
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# ============ GEOCODING ============
+@app.route('/api/geocode', methods=['GET'])
+def geocode_place():
+    """Resolve a city, postal code or address to coordinates without leaving the server"""
+    try:
+        query = request.args.get('q', '').strip()
+        
+        if not query:
+            return jsonify({'error': 'Query required'}), 400
         
-        return jsonify(businesses), 200
+        place = geocode(query)
+        if not place:
+            return jsonify({'error': 'Location not found'}), 404
+        
+        return jsonify(place), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/geocode/ip', methods=['GET'])
+def geocode_ip():
+    """Nearest city to earlier activity at the client's IP"""
+    try:
+        place = locate_ip(get_client_ip())
+        if not place:
+            return jsonify({'error': 'Location not found'}), 404
+        
+        return jsonify(place), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/search', methods=['GET'])
+def search_places_and_businesses():
+    """Geocode the query and return businesses around it, or fall back to a name search"""
+    try:
+        query = request.args.get('q', '').strip()
+        
+        if not query:
+            return jsonify({'location': None, 'businesses': []}), 200
+        
+        place = geocode(query)
+        if not place:
+            businesses = search_by_name(query, request.args.get('latitude', type=float),
+                                        request.args.get('longitude', type=float))
+            return jsonify({'location': None, 'businesses': businesses}), 200
+        
+        listings, close = nearby_listings(
+            place['latitude'], place['longitude'],
+            float(request.args.get('radius', 50)),
+            request.args.get('business_type') or None,
+            request.args.get('user_id', type=int),
+            sort=request.args.get('sort', 'relevance'),
+            limit=min(request.args.get('limit', MAX_RANKED_RESULTS, type=int), MAX_RANKED_RESULTS))
+        try:
+            businesses = list(listings)
+        finally:
+            if close:
+                close()
+        
+        return jsonify({'location': place, 'businesses': businesses}), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 # ============ NOTIFICATIONS ============
+def user_notifications(conn, user_id):
+    """A user's 50 latest notifications, each with its business's name, type and address"""
+    cursor = conn.cursor()
+    
+    cursor.execute('''
+        SELECT id, business_id, title, message, is_read, created_at
+        FROM notifications
+        WHERE user_id = ?
+        ORDER BY created_at DESC
+        LIMIT 50
+    ''', (user_id,))
+    
+    notifications = [dict(row) for row in cursor.fetchall()]
+    
+    # Business details come from the snapshot cache, which knows each business's shard
+    businesses = business_snapshots.get_many(conn, {n['business_id'] for n in notifications})
+    
+    results = []
+    for notification in notifications:
+        business = businesses.get(notification['business_id'])
+        if business:
+            for field in ('business_name', 'business_type', 'address'):
+                notification[field] = business[field]
+            results.append(notification)
+    return results
+
+def unread_count(conn, user_id):
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT COUNT(*) as count FROM notifications 
+        WHERE user_id = ? AND is_read = 0
+    ''', (user_id,))
+    return cursor.fetchone()['count']
+
 @app.route('/api/user/<int:user_id>/notifications', methods=['GET'])
 def get_user_notifications(user_id):
     """Get user notifications"""
     try:
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT n.*, b.business_name, b.business_type, b.address
-            FROM notifications n
-            JOIN businesses b ON n.business_id = b.id
-            WHERE n.user_id = ?
-            ORDER BY n.created_at DESC
-            LIMIT 50
-        ''', (user_id,))
-        
-        notifications = [dict(row) for row in cursor.fetchall()]
+        conn = get_read_db(max_staleness=0, region=user_region(user_id))
+        notifications = user_notifications(conn, user_id)
         conn.close()
         
-        return jsonify(notifications), 200
+        return stream_json(notifications, columnar=wants_columnar())
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -656,15 +1043,8 @@ def get_user_notifications(user_id):
 def get_unread_notifications(user_id):
     """Get unread notification count"""
     try:
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT COUNT(*) as count FROM notifications 
-            WHERE user_id = ? AND is_read = 0
-        ''', (user_id,))
-        
-        count = cursor.fetchone()['count']
+        conn = get_read_db(max_staleness=0, region=user_region(user_id))
+        count = unread_count(conn, user_id)
         conn.close()
         
         return jsonify({'count': count}), 200
@@ -676,12 +1056,12 @@ def get_unread_notifications(user_id):
 def mark_notification_read(notification_id):
     """Mark notification as read"""
     try:
-        conn = get_db()
-        cursor = conn.cursor()
+        def mark(conn, region):
+            cursor = conn.execute('UPDATE notifications SET is_read = 1 WHERE id = ?', (notification_id,))
+            conn.commit()
+            return cursor.rowcount
         
-        cursor.execute('UPDATE notifications SET is_read = 1 WHERE id = ?', (notification_id,))
-        conn.commit()
-        conn.close()
+        write_by_id(notification_id, mark)
         
         return jsonify({'message': 'Notification marked as read'}), 200
         
@@ -693,22 +1073,27 @@ def mark_notification_read(notification_id):
 def get_user_favorites(user_id):
     """Get user's favorite businesses"""
     try:
-        conn = get_db()
-        cursor = conn.cursor()
+        conn = get_read_db(max_staleness=0, region=user_region(user_id))
+        favorites = get_favorite_businesses(conn, user_id)
+        conn.close()
         
-        cursor.execute('''
-            SELECT b.*, GROUP_CONCAT(s.service_name || ' ($' || s.price || ')') as services
-            FROM favorites f
-            JOIN businesses b ON f.business_id = b.id
-            LEFT JOIN services s ON b.id = s.business_id
-            WHERE f.user_id = ?
-            GROUP BY b.id
-        ''', (user_id,))
+        return stream_json(favorites, columnar=wants_columnar())
         
-        favorites = [dict(row) for row in cursor.fetchall()]
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/user/<int:user_id>/favorites/check', methods=['POST'])
+def check_favorites(user_id):
+    """Check which of a list of businesses the user has favorited"""
+    try:
+        data = request.get_json()
+        business_ids = [int(business_id) for business_id in data.get('business_ids', [])]
+        
+        conn = get_read_db(max_staleness=0, region=user_region(user_id))
+        favorited = favorited_among(conn, user_id, business_ids)
         conn.close()
         
-        return jsonify(favorites), 200
+        return jsonify({'favorited': sorted(favorited)}), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -717,15 +1102,16 @@ def get_user_favorites(user_id):
 def add_favorite(user_id, business_id):
     """Add business to favorites"""
     try:
-        conn = get_db()
+        conn = get_db(user_region(user_id))
         cursor = conn.cursor()
         
         try:
             cursor.execute('''
-                INSERT INTO favorites (user_id, business_id)
-                VALUES (?, ?)
-            ''', (user_id, business_id))
+                INSERT INTO favorites (id, user_id, business_id)
+                VALUES (?, ?, ?)
+            ''', (next_id(conn, 'favorites'), user_id, business_id))
             conn.commit()
+            user_favorites.added(user_id, business_id, cursor.lastrowid)
             conn.close()
             
             return jsonify({'message': 'Added to favorites'}), 200
@@ -741,7 +1127,7 @@ def add_favorite(user_id, business_id):
 def remove_favorite(user_id, business_id):
     """Remove business from favorites"""
     try:
-        conn = get_db()
+        conn = get_db(user_region(user_id))
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -750,6 +1136,7 @@ def remove_favorite(user_id, business_id):
         ''', (user_id, business_id))
         
         conn.commit()
+        user_favorites.removed(user_id, business_id)
         conn.close()
         
         return jsonify({'message': 'Removed from favorites'}), 200
@@ -757,6 +1144,251 @@ def remove_favorite(user_id, business_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# ============ BOOKINGS ============
+@app.route('/api/business/<int:business_id>/services/<int:service_id>/slots', methods=['GET'])
+def get_service_slots(business_id, service_id):
+    """Get open booking slots for a service on a given day"""
+    try:
+        # Without a date, the business's own today
+        date_str = request.args.get('date')
+        day = None
+        if date_str:
+            try:
+                day = datetime.strptime(date_str, '%Y-%m-%d')
+            except ValueError:
+                return jsonify({'error': 'Invalid date. Use YYYY-MM-DD'}), 400
+        
+        conn = get_read_db(region=business_region(business_id))
+        availability = get_available_slots(conn, business_id, service_id, day)
+        conn.close()
+        
+        if availability is None:
+            return jsonify({'error': 'Service not found'}), 404
+        
+        return jsonify(availability), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/bookings', methods=['POST'])
+def create_booking():
+    """Reserve a slot for a user"""
+    try:
+        data = request.get_json()
+        user_id = data.get('user_id')
+        business_id = data.get('business_id')
+        service_id = data.get('service_id')
+        booking_date = data.get('booking_date')
+        
+        if not all([user_id, business_id, service_id, booking_date]):
+            return jsonify({'error': 'User, business, service and booking date are required'}), 400
+        
+        try:
+            start = parse_booking_date(booking_date)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        # Users can live in another shard than the business, so no foreign key covers this
+        user_conn = get_read_db(max_staleness=0, region=user_region(user_id))
+        try:
+            user = user_conn.execute('SELECT 1 FROM users WHERE id = ?', (user_id,)).fetchone()
+        finally:
+            user_conn.close()
+        if user is None:
+            return jsonify({'error': 'User not found'}), 404
+        
+        conn = get_db(business_region(business_id))
+        try:
+            booking_id = reserve_slot(conn, user_id, business_id, service_id, start)
+        except SlotUnavailable as e:
+            conn.close()
+            return jsonify({'error': str(e)}), 409
+        conn.close()
+        
+        return jsonify({
+            'message': 'Booking confirmed!',
+            'booking_id': booking_id
+        }), 201
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/bookings/<int:booking_id>/cancel', methods=['POST'])
+def cancel_booking(booking_id):
+    """Cancel a booking and release its slot"""
+    try:
+        data = request.get_json(silent=True) or {}
+        user_id = data.get('user_id')
+        
+        if not user_id:
+            return jsonify({'error': 'User ID required'}), 400
+        
+        def cancel(conn, region):
+            cursor = conn.execute('''
+                UPDATE bookings SET status = 'cancelled'
+                WHERE id = ? AND user_id = ? AND status != 'cancelled'
+            ''', (booking_id, user_id))
+            conn.commit()
+            return cursor.rowcount
+        
+        # Bookings live in their business's shard
+        updated = write_by_id(booking_id, cancel)
+        
+        if not updated:
+            return jsonify({'error': 'Booking not found'}), 404
+        
+        return jsonify({'message': 'Booking cancelled'}), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/user/<int:user_id>/bookings', methods=['GET'])
+def get_user_bookings(user_id):
+    """Get a user's bookings"""
+    try:
+        def bookings_in(conn, region):
+            cursor = conn.execute('''
+                SELECT bk.id, bk.business_id, bk.service_id, bk.booking_date, bk.status,
+                       b.business_name, b.address, s.service_name, s.price
+                FROM bookings bk
+                JOIN businesses b ON bk.business_id = b.id
+                JOIN services s ON bk.service_id = s.id
+                WHERE bk.user_id = ?
+                ORDER BY bk.booking_date DESC
+                LIMIT 50
+            ''', (user_id,))
+            return [dict(row) for row in cursor.fetchall()]
+        
+        # Bookings live with their businesses, so gather from every shard
+        bookings = [booking for shard_bookings in scatter(bookings_in, max_staleness=0) for booking in shard_bookings]
+        bookings.sort(key=lambda booking: booking['booking_date'], reverse=True)
+        bookings = bookings[:50]
+        
+        return jsonify(bookings), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/bookings/next-available', methods=['POST'])
+def get_next_available():
+    """Find the earliest open slot at nearby businesses"""
+    try:
+        data = request.get_json()
+        user_lat = data.get('latitude')
+        user_lon = data.get('longitude')
+        
+        if user_lat is None or user_lon is None:
+            return jsonify({'error': 'Location is required'}), 400
+        
+        user_lat, user_lon = float(user_lat), float(user_lon)
+        radius_km = float(data.get('radius', 25))
+        limit = min(int(data.get('limit', 10)), 50)
+        
+        def next_in(conn, region):
+            return find_next_available(
+                conn, user_lat, user_lon,
+                radius_km=radius_km,
+                service_name=data.get('service_name'),
+                business_type=data.get('business_type'),
+                days=min(int(data.get('days', 7)), 30),
+                limit=limit
+            )
+        
+        target_regions = regions_for_bbox(*bounding_box(user_lat, user_lon, radius_km))
+        results = [result for shard_results in scatter(next_in, target_regions) for result in shard_results]
+        results.sort(key=lambda r: (r['next_available'], r['distance']))
+        results = results[:limit]
+        
+        return jsonify(results), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# ============ BATCH ============
+MAX_BATCH_REQUESTS = 10
+
+def _batch_profile(conn, user_id, params):
+    row = conn.execute('SELECT id, name, email, profile_photo FROM users WHERE id = ?', (user_id,)).fetchone()
+    if row is None:
+        raise LookupError('User not found')
+    return dict(row)
+
+def _batch_nearby(conn, user_id, params):
+    limit = params.get('limit')
+    listings, close = nearby_listings(
+        params.get('latitude'), params.get('longitude'),
+        params.get('radius', 50),
+        params.get('business_type'), user_id,
+        sort=params.get('sort', 'distance'),
+        limit=min(int(limit), MAX_RANKED_RESULTS) if limit else None,
+        conn=conn)
+    try:
+        return list(listings)
+    finally:
+        if close:
+            close()
+
+# op -> fn(conn, user_id, params) returning the response body
+BATCH_OPERATIONS = {
+    'profile': _batch_profile,
+    'notifications': lambda conn, user_id, params: user_notifications(conn, user_id),
+    'unread': lambda conn, user_id, params: {'count': unread_count(conn, user_id)},
+    'favorites': lambda conn, user_id, params: get_favorite_businesses(conn, user_id),
+    'nearby': _batch_nearby,
+}
+
+@app.route('/api/batch', methods=['POST'])
+def run_batch():
+    """Run several read requests for one user in a single round trip.
+
+    Body: {"user_id": 1, "requests": [{"op": "unread"}, {"op": "nearby", "latitude": ..., ...}]}
+    with ops from BATCH_OPERATIONS (nearby takes the same fields as
+    /api/businesses/nearby). Responses come back in request order as
+    {"op", "status", "body"}. All ops read one connection inside one read
+    transaction, so they see the same snapshot of the database (with
+    sharding, nearby still reads the other shards separately).
+    """
+    try:
+        data = request.get_json()
+        user_id = data.get('user_id')
+        sub_requests = data.get('requests')
+        
+        if not isinstance(sub_requests, list) or not sub_requests:
+            return jsonify({'error': 'requests must be a non-empty list'}), 400
+        if len(sub_requests) > MAX_BATCH_REQUESTS:
+            return jsonify({'error': f'At most {MAX_BATCH_REQUESTS} requests per batch'}), 400
+        
+        responses = []
+        conn = get_read_db(max_staleness=0, region=user_region(user_id))
+        try:
+            conn.execute('BEGIN')
+            for sub_request in sub_requests:
+                params = sub_request if isinstance(sub_request, dict) else {}
+                op = params.get('op')
+                operation = BATCH_OPERATIONS.get(op)
+                
+                if operation is None:
+                    status, body = 400, {'error': f'Unknown op: {op}'}
+                elif op != 'nearby' and not user_id:
+                    status, body = 400, {'error': 'user_id is required'}
+                else:
+                    try:
+                        status, body = 200, operation(conn, user_id, params)
+                    except LookupError as e:
+                        status, body = 404, {'error': str(e)}
+                    except Exception as e:
+                        status, body = 500, {'error': str(e)}
+                
+                responses.append({'op': op, 'status': status, 'body': body})
+        finally:
+            conn.rollback()
+            conn.close()
+        
+        return jsonify({'responses': responses}), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 # ============ ACTIVITY TRACKING ============
 @app.route('/api/user/activity', methods=['POST'])
 def track_activity():
@@ -779,17 +1411,17 @@ def track_activity():
 
 if __name__ == '__main__':
     # Initialize database
-    from database import init_db, add_sample_data
-    init_db()
+    create_app()
     add_sample_data()
+    start_scheduler()
     
     print("=" * 60)
     print(" BOOK&BLOOM Beta Server Starting... ")
     print("=" * 60)
     print("Server: http://localhost:5000")
-    print("Upload folders ready:")
-    print(f"  - Users: {os.path.join(UPLOAD_FOLDER, 'users')}")
-    print(f"  - Businesses: {os.path.join(UPLOAD_FOLDER, 'businesses')}")
+    print("Upload folders:")
+    print(f"  - Users: {get_upload_dir('users')}")
+    print(f"  - Businesses: {get_upload_dir('businesses')}")
     print("=" * 60)
     
     app.run(debug=True, host='0.0.0.0', port=5000)
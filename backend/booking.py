@@ -0,0 +1,306 @@
+import math
+import re
+import sqlite3
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+from geo import bounding_box, calculate_distance
+from sharding import next_id
+
+# Opening hours used to generate slots (no per-business hours are stored yet)
+OPEN_HOUR = 9
+CLOSE_HOUR = 18
+SLOT_STEP_MINUTES = 15
+DEFAULT_DURATION_MINUTES = 60
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Statuses that release the slot they were holding
+INACTIVE_STATUSES = ('cancelled',)
+
+# Slots and booking_date are wall-clock times in the business's own time zone,
+# taken from the province in its address ('..., Calgary, AB T2P 1B5')
+PROVINCE_TIMEZONES = {
+    'BC': 'America/Vancouver', 'AB': 'America/Edmonton', 'SK': 'America/Regina',
+    'MB': 'America/Winnipeg', 'ON': 'America/Toronto', 'QC': 'America/Toronto',
+    'NB': 'America/Moncton', 'NS': 'America/Halifax', 'PE': 'America/Halifax',
+    'NL': 'America/St_Johns', 'YT': 'America/Whitehorse', 'NT': 'America/Yellowknife',
+    'NU': 'America/Iqaluit',
+}
+# Rough longitude bands for addresses without a province, west to east
+LONGITUDE_TIMEZONES = (
+    (-120.0, 'America/Vancouver'), (-110.0, 'America/Edmonton'), (-101.5, 'America/Regina'),
+    (-90.0, 'America/Winnipeg'), (-64.0, 'America/Toronto'), (-57.5, 'America/Halifax'),
+)
+DEFAULT_TIMEZONE = 'America/Toronto'
+ADDRESS_PROVINCE = re.compile(r',\s*([A-Za-z]{2})(?:\s+[A-Za-z]\d[A-Za-z]|\s*$)')
+
+
+class SlotUnavailable(Exception):
+    """Raised when a requested slot is already taken or outside opening hours"""
+
+
+def parse_duration(duration):
+    """Convert a free-text service duration ('60 min', '1h 30m', '90') to minutes"""
+    if duration is None:
+        return DEFAULT_DURATION_MINUTES
+    if isinstance(duration, (int, float)):
+        return int(duration) if duration > 0 else DEFAULT_DURATION_MINUTES
+
+    text = str(duration).strip().lower()
+    hours = re.search(r'(\d+(?:\.\d+)?)\s*h', text)
+    minutes = re.search(r'(\d+)\s*m', text)
+    total = 0
+    if hours:
+        total += int(float(hours.group(1)) * 60)
+    if minutes:
+        total += int(minutes.group(1))
+    if not hours and not minutes:
+        plain = re.search(r'\d+', text)
+        if plain:
+            total = int(plain.group(0))
+    return total if total > 0 else DEFAULT_DURATION_MINUTES
+
+
+def business_timezone(address=None, longitude=None):
+    """Time zone name for a business, from its address's province or else its longitude"""
+    match = ADDRESS_PROVINCE.search(address or '')
+    if match and match.group(1).upper() in PROVINCE_TIMEZONES:
+        return PROVINCE_TIMEZONES[match.group(1).upper()]
+    if longitude is not None:
+        for limit, timezone in LONGITUDE_TIMEZONES:
+            if longitude < limit:
+                return timezone
+        return 'America/St_Johns'
+    return DEFAULT_TIMEZONE
+
+
+def business_now(address=None, longitude=None):
+    """Current wall-clock time at the business, naive like the stored booking dates"""
+    return datetime.now(ZoneInfo(business_timezone(address, longitude))).replace(tzinfo=None)
+
+
+def parse_booking_date(value):
+    """Parse an ISO-ish booking timestamp and normalise it to the stored format"""
+    value = str(value).strip().replace('T', ' ').rstrip('Z')
+    for fmt in (DATE_FORMAT, '%Y-%m-%d %H:%M'):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    raise ValueError('Invalid booking date. Use YYYY-MM-DD HH:MM')
+
+
+def _day_bounds(day):
+    start = datetime(day.year, day.month, day.day, OPEN_HOUR)
+    end = datetime(day.year, day.month, day.day, CLOSE_HOUR)
+    return start, end
+
+
+def _load_busy_intervals(cursor, business_ids, window_start, window_end):
+    """Fetch active bookings for several businesses in one indexed range scan"""
+    busy = {business_id: [] for business_id in business_ids}
+    if not business_ids:
+        return busy
+
+    # Bookings starting up to a day before the window may still overlap it
+    lookback = window_start - timedelta(days=1)
+    placeholders = ','.join('?' * len(business_ids))
+    cursor.execute(f'''
+        SELECT bk.business_id, bk.booking_date, s.duration
+        FROM bookings bk
+        LEFT JOIN services s ON bk.service_id = s.id
+        WHERE bk.business_id IN ({placeholders})
+        AND bk.booking_date >= ? AND bk.booking_date < ?
+        AND bk.status NOT IN ({','.join('?' * len(INACTIVE_STATUSES))})
+    ''', (*business_ids, lookback.strftime(DATE_FORMAT), window_end.strftime(DATE_FORMAT),
+          *INACTIVE_STATUSES))
+
+    for row in cursor.fetchall():
+        start = datetime.strptime(row['booking_date'], DATE_FORMAT)
+        end = start + timedelta(minutes=parse_duration(row['duration']))
+        if end > window_start:
+            busy[row['business_id']].append((start, end))
+
+    for intervals in busy.values():
+        intervals.sort()
+    return busy
+
+
+def _overlaps(start, end, intervals):
+    for busy_start, busy_end in intervals:
+        if busy_start >= end:
+            break
+        if busy_end > start:
+            return True
+    return False
+
+
+def _free_slots(day, duration_minutes, intervals, not_before=None, limit=None):
+    """Walk the day's slot grid and yield start times that fit between bookings"""
+    open_at, close_at = _day_bounds(day)
+    step = timedelta(minutes=SLOT_STEP_MINUTES)
+    length = timedelta(minutes=duration_minutes)
+    slot = open_at
+
+    if not_before and not_before > slot:
+        # Round up to the next slot boundary
+        offset = (not_before - open_at).total_seconds() / step.total_seconds()
+        slot = open_at + step * math.ceil(offset)
+
+    found = 0
+    while slot + length <= close_at:
+        if not _overlaps(slot, slot + length, intervals):
+            yield slot
+            found += 1
+            if limit and found >= limit:
+                return
+        slot += step
+
+
+def get_service(cursor, business_id, service_id):
+    cursor.execute('''
+        SELECT s.id, s.business_id, s.service_name, s.price, s.duration, b.address, b.longitude
+        FROM services s
+        JOIN businesses b ON s.business_id = b.id
+        WHERE s.id = ? AND s.business_id = ?
+    ''', (service_id, business_id))
+    return cursor.fetchone()
+
+
+def get_available_slots(conn, business_id, service_id, day=None):
+    """List open start times for one service on one day (default: today at the business)"""
+    cursor = conn.cursor()
+    service = get_service(cursor, business_id, service_id)
+    if not service:
+        return None
+
+    now = business_now(service['address'], service['longitude'])
+    day = day or now
+    open_at, close_at = _day_bounds(day)
+    busy = _load_busy_intervals(cursor, [business_id], open_at, close_at)
+    duration = parse_duration(service['duration'])
+    slots = _free_slots(day, duration, busy[business_id], not_before=now)
+
+    return {
+        'business_id': business_id,
+        'service_id': service_id,
+        'service_name': service['service_name'],
+        'duration': duration,
+        'date': day.strftime('%Y-%m-%d'),
+        'slots': [slot.strftime('%H:%M') for slot in slots]
+    }
+
+
+def reserve_slot(conn, user_id, business_id, service_id, start):
+    """Atomically book a slot; raises SlotUnavailable if it is no longer free.
+
+    BEGIN IMMEDIATE takes SQLite's write lock before the availability check, so
+    concurrent gunicorn workers serialise here instead of both seeing a free
+    slot. The partial unique index on (business_id, booking_date) backs this up
+    for identical start times.
+    """
+    cursor = conn.cursor()
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        service = get_service(cursor, business_id, service_id)
+        if not service:
+            raise SlotUnavailable('Service not found for this business')
+
+        end = start + timedelta(minutes=parse_duration(service['duration']))
+        open_at, close_at = _day_bounds(start)
+        if start < open_at or end > close_at:
+            raise SlotUnavailable('Requested time is outside opening hours')
+        if start < business_now(service['address'], service['longitude']):
+            raise SlotUnavailable('Requested time is in the past')
+
+        busy = _load_busy_intervals(cursor, [business_id], start, end)
+        if _overlaps(start, end, busy[business_id]):
+            raise SlotUnavailable('This time slot is already booked')
+
+        try:
+            cursor.execute('''
+                INSERT INTO bookings (id, user_id, business_id, service_id, booking_date, status)
+                VALUES (?, ?, ?, ?, ?, 'confirmed')
+            ''', (next_id(conn, 'bookings'), user_id, business_id, service_id, start.strftime(DATE_FORMAT)))
+        except sqlite3.IntegrityError:
+            raise SlotUnavailable('This time slot is already booked')
+
+        booking_id = cursor.lastrowid
+        conn.commit()
+        return booking_id
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def find_next_available(conn, latitude, longitude, radius_km=25, service_name=None,
+                        business_type=None, days=7, limit=10):
+    """Earliest open slot for each nearby business, using one bookings query in total"""
+    cursor = conn.cursor()
+
+    # Bounding box prefilter before the exact haversine check
+    min_lat, max_lat, min_lon, max_lon = bounding_box(latitude, longitude, radius_km)
+    query = '''
+        SELECT b.id, b.business_name, b.business_type, b.address, b.latitude, b.longitude,
+               s.id as service_id, s.service_name, s.price, s.duration
+        FROM businesses b
+        JOIN services s ON s.business_id = b.id
+        WHERE b.verified = 1
+        AND b.latitude BETWEEN ? AND ?
+        AND b.longitude BETWEEN ? AND ?
+    '''
+    params = [min_lat, max_lat, min_lon, max_lon]
+    if business_type:
+        query += ' AND b.business_type = ?'
+        params.append(business_type)
+    if service_name:
+        query += ' AND s.service_name LIKE ?'
+        params.append(f'%{service_name}%')
+    query += ' ORDER BY b.id, s.id'
+    cursor.execute(query, params)
+
+    # One service per business: the first match, with the time where it is
+    candidates = {}
+    for row in cursor.fetchall():
+        if row['id'] in candidates:
+            continue
+        distance = calculate_distance(latitude, longitude, row['latitude'], row['longitude'])
+        if distance <= radius_km:
+            zone = ZoneInfo(business_timezone(row['address'], row['longitude']))
+            candidates[row['id']] = (dict(row), distance, zone, datetime.now(zone).replace(tzinfo=None))
+    if not candidates:
+        return []
+
+    # One window covering every business's local days
+    today = {business_id: datetime(now.year, now.month, now.day)
+             for business_id, (_, _, _, now) in candidates.items()}
+    window_start = min(today.values())
+    window_end = max(today.values()) + timedelta(days=days)
+    busy = _load_busy_intervals(cursor, list(candidates), window_start, window_end)
+
+    results = []
+    for business_id, (biz, distance, zone, now) in candidates.items():
+        duration = parse_duration(biz['duration'])
+        for offset in range(days):
+            day = today[business_id] + timedelta(days=offset)
+            slot = next(_free_slots(day, duration, busy[business_id], not_before=now, limit=1), None)
+            if slot:
+                # Local times from different zones aren't comparable; order by the instant
+                instant = slot.replace(tzinfo=zone).astimezone(timezone.utc)
+                results.append((instant, distance, {
+                    'business_id': business_id,
+                    'business_name': biz['business_name'],
+                    'business_type': biz['business_type'],
+                    'address': biz['address'],
+                    'service_id': biz['service_id'],
+                    'service_name': biz['service_name'],
+                    'price': biz['price'],
+                    'duration': duration,
+                    'distance': distance,
+                    'next_available': slot.strftime(DATE_FORMAT),
+                    'timezone': zone.key
+                }))
+                break
+
+    results.sort(key=lambda result: result[:2])
+    return [result for _, _, result in results[:limit]]
@@ -1,20 +1,146 @@
 import sqlite3
 import os
+import threading
+import time
 from datetime import datetime
+from urllib.request import pathname2url
 
-DATABASE_PATH = os.path.join(os.path.dirname(__file__), '..', 'database.db')
+try:
+    import fcntl
+except ImportError:  # Windows: snapshot refreshes are only coordinated within a process
+    fcntl = None
 
-def get_db():
-    """Get database connection"""
-    conn = sqlite3.connect(DATABASE_PATH)
+DATABASE_PATH = os.environ.get('DATABASE_PATH', os.path.join(os.path.dirname(__file__), '..', 'database.db'))
+
+# Seconds a connection waits on a locked database before raising
+DB_TIMEOUT = float(os.environ.get('DB_TIMEOUT', 10))
+
+# Optional regional sharding (see sharding.py); off unless SHARDING=1
+SHARDING_ENABLED = os.environ.get('SHARDING', '0') == '1'
+SHARD_DIR = os.environ.get('SHARD_DIR', os.path.join(os.path.dirname(__file__), '..', 'shards'))
+
+def db_path(region=None):
+    """File backing a region's shard; the primary database.db when region is None or sharding is off"""
+    if region is None or not SHARDING_ENABLED:
+        return DATABASE_PATH
+    return os.path.join(SHARD_DIR, f'{region}.db')
+
+def get_db(region=None):
+    """Get database connection.
+
+    Each call opens its own connection, so callers on different threads
+    (gthread workers) never share one. With sharding on, region selects
+    the shard file.
+    """
+    conn = sqlite3.connect(db_path(region), timeout=DB_TIMEOUT)
     conn.row_factory = sqlite3.Row
     return conn
 
-def init_db():
-    """Initialize database with tables"""
-    conn = get_db()
-    cursor = conn.cursor()
+# Seconds a read snapshot may lag the primary; 0 reads the primary directly
+READ_SNAPSHOT_MAX_AGE = float(os.environ.get('READ_SNAPSHOT_MAX_AGE', 0))
+_snapshot_lock = threading.Lock()
+# Regions with a snapshot refresh thread running in this process
+_refreshing = set()
+
+def _read_uri(path, immutable=False):
+    uri = 'file:' + pathname2url(os.path.abspath(path)) + '?mode=ro'
+    if immutable:
+        uri += '&immutable=1'
+    return uri
+
+def refresh_read_snapshot(region=None):
+    """Copy the primary into the read snapshot file with the online backup API.
+
+    The copy is written to a temp file and swapped in with os.replace, so
+    readers holding the previous snapshot keep a consistent view.
+    """
+    snapshot_path = db_path(region) + '.snapshot'
+    tmp_path = f'{snapshot_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    source = get_db(region)
+    target = sqlite3.connect(tmp_path)
+    try:
+        source.backup(target)
+        # The copy is opened immutable, so it must not depend on WAL side files
+        target.execute('PRAGMA journal_mode=DELETE')
+    finally:
+        target.close()
+        source.close()
+    os.replace(tmp_path, snapshot_path)
+    return snapshot_path
+
+def _snapshot_age(snapshot_path):
+    try:
+        return time.time() - os.path.getmtime(snapshot_path)
+    except OSError:
+        return float('inf')
+
+def _refresh_snapshot_once(region, max_age):
+    """Refresh the snapshot unless another process is already doing it or just did"""
+    snapshot_path = db_path(region) + '.snapshot'
+    try:
+        with open(snapshot_path + '.lock', 'a') as lock_file:
+            if fcntl:
+                try:
+                    # Released when the file is closed, including if the worker dies
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return
+            if _snapshot_age(snapshot_path) > max_age / 2:
+                refresh_read_snapshot(region)
+    except Exception as e:
+        print(f'[database] read snapshot refresh failed: {e}')
+    finally:
+        with _snapshot_lock:
+            _refreshing.discard(region)
+
+def _fresh_snapshot(max_age, region=None):
+    """Path of a read snapshot at most max_age seconds old, or None to read the primary.
+
+    Once the snapshot is half max_age old a background thread refreshes it,
+    so requests keep reading the current copy instead of waiting on the
+    backup. Only one process refreshes a given file at a time (a flock on
+    <snapshot>.lock). Until a copy exists, or if refreshing falls behind,
+    reads go to the primary, which in WAL mode doesn't wait on writers either.
+    """
+    snapshot_path = db_path(region) + '.snapshot'
+    age = _snapshot_age(snapshot_path)
+    if age > max_age / 2:
+        with _snapshot_lock:
+            start = region not in _refreshing
+            _refreshing.add(region)
+        if start:
+            threading.Thread(target=_refresh_snapshot_once, args=(region, max_age),
+                             name='read-snapshot', daemon=True).start()
+    return snapshot_path if age <= max_age else None
+
+def get_read_db(max_staleness=None, region=None):
+    """Get a read-only connection for queries that never write.
+
+    With READ_SNAPSHOT_MAX_AGE = 0 (the default) this is a mode=ro connection
+    to the primary. In WAL mode it reads the last committed state and never
+    waits on a writer. With READ_SNAPSHOT_MAX_AGE > 0 it reads an immutable
+    copy of the primary that is at most that many seconds old, so heavy
+    discovery queries don't touch the primary file at all. Pass
+    max_staleness to tighten the bound for one call (0 = always primary).
+    region selects a shard the same way as get_db().
+    """
+    staleness = READ_SNAPSHOT_MAX_AGE
+    if max_staleness is not None:
+        staleness = min(staleness, max_staleness)
+    
+    snapshot_path = _fresh_snapshot(staleness, region) if staleness > 0 else None
+    if snapshot_path:
+        uri = _read_uri(snapshot_path, immutable=True)
+    else:
+        uri = _read_uri(db_path(region))
     
+    conn = sqlite3.connect(uri, uri=True, timeout=DB_TIMEOUT)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA query_only = ON')
+    return conn
+
+def _create_tables(cursor):
+    """Migration 1: base schema"""
     # Users table (with profile photo)
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS users (
@@ -132,8 +258,215 @@ def init_db():
         )
     ''')
     
-    conn.commit()
-    conn.close()
+    # Bookings are looked up by business and time range; the partial unique
+    # index stops two active bookings claiming the same start time
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_bookings_business_date ON bookings (business_id, booking_date)')
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_bookings_active_slot
+        ON bookings (business_id, booking_date)
+        WHERE status != 'cancelled'
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_bookings_user ON bookings (user_id)')
+
+def _add_location_index(cursor):
+    """Migration 2: range scans on business coordinates (viewport, nearby)"""
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_businesses_location ON businesses (latitude, longitude)')
+
+def _add_maintenance(cursor):
+    """Migration 3: maintenance job bookkeeping and notification expiry index"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS maintenance_runs (
+            job TEXT PRIMARY KEY,
+            started_at REAL,
+            finished_at REAL,
+            duration REAL,
+            reclaimed_bytes INTEGER,
+            status TEXT,
+            detail TEXT
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_notifications_read_created ON notifications (is_read, created_at)')
+
+def _add_shard_directory(cursor):
+    """Migration 4: home region of users/businesses moved by the shard rebalancer"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS shard_directory (
+            entity TEXT NOT NULL,
+            entity_id INTEGER NOT NULL,
+            region TEXT NOT NULL,
+            moved_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (entity, entity_id)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_notifications_user ON notifications (user_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_activity_user ON user_activity (user_id, user_type)')
+
+def _add_geocode_cache(cursor):
+    """Migration 5: resolved geocoding queries, and IP lookups over recent activity"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS geocode_cache (
+            query TEXT PRIMARY KEY,
+            latitude REAL NOT NULL,
+            longitude REAL NOT NULL,
+            label TEXT,
+            source TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_activity_ip ON user_activity (ip_address)')
+
+def _add_popularity(cursor):
+    """Migration 6: per-business popularity counters for ranking, kept up to date incrementally"""
+    # One row per (business, database the counted rows live in), summed when read
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS business_popularity (
+            business_id INTEGER NOT NULL,
+            source_db TEXT NOT NULL,
+            favorites INTEGER NOT NULL DEFAULT 0,
+            bookings INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (business_id, source_db)
+        )
+    ''')
+    # Highest row id already counted, per source table and database
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS popularity_watermarks (
+            source_db TEXT NOT NULL,
+            source TEXT NOT NULL,
+            last_id INTEGER NOT NULL,
+            PRIMARY KEY (source_db, source)
+        )
+    ''')
+
+def _add_photo_metadata(cursor):
+    """Migration 7: gallery metadata, resized variants and one cover photo per business"""
+    for column in ('width INTEGER', 'height INTEGER', 'bytes INTEGER', 'content_type TEXT',
+                   'is_cover INTEGER NOT NULL DEFAULT 0'):
+        cursor.execute(f'ALTER TABLE business_photos ADD COLUMN {column}')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_business_photos_business ON business_photos (business_id, id)')
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_business_photos_cover
+        ON business_photos (business_id) WHERE is_cover = 1
+    ''')
+    # business_id is repeated here so shard rebalancing moves variants with their business
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS business_photo_variants (
+            photo_id INTEGER NOT NULL,
+            business_id INTEGER NOT NULL,
+            variant TEXT NOT NULL,
+            path TEXT NOT NULL,
+            width INTEGER NOT NULL,
+            height INTEGER NOT NULL,
+            bytes INTEGER NOT NULL,
+            PRIMARY KEY (photo_id, variant),
+            FOREIGN KEY (photo_id) REFERENCES business_photos(id)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_photo_variants_business ON business_photo_variants (business_id)')
+
+def _add_business_search(cursor):
+    """Migration 8: full-text index over business name, type, services and address for name search"""
+    # Columns in ranking.FIELD_WEIGHTS order; rowid is the business id. Triggers keep it in
+    # step with every write path, including rows the shard rebalancer copies and deletes.
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS business_search USING fts5(
+            business_name, business_type, services, address,
+            tokenize = 'unicode61 remove_diacritics 2'
+        )
+    ''')
+    cursor.execute('''
+        INSERT OR REPLACE INTO business_search (rowid, business_name, business_type, services, address)
+        SELECT b.id, b.business_name, b.business_type,
+               (SELECT GROUP_CONCAT(s.service_name, ' ') FROM services s WHERE s.business_id = b.id), b.address
+        FROM businesses b
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS business_search_insert AFTER INSERT ON businesses BEGIN
+            INSERT OR REPLACE INTO business_search (rowid, business_name, business_type, services, address)
+            VALUES (NEW.id, NEW.business_name, NEW.business_type,
+                    (SELECT GROUP_CONCAT(service_name, ' ') FROM services WHERE business_id = NEW.id), NEW.address);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS business_search_update
+        AFTER UPDATE OF business_name, business_type, address ON businesses BEGIN
+            UPDATE business_search
+            SET business_name = NEW.business_name, business_type = NEW.business_type, address = NEW.address
+            WHERE rowid = NEW.id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS business_search_delete AFTER DELETE ON businesses BEGIN
+            DELETE FROM business_search WHERE rowid = OLD.id;
+        END
+    ''')
+    for event, row in (('INSERT', 'NEW'), ('UPDATE OF service_name', 'NEW'), ('DELETE', 'OLD')):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS business_search_services_{event.split()[0].lower()}
+            AFTER {event} ON services BEGIN
+                UPDATE business_search
+                SET services = (SELECT GROUP_CONCAT(service_name, ' ') FROM services WHERE business_id = {row}.business_id)
+                WHERE rowid = {row}.business_id;
+            END
+        ''')
+
+# Applied in order; entry N upgrades the schema to user_version N
+MIGRATIONS = [
+    _create_tables,
+    _add_location_index,
+    _add_maintenance,
+    _add_shard_directory,
+    _add_geocode_cache,
+    _add_popularity,
+    _add_photo_metadata,
+    _add_business_search,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def get_schema_version(conn):
+    """Read the schema version stored in the database header"""
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def ensure_schema(region=None):
+    """Apply pending migrations once; a cheap no-op when the schema is current.
+
+    Safe to call from every gunicorn worker at once: the version is
+    re-checked under BEGIN IMMEDIATE, so only the first caller runs DDL.
+    Returns True if any migration was applied.
+    """
+    conn = get_db(region)
+    try:
+        if get_schema_version(conn) >= SCHEMA_VERSION:
+            return False
+        
+        # Only takes effect on a brand-new file; older ones are converted by
+        # the convert_auto_vacuum maintenance job
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        
+        # WAL lets readers on other threads/workers proceed while one writer commits
+        conn.execute('PRAGMA journal_mode=WAL')
+        
+        conn.execute('BEGIN IMMEDIATE')
+        version = get_schema_version(conn)
+        if version >= SCHEMA_VERSION:
+            conn.rollback()
+            return False
+        
+        cursor = conn.cursor()
+        for migration in MIGRATIONS[version:]:
+            migration(cursor)
+        cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        conn.commit()
+        return True
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def init_db():
+    """Initialize database with tables"""
+    ensure_schema()
     print("Database initialized successfully!")
 
 def add_sample_data():
@@ -0,0 +1,147 @@
+from collections import OrderedDict
+
+import database
+import sharding
+from cache import LRUCache
+from photos import COVER_JOIN, COVER_SELECT
+
+# Business fields safe to send to clients (no password_hash / verification_doc)
+BUSINESS_SNAPSHOT_COLUMNS = (
+    'id', 'business_name', 'owner_name', 'email', 'phone', 'business_type',
+    'address', 'latitude', 'longitude', 'website', 'verified', 'created_at'
+)
+
+SNAPSHOT_TTL_SECONDS = 300
+MAX_SNAPSHOTS = 5000
+MAX_CACHED_USERS = 10000
+
+
+class BusinessSnapshotCache:
+    """Shared cache of business listings (with their services string) keyed by id.
+
+    Entries expire after ttl seconds so edits made by other workers show up
+    without any cross-process signalling; local writers call invalidate().
+    """
+
+    def __init__(self, ttl=SNAPSHOT_TTL_SECONDS, maxsize=MAX_SNAPSHOTS):
+        self._snapshots = LRUCache(maxsize, ttl=ttl)
+
+    def get_many(self, conn, business_ids):
+        """Return {id: snapshot} for the ids that exist, loading misses in one query"""
+        found = self._snapshots.get_many(business_ids)
+        missing = [business_id for business_id in business_ids if business_id not in found]
+        if missing:
+            loaded = self._load(conn, missing)
+            self._snapshots.put_many(loaded)
+            found.update(loaded)
+        return found
+
+    def invalidate(self, business_id):
+        self._snapshots.pop(business_id)
+
+    def clear(self):
+        self._snapshots.clear()
+
+    def _load(self, conn, business_ids):
+        if sharding.enabled():
+            # conn is the caller's shard; each business is read from its own
+            by_region = {}
+            for business_id in business_ids:
+                by_region.setdefault(sharding.business_region(business_id), []).append(business_id)
+            loaded = {}
+            for region, ids in by_region.items():
+                shard = database.get_read_db(region=region)
+                try:
+                    loaded.update(self._load_from(shard, ids))
+                finally:
+                    shard.close()
+            return loaded
+        return self._load_from(conn, business_ids)
+
+    @staticmethod
+    def _load_from(conn, business_ids):
+        columns = ', '.join(f'b.{column}' for column in BUSINESS_SNAPSHOT_COLUMNS)
+        placeholders = ','.join('?' * len(business_ids))
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT {columns}, {COVER_SELECT},
+                   GROUP_CONCAT(s.service_name || ' ($' || s.price || ')') as services
+            FROM businesses b
+            {COVER_JOIN}
+            LEFT JOIN services s ON b.id = s.business_id
+            WHERE b.id IN ({placeholders})
+            GROUP BY b.id
+        ''', business_ids)
+        return {row['id']: dict(row) for row in cursor.fetchall()}
+
+
+class FavoritesCache:
+    """Per-user map of favorited business id -> favorites row id.
+
+    A cached entry is trusted while (COUNT(*), MAX(id)) of the user's
+    favorites rows still matches. That check is an index-only lookup on the
+    UNIQUE(user_id, business_id) index, and because favorites ids are never
+    reused it changes on any add or remove made by another worker.
+    """
+
+    def __init__(self, maxsize=MAX_CACHED_USERS):
+        self._users = LRUCache(maxsize)
+
+    @staticmethod
+    def _fingerprint(favorite_ids):
+        return (len(favorite_ids), max(favorite_ids.values(), default=None))
+
+    def get_ids(self, conn, user_id):
+        """Favorited business ids for a user, oldest first"""
+        cursor = conn.cursor()
+        cursor.execute('SELECT COUNT(*), MAX(id) FROM favorites WHERE user_id = ?', (user_id,))
+        current = tuple(cursor.fetchone())
+
+        cached = self._users.get(user_id)
+        if cached is not None and self._fingerprint(cached) == current:
+            return list(cached)
+
+        cursor.execute('SELECT id, business_id FROM favorites WHERE user_id = ? ORDER BY id', (user_id,))
+        favorite_ids = OrderedDict((row['business_id'], row['id']) for row in cursor.fetchall())
+        self._users.put(user_id, favorite_ids)
+        return list(favorite_ids)
+
+    def added(self, user_id, business_id, favorite_id):
+        """Record a favorite this process just inserted"""
+        cached = self._users.get(user_id)
+        if cached is not None:
+            # Copy instead of mutating a map other threads may be reading
+            favorite_ids = OrderedDict(cached)
+            favorite_ids[business_id] = favorite_id
+            self._users.put(user_id, favorite_ids)
+
+    def removed(self, user_id, business_id):
+        """Record a favorite this process just deleted"""
+        cached = self._users.get(user_id)
+        if cached is not None and business_id in cached:
+            favorite_ids = OrderedDict(cached)
+            del favorite_ids[business_id]
+            self._users.put(user_id, favorite_ids)
+
+    def forget(self, user_id):
+        self._users.pop(user_id)
+
+    def clear(self):
+        self._users.clear()
+
+
+business_snapshots = BusinessSnapshotCache()
+user_favorites = FavoritesCache()
+
+
+def get_favorite_businesses(conn, user_id):
+    """A user's favorite businesses as listing snapshots, without a join per read"""
+    business_ids = user_favorites.get_ids(conn, user_id)
+    snapshots = business_snapshots.get_many(conn, business_ids)
+    return [snapshots[business_id] for business_id in business_ids if business_id in snapshots]
+
+
+def favorited_among(conn, user_id, business_ids):
+    """Subset of business_ids the user has favorited"""
+    favorites = set(user_favorites.get_ids(conn, user_id))
+    return {business_id for business_id in business_ids if business_id in favorites}
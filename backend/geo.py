@@ -0,0 +1,25 @@
+import math
+
+EARTH_RADIUS_KM = 6371
+
+
+def calculate_distance(lat1, lon1, lat2, lon2):
+    """Calculate distance between two points using Haversine formula"""
+    lat1_rad = math.radians(lat1)
+    lat2_rad = math.radians(lat2)
+    delta_lat = math.radians(lat2 - lat1)
+    delta_lon = math.radians(lon2 - lon1)
+
+    a = math.sin(delta_lat/2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(delta_lon/2)**2
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
+
+    distance = EARTH_RADIUS_KM * c
+    return round(distance, 2)
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """Lat/lon box that contains every point within radius_km of the centre"""
+    lat_delta = radius_km / 111.0
+    lon_delta = radius_km / (111.0 * max(math.cos(math.radians(latitude)), 0.01))
+    return (latitude - lat_delta, latitude + lat_delta,
+            longitude - lon_delta, longitude + lon_delta)
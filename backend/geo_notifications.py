@@ -0,0 +1,118 @@
+import os
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timedelta
+
+from cache import LRUCache
+from geo import bounding_box, calculate_distance
+from sharding import next_id, regions_for_bbox, scatter
+
+NOTIFY_RADIUS_KM = 10
+# Businesses registered within this window count as new for users arriving nearby
+NEW_BUSINESS_DAYS = int(os.environ.get('NEW_BUSINESS_DAYS', 30))
+# Smaller moves are still covered by the last match (and by check_nearby_users)
+MIN_MOVE_KM = 1.0
+MAX_NOTIFICATIONS_PER_MOVE = 20
+MAX_CACHED_USERS = 10000
+
+
+class SeenBusinesses:
+    """Per-user sorted array of business ids the user already has a notification for.
+
+    An entry is trusted while (COUNT(*), MAX(id)) of the user's
+    notifications rows still matches, an index-only lookup on
+    idx_notifications_user that changes whenever any worker inserts or
+    expires one of them.
+    """
+
+    def __init__(self, maxsize=MAX_CACHED_USERS):
+        self._users = LRUCache(maxsize)
+
+    @staticmethod
+    def _fingerprint(conn, user_id):
+        row = conn.execute('SELECT COUNT(*), MAX(id) FROM notifications WHERE user_id = ?', (user_id,)).fetchone()
+        return tuple(row)
+
+    def get(self, conn, user_id):
+        current = self._fingerprint(conn, user_id)
+        cached = self._users.get(user_id)
+        if cached is not None and cached[0] == current:
+            return cached[1]
+
+        rows = conn.execute('SELECT DISTINCT business_id FROM notifications WHERE user_id = ?', (user_id,))
+        seen = array('q', sorted(row[0] for row in rows))
+        self._users.put(user_id, (current, seen))
+        return seen
+
+    def add(self, conn, user_id, seen, business_ids):
+        """Record business ids this process just notified the user about"""
+        merged = array('q', sorted(set(seen).union(business_ids)))
+        self._users.put(user_id, (self._fingerprint(conn, user_id), merged))
+
+    def forget(self, user_id):
+        self._users.pop(user_id)
+
+
+seen_businesses = SeenBusinesses()
+
+
+def _contains(sorted_ids, business_id):
+    index = bisect_left(sorted_ids, business_id)
+    return index < len(sorted_ids) and sorted_ids[index] == business_id
+
+
+def moved(previous_lat, previous_lon, latitude, longitude):
+    """True if the user has no stored location yet or moved at least MIN_MOVE_KM"""
+    if previous_lat is None or previous_lon is None:
+        return True
+    return calculate_distance(previous_lat, previous_lon, latitude, longitude) >= MIN_MOVE_KM
+
+
+def notify_new_location(conn, user_id, latitude, longitude, radius_km=NOTIFY_RADIUS_KM):
+    """Notify a user about recently registered businesses around their new location.
+
+    conn is a write connection to the user's shard. Candidates come from the
+    bounding box on idx_businesses_location, so the cost depends on how many
+    businesses are nearby rather than on the size of the table. Returns the
+    number of notifications created.
+    """
+    min_lat, max_lat, min_lon, max_lon = bounding_box(latitude, longitude, radius_km)
+    cutoff = (datetime.utcnow() - timedelta(days=NEW_BUSINESS_DAYS)).strftime('%Y-%m-%d %H:%M:%S')
+
+    def candidates_in(shard, region):
+        return shard.execute('''
+            SELECT id, business_name, latitude, longitude FROM businesses
+            WHERE latitude BETWEEN ? AND ? AND longitude BETWEEN ? AND ?
+            AND created_at >= ?
+        ''', (min_lat, max_lat, min_lon, max_lon, cutoff)).fetchall()
+
+    candidates = [row for rows in scatter(candidates_in, regions_for_bbox(min_lat, max_lat, min_lon, max_lon))
+                  for row in rows]
+    if not candidates:
+        return 0
+
+    seen = seen_businesses.get(conn, user_id)
+    matches = []
+    for row in candidates:
+        if _contains(seen, row['id']):
+            continue
+        distance = calculate_distance(latitude, longitude, row['latitude'], row['longitude'])
+        if distance <= radius_km:
+            matches.append((distance, row))
+    if not matches:
+        return 0
+
+    matches.sort(key=lambda match: match[0])
+    matches = matches[:MAX_NOTIFICATIONS_PER_MOVE]
+    changes_before = conn.total_changes
+    # NOT EXISTS guards against a concurrent login of the same user on another worker
+    conn.executemany('''
+        INSERT INTO notifications (id, user_id, business_id, title, message)
+        SELECT ?, ?, ?, ?, ?
+        WHERE NOT EXISTS (SELECT 1 FROM notifications WHERE user_id = ? AND business_id = ?)
+    ''', [(next_id(conn, 'notifications'), user_id, row['id'], "New Business Near You! 🎉",
+           f"{row['business_name']} opened {distance}km away from you!", user_id, row['id'])
+          for distance, row in matches])
+    conn.commit()
+    seen_businesses.add(conn, user_id, seen, [row['id'] for _, row in matches])
+    return conn.total_changes - changes_before
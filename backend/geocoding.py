@@ -0,0 +1,312 @@
+"""Offline geocoding for Canadian place names, postal codes and business addresses.
+
+Queries are resolved against the bundled gazetteer (data/gazetteer_ca.csv:
+cities, postal districts and a few forward sortation areas) plus the full
+street addresses of verified businesses, so no external service is involved.
+Resolved queries are kept in a small per-process LRU and in the
+geocode_cache table, which is read through read connections and written
+in batches from a background thread, so lookups never wait on the write
+lock. The gazetteer itself is read on first use rather than at import.
+"""
+import atexit
+import csv
+import ipaddress
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from datetime import datetime, timedelta
+from difflib import get_close_matches
+
+import database
+from cache import LRUCache
+from geo import calculate_distance
+from sharding import regions, scatter
+
+GAZETTEER_PATH = os.path.join(os.path.dirname(__file__), 'data', 'gazetteer_ca.csv')
+GEOCODE_CACHE_DAYS = int(os.environ.get('GEOCODE_CACHE_DAYS', 30))
+ADDRESS_REFRESH_SECONDS = 600
+RECENT_TTL_SECONDS = 600
+MAX_RECENT_QUERIES = 5000
+FUZZY_CUTOFF = 0.85
+# Resolved queries are written to geocode_cache once this many are queued or the oldest is this old
+CACHE_WRITE_BATCH = 50
+CACHE_WRITE_SECONDS = 60
+
+logger = logging.getLogger('app')
+
+PROVINCES = {
+    'AB': 'Alberta', 'BC': 'British Columbia', 'MB': 'Manitoba', 'NB': 'New Brunswick',
+    'NL': 'Newfoundland and Labrador', 'NS': 'Nova Scotia', 'NT': 'Northwest Territories',
+    'NU': 'Nunavut', 'ON': 'Ontario', 'PE': 'Prince Edward Island', 'QC': 'Quebec',
+    'SK': 'Saskatchewan', 'YT': 'Yukon',
+}
+POSTAL_CODE = re.compile(r'^([a-z]\d[a-z])(?: ?\d[a-z]\d)?$')
+ADDRESS_TAIL = re.compile(r'^([A-Za-z]{2})\s+([A-Za-z]\d[A-Za-z])')
+
+
+def normalize(text):
+    """Lowercase ASCII words: 'Montréal, QC' -> 'montreal qc', "St. John's" -> 'st johns'"""
+    text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode().lower()
+    text = re.sub(r"[.'’]", '', text)
+    text = re.sub(r'[^a-z0-9]+', ' ', text).strip()
+    return re.sub(r'\s*\bcanada$', '', text)
+
+
+def _place(label, latitude, longitude, source):
+    return {'label': label, 'latitude': round(latitude, 6), 'longitude': round(longitude, 6), 'source': source}
+
+
+class Gazetteer:
+    """In-memory index of the bundled places plus centroids learned from verified business addresses"""
+
+    def __init__(self, path=GAZETTEER_PATH):
+        self.path = path
+        self._places = None
+        self._postal = {}
+        self._cities = []
+        self._addresses = {}
+        self._learned = {}
+        self._addresses_loaded_at = None
+        self._lock = threading.Lock()
+
+    def _load_places(self):
+        """Read the bundled CSV the first time a lookup needs it"""
+        if self._places is not None:
+            return
+        with self._lock:
+            if self._places is not None:
+                return
+            places, postal, cities = {}, {}, []
+            with open(self.path, newline='', encoding='utf-8') as f:
+                for row in csv.DictReader(f):
+                    latitude, longitude = float(row['latitude']), float(row['longitude'])
+                    if row['kind'] == 'fsa':
+                        postal[row['name'].upper()] = _place(
+                            f"{row['name']} ({row['province']})", latitude, longitude, 'gazetteer')
+                        continue
+                    place = _place(f"{row['name']}, {row['province']}", latitude, longitude, 'gazetteer')
+                    cities.append(place)
+                    for key in (row['name'], f"{row['name']} {row['province']}",
+                                f"{row['name']} {PROVINCES[row['province']]}"):
+                        places[normalize(key)] = place
+            self._postal, self._cities = postal, cities
+            # Set last: other threads check it without the lock
+            self._places = places
+
+    def refresh_addresses(self, force=False):
+        """Rebuild the address index from verified businesses, at most every ADDRESS_REFRESH_SECONDS"""
+        loaded_at = self._addresses_loaded_at
+        if not force and loaded_at is not None and time.monotonic() - loaded_at < ADDRESS_REFRESH_SECONDS:
+            return
+
+        def addresses_in(conn, region):
+            return conn.execute('''
+                SELECT address, latitude, longitude FROM businesses
+                WHERE verified = 1 AND address IS NOT NULL AND latitude IS NOT NULL
+            ''').fetchall()
+
+        addresses, sums = {}, {}
+        for rows in scatter(addresses_in, regions()):
+            for row in rows:
+                self._learn(addresses, sums, row['address'], row['latitude'], row['longitude'])
+        with self._lock:
+            self._addresses = addresses
+            self._learned = self._centroids(sums)
+            self._addresses_loaded_at = time.monotonic()
+
+    @staticmethod
+    def _learn(addresses, sums, address, latitude, longitude):
+        """Record a full street address and add it to the centroid of its city and postal FSA"""
+        # Only '123 Yonge St, Toronto, ON M5C 1W4' -> city 'Toronto', province 'ON', FSA 'M5C'
+        parts = [part.strip() for part in address.split(',')]
+        if len(parts) < 3 or not all(parts):
+            return
+        match = ADDRESS_TAIL.match(parts[-1])
+        if not match or match.group(1).upper() not in PROVINCES:
+            return
+        key = normalize(address)
+        if key in addresses:
+            return
+        addresses[key] = _place(address, latitude, longitude, 'address')
+
+        city, province, fsa = parts[-2], match.group(1).upper(), match.group(2).upper()
+        for learned_key, label in ((normalize(city), f'{city}, {province}'),
+                                   (normalize(f'{city} {province}'), f'{city}, {province}'),
+                                   (fsa, f'{fsa} ({province})')):
+            entry = sums.setdefault(learned_key, [0.0, 0.0, 0, label])
+            entry[0] += latitude
+            entry[1] += longitude
+            entry[2] += 1
+
+    @staticmethod
+    def _centroids(sums):
+        return {key: (_place(label, lat_sum / count, lon_sum / count, 'address'), count)
+                for key, (lat_sum, lon_sum, count, label) in sums.items()}
+
+    def resolve(self, key):
+        """Best place for a normalized query, or None"""
+        self._load_places()
+        self.refresh_addresses()
+        with self._lock:
+            addresses, learned = self._addresses, self._learned
+
+        postal = POSTAL_CODE.match(key)
+        if postal:
+            fsa = postal.group(1).upper()
+            if fsa in self._postal:
+                return self._postal[fsa]
+            if fsa in learned:
+                return learned[fsa][0]
+            return self._postal.get(fsa[0])
+
+        # Bundled places win over anything learned from business addresses
+        if key in self._places:
+            return self._places[key]
+        if key in addresses:
+            return addresses[key]
+        if key in learned:
+            return learned[key][0]
+
+        # Typos and partial names, e.g. 'mississuaga' or 'st catherines'
+        candidates = list(self._places) + [name for name in learned if name.islower()]  # not FSAs
+        close = get_close_matches(key, candidates, n=1, cutoff=FUZZY_CUTOFF)
+        if close:
+            return self._places.get(close[0]) or learned[close[0]][0]
+        return None
+
+    def nearest_city(self, latitude, longitude):
+        self._load_places()
+        return min(self._cities, key=lambda place: calculate_distance(
+            latitude, longitude, place['latitude'], place['longitude']))
+
+
+gazetteer = Gazetteer()
+# Query -> place, with None cached for misses
+recent_lookups = LRUCache(MAX_RECENT_QUERIES, ttl=RECENT_TTL_SECONDS)
+_MISSING = object()
+
+# Resolved queries waiting for the next batch write to geocode_cache
+_pending_writes = {}
+_pending_since = None
+_flushing = False
+_pending_lock = threading.Lock()
+
+
+def _cache_cutoff():
+    return (datetime.utcnow() - timedelta(days=GEOCODE_CACHE_DAYS)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def geocode(query):
+    """Coordinates for a place name, postal code or business address, or None"""
+    key = normalize(query or '')
+    if not key:
+        return None
+    place = recent_lookups.get(key, _MISSING)
+    if place is not _MISSING:
+        return place
+
+    conn = database.get_read_db()
+    try:
+        row = conn.execute('''
+            SELECT label, latitude, longitude, source FROM geocode_cache
+            WHERE query = ? AND created_at >= ?
+        ''', (key, _cache_cutoff())).fetchone()
+    finally:
+        conn.close()
+    if row:
+        place = dict(row)
+    else:
+        place = gazetteer.resolve(key)
+        if place:
+            _queue_cache_write(key, place)
+
+    recent_lookups.put(key, place)
+    return place
+
+
+def _queue_cache_write(key, place):
+    global _pending_since, _flushing
+    with _pending_lock:
+        _pending_writes[key] = place
+        if _pending_since is None:
+            _pending_since = time.monotonic()
+        due = (len(_pending_writes) >= CACHE_WRITE_BATCH
+               or time.monotonic() - _pending_since >= CACHE_WRITE_SECONDS)
+        start = due and not _flushing
+        if start:
+            _flushing = True
+    if start:
+        threading.Thread(target=flush_cache_writes, name='geocode-cache', daemon=True).start()
+
+
+def flush_cache_writes():
+    """Write every queued lookup to geocode_cache in one transaction; returns how many"""
+    global _pending_since, _flushing
+    with _pending_lock:
+        batch = list(_pending_writes.items())
+        _pending_writes.clear()
+        _pending_since = None
+    try:
+        if not batch:
+            return 0
+        conn = database.get_db()
+        try:
+            conn.executemany('''
+                INSERT OR REPLACE INTO geocode_cache (query, latitude, longitude, label, source)
+                VALUES (?, ?, ?, ?, ?)
+            ''', [(key, place['latitude'], place['longitude'], place['label'], place['source'])
+                  for key, place in batch])
+            conn.commit()
+        finally:
+            conn.close()
+        return len(batch)
+    except Exception as e:
+        # Only a cache: the lookups are resolved again after a restart
+        logger.warning('geocode cache write failed: %s', e)
+        return 0
+    finally:
+        with _pending_lock:
+            _flushing = False
+
+
+# Whatever is still queued when a worker exits
+atexit.register(flush_cache_writes)
+
+
+def locate_ip(ip):
+    """City nearest to the last location reported from this IP address in user_activity.
+
+    Only the city's centroid is returned, never the reported coordinates,
+    which belong to whoever last used the address.
+    """
+    try:
+        address = ipaddress.ip_address((ip or '').strip())
+    except ValueError:
+        return None
+    if address.is_private or address.is_loopback:
+        return None
+
+    key = f'ip:{address}'
+    place = recent_lookups.get(key, _MISSING)
+    if place is not _MISSING:
+        return place
+
+    def last_seen(conn, region):
+        return conn.execute('''
+            SELECT latitude, longitude, timestamp FROM user_activity
+            WHERE ip_address = ? AND latitude IS NOT NULL AND longitude IS NOT NULL
+            ORDER BY id DESC LIMIT 1
+        ''', (str(address),)).fetchone()
+
+    rows = [row for row in scatter(last_seen, regions()) if row]
+    place = None
+    if rows:
+        row = max(rows, key=lambda r: r['timestamp'])
+        city = gazetteer.nearest_city(float(row['latitude']), float(row['longitude']))
+        place = _place(city['label'], city['latitude'], city['longitude'], 'ip')
+
+    recent_lookups.put(key, place)
+    return place
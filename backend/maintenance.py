@@ -0,0 +1,287 @@
+import logging
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+import database
+import sharding
+from ranking import recount_popularity, refresh_popularity
+
+BACKUP_DIR = os.environ.get('BACKUP_DIR', os.path.join(os.path.dirname(__file__), '..', 'backups'))
+BACKUP_KEEP = int(os.environ.get('BACKUP_KEEP', 7))
+NOTIFICATION_RETENTION_DAYS = int(os.environ.get('NOTIFICATION_RETENTION_DAYS', 30))
+
+# Flask's app.logger; create_app() points it at gunicorn's error log
+logger = logging.getLogger('app')
+
+# Rows deleted / pages freed per transaction, so writers are never held up for long
+DELETE_BATCH_SIZE = 500
+VACUUM_BATCH_PAGES = 256
+
+# How often each job runs, in seconds
+JOB_INTERVALS = {
+    'optimize': int(os.environ.get('MAINTENANCE_OPTIMIZE_INTERVAL', 60 * 60)),
+    'expire_notifications': int(os.environ.get('MAINTENANCE_EXPIRE_INTERVAL', 6 * 60 * 60)),
+    'incremental_vacuum': int(os.environ.get('MAINTENANCE_VACUUM_INTERVAL', 6 * 60 * 60)),
+    'backup': int(os.environ.get('MAINTENANCE_BACKUP_INTERVAL', 24 * 60 * 60)),
+    'refresh_popularity': int(os.environ.get('MAINTENANCE_POPULARITY_INTERVAL', 5 * 60)),
+    'recount_popularity': int(os.environ.get('MAINTENANCE_RECOUNT_INTERVAL', 24 * 60 * 60)),
+}
+SCHEDULER_TICK_SECONDS = 60
+
+
+def _freelist_bytes(conn):
+    page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+    free_pages = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    return page_size * free_pages
+
+
+def _file_bytes(region=None):
+    total = 0
+    for suffix in ('', '-wal'):
+        try:
+            total += os.path.getsize(database.db_path(region) + suffix)
+        except OSError:
+            pass
+    return total
+
+
+def backup(region=None):
+    """Hot backup with VACUUM INTO.
+
+    The copy is made inside a single read transaction, so writers carry on
+    and, unlike a stepped online backup, it never restarts when they commit.
+    """
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    prefix = f'{region}_' if region else 'database_'
+    target_path = os.path.join(BACKUP_DIR, f"{prefix}{datetime.now().strftime('%Y%m%d_%H%M%S')}.db")
+    tmp_path = target_path + '.tmp'
+
+    source = database.get_db(region)
+    try:
+        source.execute('VACUUM INTO ?', (tmp_path,))
+    finally:
+        source.close()
+    os.replace(tmp_path, target_path)
+
+    # Keep only the newest BACKUP_KEEP backups
+    backups = sorted(name for name in os.listdir(BACKUP_DIR) if name.startswith(prefix) and name.endswith('.db'))
+    for name in backups[:-BACKUP_KEEP]:
+        os.remove(os.path.join(BACKUP_DIR, name))
+
+    return 0, f'{os.path.basename(target_path)} ({os.path.getsize(target_path)} bytes)'
+
+
+def expire_notifications(region=None):
+    """Delete read notifications older than the retention window, in small batches"""
+    cutoff = (datetime.utcnow() - timedelta(days=NOTIFICATION_RETENTION_DAYS)).strftime('%Y-%m-%d %H:%M:%S')
+    conn = database.get_db(region)
+    try:
+        free_before = _freelist_bytes(conn)
+        deleted = 0
+        while True:
+            cursor = conn.execute('''
+                DELETE FROM notifications WHERE id IN (
+                    SELECT id FROM notifications
+                    WHERE is_read = 1 AND created_at < ?
+                    LIMIT ?
+                )
+            ''', (cutoff, DELETE_BATCH_SIZE))
+            conn.commit()
+            deleted += cursor.rowcount
+            if cursor.rowcount < DELETE_BATCH_SIZE:
+                break
+        freed = _freelist_bytes(conn) - free_before
+    finally:
+        conn.close()
+    return max(freed, 0), f'{deleted} read notifications older than {NOTIFICATION_RETENTION_DAYS} days'
+
+
+def incremental_vacuum(region=None):
+    """Return free pages to the filesystem a batch at a time.
+
+    Databases created before auto_vacuum was enabled are skipped: converting
+    them takes a full VACUUM, which holds the write lock for the whole
+    rewrite, so that is left to convert_auto_vacuum during a deploy.
+    """
+    conn = database.get_db(region)
+    try:
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            return 0, 'skipped, not in incremental auto_vacuum mode (run convert_auto_vacuum)'
+        page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+        pages = 0
+        free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        while free > 0:
+            conn.execute(f'PRAGMA incremental_vacuum({VACUUM_BATCH_PAGES})').fetchall()
+            conn.commit()
+            remaining = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            if remaining >= free:
+                break
+            pages += free - remaining
+            free = remaining
+        # Let the main file shrink without waiting on readers
+        conn.execute('PRAGMA wal_checkpoint(PASSIVE)').fetchall()
+    finally:
+        conn.close()
+    return pages * page_size, f'{pages} free pages released'
+
+
+def convert_auto_vacuum(region=None):
+    """One-time switch of an older database to incremental auto_vacuum.
+
+    Runs a full VACUUM, which blocks writers until it finishes, so it is
+    never scheduled: run it by hand while the app is stopped, e.g. as a
+    deploy step (python maintenance.py convert_auto_vacuum).
+    """
+    conn = database.get_db(region)
+    try:
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+            return 0, 'already incremental'
+        size_before = _file_bytes(region)
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchall()
+        reclaimed = size_before - _file_bytes(region)
+    finally:
+        conn.close()
+    return max(reclaimed, 0), 'converted to incremental auto_vacuum'
+
+
+def optimize(region=None):
+    """Refresh planner statistics"""
+    conn = database.get_db(region)
+    try:
+        has_stats = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'"
+        ).fetchone()
+        if has_stats:
+            conn.execute('PRAGMA optimize')
+            detail = 'PRAGMA optimize'
+        else:
+            conn.execute('ANALYZE')
+            detail = 'ANALYZE (first run)'
+        conn.commit()
+    finally:
+        conn.close()
+    return 0, detail
+
+
+JOBS = {
+    'optimize': optimize,
+    'expire_notifications': expire_notifications,
+    'incremental_vacuum': incremental_vacuum,
+    'backup': backup,
+    'refresh_popularity': refresh_popularity,
+    'recount_popularity': recount_popularity,
+}
+# Run only when asked for by name, never by the scheduler
+MANUAL_JOBS = {
+    'convert_auto_vacuum': convert_auto_vacuum,
+}
+
+
+def _claim(job, interval):
+    """Mark a job as started if it is due; only one worker wins the claim"""
+    conn = database.get_db()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        row = conn.execute('SELECT started_at FROM maintenance_runs WHERE job = ?', (job,)).fetchone()
+        now = time.time()
+        if row and row['started_at'] is not None and now - row['started_at'] < interval:
+            conn.rollback()
+            return False
+        conn.execute('''
+            INSERT INTO maintenance_runs (job, started_at, status) VALUES (?, ?, 'running')
+            ON CONFLICT(job) DO UPDATE SET started_at = excluded.started_at, status = 'running'
+        ''', (job, now))
+        conn.commit()
+        return True
+    finally:
+        conn.close()
+
+
+def run_job(job):
+    """Run one job now, on the primary and every shard, and record its duration and reclaimed bytes"""
+    started = time.perf_counter()
+    reclaimed, details, status = 0, [], 'ok'
+    for region in sharding.all_databases():
+        try:
+            region_reclaimed, region_detail = (JOBS.get(job) or MANUAL_JOBS[job])(region)
+            reclaimed += region_reclaimed
+        except Exception as e:
+            region_detail, status = str(e), 'error'
+        details.append(f'{region}: {region_detail}' if region else region_detail)
+    detail = '; '.join(details)
+    duration = time.perf_counter() - started
+
+    conn = database.get_db()
+    conn.execute('''
+        INSERT INTO maintenance_runs (job, started_at, finished_at, duration, reclaimed_bytes, status, detail)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(job) DO UPDATE SET finished_at = excluded.finished_at, duration = excluded.duration,
+            reclaimed_bytes = excluded.reclaimed_bytes, status = excluded.status, detail = excluded.detail
+    ''', (job, time.time() - duration, time.time(), duration, reclaimed, status, detail))
+    conn.commit()
+    conn.close()
+
+    report = {'job': job, 'status': status, 'duration': round(duration, 3),
+              'reclaimed_bytes': reclaimed, 'detail': detail}
+    logger.log(logging.ERROR if status == 'error' else logging.INFO,
+               'maintenance %s: %s in %.2fs, reclaimed %d bytes (%s)', job, status, duration, reclaimed, detail)
+    return report
+
+
+def run_due_jobs():
+    """Run every job whose interval has elapsed and that no other worker has claimed"""
+    return [run_job(job) for job, interval in JOB_INTERVALS.items() if _claim(job, interval)]
+
+
+def get_reports():
+    """Last recorded run of each job"""
+    conn = database.get_db()
+    rows = conn.execute('SELECT * FROM maintenance_runs ORDER BY job').fetchall()
+    conn.close()
+    return [dict(row) for row in rows]
+
+
+_scheduler_thread = None
+_scheduler_stop = threading.Event()
+
+
+def _scheduler_loop():
+    while not _scheduler_stop.wait(SCHEDULER_TICK_SECONDS):
+        try:
+            run_due_jobs()
+        except Exception:
+            logger.exception('maintenance scheduler error')
+
+
+def start_scheduler():
+    """Start the background maintenance thread once per process.
+
+    Call it after fork (gunicorn post_fork): threads don't survive fork.
+    Every worker runs a scheduler, and the claim in maintenance_runs makes
+    sure each job runs once per interval across all of them.
+    """
+    global _scheduler_thread
+    if os.environ.get('MAINTENANCE_ENABLED', '1') != '1':
+        return None
+    if _scheduler_thread is None or not _scheduler_thread.is_alive():
+        _scheduler_stop.clear()
+        _scheduler_thread = threading.Thread(target=_scheduler_loop, name='maintenance', daemon=True)
+        _scheduler_thread.start()
+    return _scheduler_thread
+
+
+def stop_scheduler():
+    _scheduler_stop.set()
+
+
+if __name__ == '__main__':
+    # Run the given jobs (or all scheduled ones) immediately: python maintenance.py [job ...]
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    database.ensure_schema()
+    for name in sys.argv[1:] or list(JOBS):
+        run_job(name)
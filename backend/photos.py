@@ -0,0 +1,301 @@
+"""Business photo galleries: upload validation, size metadata, resized variants and covers.
+
+Dimensions are read from the image headers (PNG, JPEG, GIF, WebP), so
+no file is decoded just to validate it. When Pillow is installed each
+photo also gets resized WebP variants ('thumb' for cards, 'medium' for
+the gallery). Without it, or when the original is already small enough,
+a variant row points at the original file. List endpoints get the cover
+thumbnail from the same query that loads the businesses, by joining
+COVER_JOIN. The partial unique index allows one cover per business, so
+the join never adds rows.
+"""
+import os
+import secrets
+import struct
+from datetime import datetime
+from io import BytesIO
+
+from sharding import next_id
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # variants fall back to the original file
+    Image = None
+
+# Longest edge of each variant, in pixels
+VARIANT_SIZES = {'thumb': 320, 'medium': 1280}
+VARIANT_QUALITY = 80
+# Larger images are rejected before anything is decoded
+MAX_PIXELS = 40_000_000
+MAX_PHOTO_SIZE = 5 * 1024 * 1024
+MAX_PHOTOS_PER_UPLOAD = 10
+DEFAULT_PAGE_SIZE = 12
+MAX_PAGE_SIZE = 50
+
+EXTENSIONS = {'image/png': 'png', 'image/jpeg': 'jpg', 'image/gif': 'gif', 'image/webp': 'webp'}
+
+COVER_SELECT = 'cv.path AS cover_url, cv.width AS cover_width, cv.height AS cover_height'
+COVER_JOIN = '''
+    LEFT JOIN business_photos cp ON cp.business_id = b.id AND cp.is_cover = 1
+    LEFT JOIN business_photo_variants cv ON cv.photo_id = cp.id AND cv.variant = 'thumb'
+'''
+
+# JPEG start-of-frame markers (not DHT 0xC4, JPG 0xC8 or DAC 0xCC)
+_JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+class InvalidPhoto(ValueError):
+    pass
+
+
+def _exif_orientation(segment):
+    """EXIF orientation (1-8) from an APP1 segment body, or 1"""
+    if not segment.startswith(b'Exif\0\0'):
+        return 1
+    tiff = segment[6:]
+    endian = {b'II': '<', b'MM': '>'}.get(tiff[:2])
+    if endian is None or len(tiff) < 8:
+        return 1
+    offset = struct.unpack(endian + 'I', tiff[4:8])[0]
+    if offset + 2 > len(tiff):
+        return 1
+    count = struct.unpack(endian + 'H', tiff[offset:offset + 2])[0]
+    for i in range(count):
+        entry = tiff[offset + 2 + i * 12:offset + 14 + i * 12]
+        if len(entry) < 12:
+            break
+        tag, _, _, value = struct.unpack(endian + 'HHIH', entry[:10])
+        if tag == 0x0112:
+            return value
+    return 1
+
+
+def _jpeg_size(data):
+    i, orientation = 2, 1
+    while i + 4 <= len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:  # fill byte
+            i += 1
+            continue
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+            i += 2
+            continue
+        length = struct.unpack('>H', data[i + 2:i + 4])[0]
+        if marker == 0xE1:
+            orientation = _exif_orientation(data[i + 4:i + 2 + length])
+        elif marker in _JPEG_SOF:
+            height, width = struct.unpack('>HH', data[i + 5:i + 9])
+            # Orientations 5-8 are rotated by 90 degrees when displayed
+            return (height, width) if orientation >= 5 else (width, height)
+        i += 2 + length
+    return None
+
+
+def _webp_size(data):
+    chunk = data[12:16]
+    if chunk == b'VP8 ' and data[23:26] == b'\x9d\x01\x2a':
+        width, height = struct.unpack('<HH', data[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b'VP8L' and data[20:21] == b'\x2f':
+        bits = struct.unpack('<I', data[21:25])[0]
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b'VP8X':
+        return (int.from_bytes(data[24:27], 'little') + 1,
+                int.from_bytes(data[27:30], 'little') + 1)
+    return None
+
+
+def inspect_image(data):
+    """(content_type, width, height) read from the file header, or None if it isn't a supported image"""
+    try:
+        if data.startswith(b'\x89PNG\r\n\x1a\n') and data[12:16] == b'IHDR':
+            content_type, size = 'image/png', struct.unpack('>II', data[16:24])
+        elif data[:6] in (b'GIF87a', b'GIF89a'):
+            content_type, size = 'image/gif', struct.unpack('<HH', data[6:10])
+        elif data.startswith(b'\xff\xd8'):
+            content_type, size = 'image/jpeg', _jpeg_size(data)
+        elif data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+            content_type, size = 'image/webp', _webp_size(data)
+        else:
+            return None
+    except struct.error:  # truncated header
+        return None
+    if not size or not size[0] or not size[1]:
+        return None
+    return content_type, size[0], size[1]
+
+
+def _decode(name, data):
+    """Fully decoded image turned upright; InvalidPhoto if Pillow can't read it"""
+    try:
+        image = Image.open(BytesIO(data))
+        image.load()
+        return ImageOps.exif_transpose(image)
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as e:
+        # A valid header over a corrupt or truncated body
+        raise InvalidPhoto(f'{name} could not be read as an image') from e
+
+
+def _make_variant(image, longest_edge, path):
+    """Save a WebP copy no larger than longest_edge on either side; returns (width, height, bytes)"""
+    copy = image.copy()
+    copy.thumbnail((longest_edge, longest_edge))
+    if copy.mode not in ('RGB', 'RGBA'):
+        copy = copy.convert('RGBA' if 'A' in copy.getbands() or 'transparency' in copy.info else 'RGB')
+    copy.save(path, 'WEBP', quality=VARIANT_QUALITY)
+    return copy.width, copy.height, os.path.getsize(path)
+
+
+def _photo_url(filename):
+    return f'/uploads/businesses/{filename}'
+
+
+def _write_photo(business_id, name, data, content_type, width, height, upload_dir):
+    """Write the original and its variants; returns (files written, original dict, {variant: dict})"""
+    # Decoded before anything is written, so an unreadable body is rejected like a bad header
+    image = None
+    if Image is not None and max(width, height) > min(VARIANT_SIZES.values()):
+        image = _decode(name, data)
+
+    stem = f"business_{business_id}_photo_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{secrets.token_hex(4)}"
+    filename = f'{stem}.{EXTENSIONS[content_type]}'
+    written = [os.path.join(upload_dir, filename)]
+    with open(written[0], 'wb') as f:
+        f.write(data)
+    original = {'url': _photo_url(filename), 'width': width, 'height': height, 'bytes': len(data)}
+
+    variants = {}
+    for variant, longest_edge in VARIANT_SIZES.items():
+        if image is None or max(width, height) <= longest_edge:
+            variants[variant] = original
+            continue
+        variant_filename = f'{stem}_{variant}.webp'
+        path = os.path.join(upload_dir, variant_filename)
+        written.append(path)
+        variant_width, variant_height, size = _make_variant(image, longest_edge, path)
+        variants[variant] = {'url': _photo_url(variant_filename), 'width': variant_width,
+                             'height': variant_height, 'bytes': size}
+    return written, original, variants
+
+
+def save_photos(conn, business_id, uploads, upload_dir):
+    """Store uploaded photos for a business and return them as gallery entries.
+
+    uploads is a list of (filename, bytes). Every file is checked before any
+    is written, so a bad file rejects the whole upload with InvalidPhoto.
+    The first photo of a business without a cover becomes its cover.
+    """
+    checked = []
+    for filename, data in uploads:
+        if len(data) > MAX_PHOTO_SIZE:
+            raise InvalidPhoto(f'{filename} is larger than {MAX_PHOTO_SIZE // (1024 * 1024)}MB')
+        info = inspect_image(data)
+        if info is None:
+            raise InvalidPhoto(f'{filename} is not a PNG, JPG, GIF or WEBP image')
+        if info[1] * info[2] > MAX_PIXELS:
+            raise InvalidPhoto(f'{filename} is too large ({info[1]}x{info[2]})')
+        checked.append((filename, data, info))
+
+    written, photos = [], []
+    try:
+        for filename, data, (content_type, width, height) in checked:
+            files, original, variants = _write_photo(business_id, filename, data, content_type, width, height,
+                                                     upload_dir)
+            written.extend(files)
+            cursor = conn.execute('''
+                INSERT INTO business_photos (id, business_id, photo_path, width, height, bytes, content_type, is_cover)
+                VALUES (?, ?, ?, ?, ?, ?, ?,
+                        NOT EXISTS (SELECT 1 FROM business_photos WHERE business_id = ? AND is_cover = 1))
+            ''', (next_id(conn, 'business_photos'), business_id, original['url'], width, height, len(data), content_type, business_id))
+            photo_id = cursor.lastrowid
+            conn.executemany('''
+                INSERT INTO business_photo_variants (photo_id, business_id, variant, path, width, height, bytes)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', [(photo_id, business_id, variant, v['url'], v['width'], v['height'], v['bytes'])
+                  for variant, v in variants.items()])
+            is_cover = conn.execute('SELECT is_cover FROM business_photos WHERE id = ?', (photo_id,)).fetchone()[0]
+            photos.append({'id': photo_id, 'is_cover': bool(is_cover), 'content_type': content_type,
+                           'original': original, **variants})
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        for path in written:
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+    return photos
+
+
+def photo_page(conn, business_id, after=None, limit=DEFAULT_PAGE_SIZE):
+    """One page of a gallery in upload order as (photos, id to pass as `after` for the next page or None)"""
+    rows = conn.execute('''
+        SELECT id, photo_path, width, height, bytes, content_type, is_cover
+        FROM business_photos
+        WHERE business_id = ? AND id > ?
+        ORDER BY id
+        LIMIT ?
+    ''', (business_id, after or 0, limit + 1)).fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if not rows:
+        return [], None
+
+    # Variants for the whole page in one query
+    placeholders = ','.join('?' * len(rows))
+    variants = {}
+    for v in conn.execute(f'''
+        SELECT photo_id, variant, path, width, height, bytes
+        FROM business_photo_variants
+        WHERE photo_id IN ({placeholders})
+    ''', [row['id'] for row in rows]):
+        variants.setdefault(v['photo_id'], {})[v['variant']] = {
+            'url': v['path'], 'width': v['width'], 'height': v['height'], 'bytes': v['bytes']}
+
+    photos = []
+    for row in rows:
+        original = {'url': row['photo_path'], 'width': row['width'], 'height': row['height'], 'bytes': row['bytes']}
+        photo = {'id': row['id'], 'is_cover': bool(row['is_cover']), 'content_type': row['content_type'],
+                 'original': original}
+        # Photos from before variants existed serve the original everywhere
+        for variant in VARIANT_SIZES:
+            photo[variant] = variants.get(row['id'], {}).get(variant, original)
+        photos.append(photo)
+    return photos, rows[-1]['id'] if has_more else None
+
+
+def set_cover(conn, business_id, photo_id):
+    """Make a photo its business's cover; False if the business has no such photo"""
+    if conn.execute('SELECT 1 FROM business_photos WHERE id = ? AND business_id = ?',
+                    (photo_id, business_id)).fetchone() is None:
+        return False
+    conn.execute('UPDATE business_photos SET is_cover = 0 WHERE business_id = ? AND is_cover = 1', (business_id,))
+    conn.execute('UPDATE business_photos SET is_cover = 1 WHERE id = ?', (photo_id,))
+    conn.commit()
+    return True
+
+
+def delete_photo(conn, business_id, photo_id, upload_folder):
+    """Delete a photo, its variants and files; the oldest remaining photo becomes cover if needed"""
+    row = conn.execute('SELECT photo_path, is_cover FROM business_photos WHERE id = ? AND business_id = ?',
+                       (photo_id, business_id)).fetchone()
+    if row is None:
+        return False
+    paths = {row['photo_path']} | {v['path'] for v in conn.execute(
+        'SELECT path FROM business_photo_variants WHERE photo_id = ?', (photo_id,))}
+
+    conn.execute('DELETE FROM business_photo_variants WHERE photo_id = ?', (photo_id,))
+    conn.execute('DELETE FROM business_photos WHERE id = ?', (photo_id,))
+    if row['is_cover']:
+        conn.execute('''
+            UPDATE business_photos SET is_cover = 1
+            WHERE id = (SELECT MIN(id) FROM business_photos WHERE business_id = ?)
+        ''', (business_id,))
+    conn.commit()
+
+    for path in paths:
+        full_path = os.path.join(upload_folder, path.replace('/uploads/', ''))
+        if os.path.exists(full_path):
+            os.remove(full_path)
+    return True
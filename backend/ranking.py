@@ -0,0 +1,234 @@
+"""Relevance ranking for discovery: distance decay, text match and popularity.
+
+Popularity comes from customer engagement: favorites and confirmed bookings.
+The counters in business_popularity (primary database) are refreshed
+incrementally by the refresh_popularity maintenance job, which only reads
+rows added since its per-table watermark. recount_popularity rebuilds them
+from scratch now and then to pick up deletions and cancellations. Queries
+only read the cached, normalized scores.
+"""
+import math
+import re
+import threading
+import time
+import unicodedata
+
+import database
+
+# Relative weight of each signal; a signal that doesn't apply (no location, no query) is left out
+W_DISTANCE = 0.5
+W_TEXT = 0.3
+W_POPULARITY = 0.2
+# Distance score halves every DISTANCE_HALF_LIFE_KM
+DISTANCE_HALF_LIFE_KM = 5.0
+
+# Text match strength per business field; a prefix match counts PREFIX_FACTOR of it
+FIELD_WEIGHTS = (('business_name', 1.0), ('business_type', 0.8), ('services', 0.6), ('address', 0.4))
+PREFIX_FACTOR = 0.7
+
+# How much each counted event adds to raw popularity
+FAVORITE_POINTS = 3
+BOOKING_POINTS = 2
+
+POPULARITY_TTL_SECONDS = 60
+
+
+def fold(text):
+    """Lowercase ASCII form used for matching: 'Beauté Montréal' -> 'beaute montreal'"""
+    return unicodedata.normalize('NFKD', str(text)).encode('ascii', 'ignore').decode().lower()
+
+
+def tokenize(text):
+    if not text:
+        return []
+    return re.findall(r'[a-z0-9]+', fold(text))
+
+
+class PopularityScores:
+    """Per-process copy of normalized popularity (0..1) by business id, reloaded after a TTL"""
+
+    def __init__(self, ttl=POPULARITY_TTL_SECONDS):
+        self.ttl = ttl
+        self._scores = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        loaded_at = self._loaded_at
+        if loaded_at is None or time.monotonic() - loaded_at > self.ttl:
+            self.reload()
+        return self._scores
+
+    def reload(self):
+        conn = database.get_read_db()
+        try:
+            rows = conn.execute('''
+                SELECT business_id, SUM(favorites) AS favorites, SUM(bookings) AS bookings
+                FROM business_popularity
+                GROUP BY business_id
+            ''').fetchall()
+        finally:
+            conn.close()
+
+        raw = {row['business_id']: FAVORITE_POINTS * row['favorites'] + BOOKING_POINTS * row['bookings']
+               for row in rows}
+        # Log scale so a handful of very popular businesses don't flatten everyone else
+        top = math.log1p(max(raw.values(), default=0))
+        scores = {business_id: math.log1p(value) / top for business_id, value in raw.items()} if top else {}
+        with self._lock:
+            self._scores = scores
+            self._loaded_at = time.monotonic()
+
+
+popularity = PopularityScores()
+
+
+def distance_score(distance):
+    return 0.5 ** (distance / DISTANCE_HALF_LIFE_KM)
+
+
+def text_score(query_tokens, biz):
+    """Share of query tokens found in the business's fields, weighted by field"""
+    fields = [(set(tokenize(biz.get(field))), weight) for field, weight in FIELD_WEIGHTS]
+    total = 0.0
+    for token in query_tokens:
+        best = 0.0
+        for words, weight in fields:
+            if token in words:
+                best = max(best, weight)
+            elif weight * PREFIX_FACTOR > best and any(word.startswith(token) for word in words):
+                best = weight * PREFIX_FACTOR
+        total += best
+    return total / len(query_tokens)
+
+
+def score(biz, query_tokens, scores):
+    weighted = total = 0.0
+    if biz.get('distance') is not None:
+        weighted += W_DISTANCE * distance_score(biz['distance'])
+        total += W_DISTANCE
+    if query_tokens:
+        weighted += W_TEXT * text_score(query_tokens, biz)
+        total += W_TEXT
+    weighted += W_POPULARITY * scores.get(biz['id'], 0.0)
+    total += W_POPULARITY
+    return weighted / total
+
+
+def rank_businesses(candidates, query=None, limit=None):
+    """Best-scoring businesses first, each with a 'relevance' field.
+
+    candidates are business dicts, with 'distance' set when the search had
+    a location. A plain sort: for the few thousand candidates a search
+    yields it is as fast as heapq.nlargest (see benchmarks/ranking.py).
+    """
+    query_tokens = tokenize(query)
+    scores = popularity.get()
+    ranked = sorted(((score(biz, query_tokens, scores), biz) for biz in candidates),
+                    key=lambda item: item[0], reverse=True)
+    results = []
+    for relevance, biz in ranked[:limit]:
+        biz['relevance'] = round(relevance, 4)
+        results.append(biz)
+    return results
+
+
+# ============ POPULARITY AGGREGATES ============
+# source name -> query for rows past a watermark: (id, business_id, counted)
+POPULARITY_SOURCES = {
+    'favorites': 'SELECT id, business_id, 1 AS counted FROM favorites WHERE id > ?',
+    'bookings': "SELECT id, business_id, status != 'cancelled' AS counted FROM bookings WHERE id > ?",
+}
+RECOUNT_QUERIES = {
+    'favorites': 'SELECT business_id, COUNT(*) AS count FROM favorites GROUP BY business_id',
+    'bookings': "SELECT business_id, COUNT(*) AS count FROM bookings WHERE status != 'cancelled' GROUP BY business_id",
+}
+MAX_ID_QUERIES = {
+    'favorites': 'SELECT MAX(id) FROM favorites',
+    'bookings': 'SELECT MAX(id) FROM bookings',
+}
+
+
+def _source_db(region):
+    return region or 'primary'
+
+
+def _save_counts(primary, source_db, counts, increment):
+    """Write {business_id: {column: n}} into business_popularity"""
+    for business_id, columns in counts.items():
+        values = [columns.get(column, 0) for column in POPULARITY_SOURCES]
+        if increment:
+            primary.execute('''
+                INSERT INTO business_popularity (business_id, source_db, favorites, bookings)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(business_id, source_db) DO UPDATE SET
+                    favorites = favorites + excluded.favorites,
+                    bookings = bookings + excluded.bookings
+            ''', [business_id, source_db] + values)
+        else:
+            primary.execute('''
+                INSERT INTO business_popularity (business_id, source_db, favorites, bookings)
+                VALUES (?, ?, ?, ?)
+            ''', [business_id, source_db] + values)
+
+
+def refresh_popularity(region=None):
+    """Add rows created since the last run to the popularity counters of one database"""
+    source_db = _source_db(region)
+    primary = database.get_db()
+    source = database.get_db(region)
+    try:
+        # The lock on the primary serializes runs, so no row is counted twice
+        primary.execute('BEGIN IMMEDIATE')
+        marks = dict(primary.execute(
+            'SELECT source, last_id FROM popularity_watermarks WHERE source_db = ?', (source_db,)
+        ).fetchall())
+
+        counts, added = {}, 0
+        for name, query in POPULARITY_SOURCES.items():
+            last_id = marks.get(name, 0)
+            for row in source.execute(query, (last_id,)):
+                # Rows that don't count (cancelled bookings) still move the watermark
+                last_id = max(last_id, row['id'])
+                if row['counted']:
+                    columns = counts.setdefault(row['business_id'], {})
+                    columns[name] = columns.get(name, 0) + 1
+                    added += 1
+            primary.execute('''
+                INSERT OR REPLACE INTO popularity_watermarks (source_db, source, last_id) VALUES (?, ?, ?)
+            ''', (source_db, name, last_id))
+
+        _save_counts(primary, source_db, counts, increment=True)
+        primary.commit()
+    finally:
+        source.close()
+        primary.close()
+    return 0, f'{added} new events for {len(counts)} businesses'
+
+
+def recount_popularity(region=None):
+    """Rebuild one database's popularity counters, dropping removed favorites and cancelled bookings"""
+    source_db = _source_db(region)
+    primary = database.get_db()
+    source = database.get_db(region)
+    try:
+        primary.execute('BEGIN IMMEDIATE')
+        # Counts and max ids must come from the same snapshot of the source
+        source.execute('BEGIN')
+        counts = {}
+        for name, query in RECOUNT_QUERIES.items():
+            for row in source.execute(query):
+                counts.setdefault(row['business_id'], {})[name] = row['count']
+        newest = {name: source.execute(query).fetchone()[0] or 0 for name, query in MAX_ID_QUERIES.items()}
+        source.rollback()
+
+        primary.execute('DELETE FROM business_popularity WHERE source_db = ?', (source_db,))
+        _save_counts(primary, source_db, counts, increment=False)
+        primary.executemany('''
+            INSERT OR REPLACE INTO popularity_watermarks (source_db, source, last_id) VALUES (?, ?, ?)
+        ''', [(source_db, name, last_id) for name, last_id in newest.items()])
+        primary.commit()
+    finally:
+        source.close()
+        primary.close()
+    return 0, f'{len(counts)} businesses recounted'
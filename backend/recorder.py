@@ -0,0 +1,181 @@
+"""Opt-in sampling recorder of API requests, for replaying traffic with replay.py.
+
+With REQUEST_LOG_SAMPLE_RATE > 0 (0 = off, the default) that fraction of
+/api requests is appended to a JSONL log in REQUEST_LOG_DIR, one file per
+worker process (requests-<pid>.jsonl), rotated at REQUEST_LOG_MAX_BYTES.
+Each line holds the start time, method, path, URL rule, query arguments,
+JSON or form body, status, response size and duration. Passwords, emails,
+phone numbers and similar fields are replaced with SCRUBBED, and latitudes
+and longitudes are rounded to LOCATION_DECIMALS places. Uploaded files are
+recorded by name and size only. Unsampled requests cost one random() call.
+"""
+import json
+import logging
+import os
+import random
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+
+from flask import g, request
+
+SAMPLE_RATE = float(os.environ.get('REQUEST_LOG_SAMPLE_RATE', 0))
+LOG_DIR = os.environ.get('REQUEST_LOG_DIR', os.path.join(os.path.dirname(__file__), '..', 'request_logs'))
+MAX_BYTES = int(os.environ.get('REQUEST_LOG_MAX_BYTES', 50 * 1024 * 1024))
+BACKUP_COUNT = int(os.environ.get('REQUEST_LOG_BACKUPS', 5))
+
+# Field names containing any of these are never written to the log
+SENSITIVE_FIELDS = ('password', 'token', 'secret', 'email', 'phone', 'authorization')
+SCRUBBED = '***'
+# Coordinates are rounded to about 10 km: no one's precise location is kept,
+# but replayed searches still land in the same area
+LOCATION_FIELDS = ('latitude', 'longitude')
+LOCATION_DECIMALS = 1
+
+_dumps = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'), default=str).encode
+
+
+def _coarsen(value):
+    if value is None:
+        return None
+    if isinstance(value, list):
+        return [_coarsen(item) for item in value]
+    try:
+        return round(float(value), LOCATION_DECIMALS)
+    except (TypeError, ValueError):
+        return SCRUBBED
+
+
+def _scrub_field(key, value):
+    name = str(key).lower()
+    if any(word in name for word in SENSITIVE_FIELDS):
+        return SCRUBBED
+    if any(word in name for word in LOCATION_FIELDS):
+        return _coarsen(value)
+    return scrub(value)
+
+
+def scrub(value):
+    """Copy of a JSON-like value with sensitive fields replaced and locations coarsened, at any depth"""
+    if isinstance(value, dict):
+        return {key: _scrub_field(key, item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [scrub(item) for item in value]
+    return value
+
+
+class RequestLog:
+    """Size-rotated JSONL file, opened lazily so each forked worker writes its own"""
+
+    def __init__(self, directory=LOG_DIR, max_bytes=MAX_BYTES, backup_count=BACKUP_COUNT):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._handler = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        line = _dumps(record)
+        with self._lock:
+            if self._pid != os.getpid():
+                os.makedirs(self.directory, exist_ok=True)
+                path = os.path.join(self.directory, f'requests-{os.getpid()}.jsonl')
+                self._handler = RotatingFileHandler(path, maxBytes=self.max_bytes,
+                                                    backupCount=self.backup_count, encoding='utf-8')
+                self._pid = os.getpid()
+        # The handler has its own lock around rotation and writes
+        self._handler.emit(logging.makeLogRecord({'msg': line}))
+
+    def close(self):
+        with self._lock:
+            if self._handler:
+                self._handler.close()
+            self._handler = None
+            self._pid = None
+
+
+request_log = RequestLog()
+
+
+class _CountingBody:
+    """Wraps a streamed response body and counts the bytes sent"""
+
+    def __init__(self, body):
+        self.body = body
+        self.bytes = 0
+
+    def __iter__(self):
+        for chunk in self.body:
+            self.bytes += len(chunk.encode()) if isinstance(chunk, str) else len(chunk)
+            yield chunk
+
+    def close(self):
+        # Lets the body's own cleanup run (e.g. stream_json's on_close)
+        if hasattr(self.body, 'close'):
+            self.body.close()
+
+
+def _file_size(file):
+    try:
+        file.stream.seek(0, os.SEEK_END)
+        return file.stream.tell()
+    except (AttributeError, OSError):
+        return None
+
+
+def _request_body():
+    if request.is_json:
+        return {'json': scrub(request.get_json(silent=True))}
+    body = {}
+    if request.form:
+        body['form'] = scrub(request.form.to_dict(flat=False))
+    if request.files:
+        body['files'] = {name: [{'filename': f.filename, 'bytes': _file_size(f)}
+                                for f in request.files.getlist(name)]
+                         for name in request.files}
+    return body
+
+
+def init_recorder(app, sample_rate=SAMPLE_RATE, log=request_log):
+    """Register the recording hooks on app when sample_rate > 0"""
+    if sample_rate <= 0:
+        return
+
+    @app.before_request
+    def start_recording():
+        if request.path.startswith('/api/') and random.random() < sample_rate:
+            g.recording = (time.time(), time.perf_counter())
+
+    @app.after_request
+    def finish_recording(response):
+        recording = g.pop('recording', None)
+        if recording is None:
+            return response
+        started_at, started = recording
+        record = {
+            'ts': round(started_at, 3),
+            'method': request.method,
+            'path': request.path,
+            'rule': request.url_rule.rule if request.url_rule else None,
+            'endpoint': request.endpoint,
+            'args': scrub(request.args.to_dict(flat=False)),
+            **_request_body(),
+            'status': response.status_code,
+        }
+
+        # Streamed bodies are still being generated here, so time and count them until the response is closed
+        counted = None
+        if response.content_length is None and not response.direct_passthrough:
+            counted = response.response = _CountingBody(response.response)
+
+        def write():
+            record['ms'] = round((time.perf_counter() - started) * 1000, 3)
+            record['bytes'] = counted.bytes if counted else response.content_length
+            try:
+                log.write(record)
+            except Exception as e:
+                print(f'[recorder] could not write request log: {e}')
+
+        response.call_on_close(write)
+        return response
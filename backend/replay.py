@@ -0,0 +1,245 @@
+"""Replay requests captured by recorder.py and profile them per endpoint.
+
+By default the requests run in-process through the Flask test client,
+against the database in DATABASE_PATH or --database. Replayed writes
+really happen, so point it at a copy. With --target they are sent over
+HTTP to a running server instead, e.g. a local gunicorn. --speed keeps
+the recorded pacing (1 = original rate, 10 = ten times faster, 0 = as
+fast as possible). Uploads are skipped because their files aren't
+recorded. Scrubbed credentials mean logins replay as failures, and
+locations are replayed rounded to one decimal place.
+
+In-process replays can be profiled per endpoint:
+  --profile cprofile  writes <endpoint>.prof (pstats; snakeviz, gprof2dot)
+  --profile sample    samples the stack every --interval seconds and writes
+                      <endpoint>.folded collapsed stacks
+                      (flamegraph.pl, speedscope, inferno)
+
+    python replay.py ../request_logs/requests-*.jsonl --speed 0 --profile sample
+"""
+import argparse
+import cProfile
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+HTTP_THREADS = 16
+
+
+def load_records(paths, endpoints=None):
+    """Recorded requests from all files, oldest first, without uploads"""
+    records = []
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if record.get('files') or (endpoints and record.get('endpoint') not in endpoints):
+                    continue
+                records.append(record)
+    records.sort(key=lambda record: record['ts'])
+    return records
+
+
+def schedule(records, speed):
+    """Yield records, sleeping so they start at their recorded offsets divided by speed"""
+    if not records:
+        return
+    first = records[0]['ts']
+    started = time.perf_counter()
+    for record in records:
+        if speed > 0:
+            delay = (record['ts'] - first) / speed - (time.perf_counter() - started)
+            if delay > 0:
+                time.sleep(delay)
+        yield record
+
+
+class StackSampler:
+    """Samples one thread's Python stack into collapsed-stack counts per label.
+
+    Set `label` to the endpoint being replayed and back to None afterwards;
+    samples taken while it is None are dropped.
+    """
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.label = None
+        self.stacks = defaultdict(Counter)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def start(self):
+        # A short switch interval lets the sampler run while the replay thread holds the GIL
+        self._switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(min(self._switch_interval, self.interval / 2))
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        sys.setswitchinterval(self._switch_interval)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            label = self.label
+            frame = sys._current_frames().get(self.thread_id)
+            if label is None or frame is None:
+                continue
+            names = []
+            # Stacks start at Flask (or at the streamed body); the replay loop above is the same every time
+            while frame is not None and frame.f_globals.get('__name__') != __name__:
+                code = frame.f_code
+                names.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                if code.co_name == 'wsgi_app':
+                    break
+                frame = frame.f_back
+            self.stacks[label][';'.join(reversed(names))] += 1
+
+    def write(self, out_dir):
+        for label, stacks in self.stacks.items():
+            with open(os.path.join(out_dir, f'{label}.folded'), 'w', encoding='utf-8') as f:
+                for stack, count in stacks.most_common():
+                    f.write(f'{stack} {count}\n')
+
+
+def replay_in_process(records, speed, profile, interval, out_dir):
+    """Run records through the Flask test client; returns [(record, status, ms)]"""
+    os.environ['REQUEST_LOG_SAMPLE_RATE'] = '0'  # don't record the replay itself
+    from app import create_app
+    client = create_app().test_client()
+
+    profiles = defaultdict(cProfile.Profile)
+    sampler = None
+    if profile == 'sample':
+        sampler = StackSampler(threading.get_ident(), interval)
+        sampler.start()
+
+    results = []
+    try:
+        for record in schedule(records, speed):
+            endpoint = record.get('endpoint') or 'unknown'
+            kwargs = {'method': record['method'], 'query_string': record.get('args') or {}}
+            if 'json' in record:
+                kwargs['json'] = record['json']
+            elif 'form' in record:
+                kwargs['data'] = record['form']
+
+            if profile == 'cprofile':
+                profiles[endpoint].enable()
+            elif sampler:
+                sampler.label = endpoint
+            started = time.perf_counter()
+            response = client.open(record['path'], **kwargs)
+            response.get_data()  # run streamed bodies to the end
+            response.close()
+            elapsed = (time.perf_counter() - started) * 1000
+            if profile == 'cprofile':
+                profiles[endpoint].disable()
+            elif sampler:
+                sampler.label = None
+
+            results.append((record, response.status_code, elapsed))
+    finally:
+        if sampler:
+            sampler.stop()
+
+    if profile:
+        os.makedirs(out_dir, exist_ok=True)
+    for endpoint, profiler in profiles.items():
+        profiler.dump_stats(os.path.join(out_dir, f'{endpoint}.prof'))
+    if sampler:
+        sampler.write(out_dir)
+    return results
+
+
+def _send(target, record):
+    url = target.rstrip('/') + record['path']
+    if record.get('args'):
+        url += '?' + urllib.parse.urlencode(record['args'], doseq=True)
+    data, headers = None, {}
+    if 'json' in record:
+        data, headers = json.dumps(record['json']).encode(), {'Content-Type': 'application/json'}
+    elif 'form' in record:
+        data = urllib.parse.urlencode(record['form'], doseq=True).encode()
+
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data, headers, method=record['method'])) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except urllib.error.URLError:
+        status = 0
+    return record, status, (time.perf_counter() - started) * 1000
+
+
+def replay_http(records, speed, target):
+    """Send records to a running server; requests overlap like the originals did"""
+    with ThreadPoolExecutor(max_workers=HTTP_THREADS) as pool:
+        futures = [pool.submit(_send, target, record) for record in schedule(records, speed)]
+        return [future.result() for future in futures]
+
+
+def report(results):
+    by_endpoint = defaultdict(list)
+    for record, status, ms in results:
+        by_endpoint[record.get('endpoint') or 'unknown'].append((record, status, ms))
+
+    print(f"{'endpoint':32} {'count':>6} {'changed':>7} {'p50 ms':>8} {'p95 ms':>8} {'recorded p50':>13}")
+    for endpoint, rows in sorted(by_endpoint.items(), key=lambda item: -len(item[1])):
+        times = sorted(ms for _, _, ms in rows)
+        recorded = [record['ms'] for record, _, _ in rows if record.get('ms') is not None]
+        # Replayed requests that didn't get the status they got originally
+        changed = sum(1 for record, status, _ in rows if status != record.get('status'))
+        p95 = times[min(len(times) - 1, int(len(times) * 0.95))]
+        print(f"{endpoint:32} {len(rows):6} {changed:7} {statistics.median(times):8.2f} {p95:8.2f} "
+              f"{statistics.median(recorded) if recorded else float('nan'):13.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay recorded API requests')
+    parser.add_argument('logs', nargs='+', help='JSONL files written by recorder.py')
+    parser.add_argument('--speed', type=float, default=1.0, help='1 = recorded rate, 0 = as fast as possible')
+    parser.add_argument('--target', help='base URL of a running server (default: in-process test client)')
+    parser.add_argument('--database', help='database file for in-process replays (use a copy)')
+    parser.add_argument('--endpoint', action='append', help='only replay this endpoint (repeatable)')
+    parser.add_argument('--profile', choices=['cprofile', 'sample'], help='profile each endpoint (in-process only)')
+    parser.add_argument('--interval', type=float, default=0.001, help='seconds between stack samples')
+    parser.add_argument('--out', default=os.path.join(os.path.dirname(__file__), '..', 'profiles'),
+                        help='directory for profile output')
+    args = parser.parse_args()
+
+    if args.profile and args.target:
+        parser.error('--profile needs an in-process replay (no --target)')
+
+    records = load_records(args.logs, set(args.endpoint) if args.endpoint else None)
+    print(f'Replaying {len(records)} requests')
+
+    if args.target:
+        results = replay_http(records, args.speed, args.target)
+    else:
+        import database
+        if args.database:
+            database.DATABASE_PATH = args.database
+        results = replay_in_process(records, args.speed, args.profile, args.interval, args.out)
+
+    if results:
+        report(results)
+    if args.profile:
+        print(f'Profiles written to {args.out}/')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+import json
+
+from flask import Response, request
+
+# Flush the streamed body to the server in chunks of roughly this many bytes
+CHUNK_SIZE = 16 * 1024
+
+_dumps = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+
+
+def wants_columnar(data=None):
+    """True when the client asked for the compact columnar format"""
+    fmt = request.args.get('format')
+    if fmt is None and data:
+        fmt = data.get('format')
+    return fmt == 'columnar'
+
+
+def _chunks(items, fields, columnar):
+    buffer = []
+    size = 0
+    first = True
+
+    for item in items:
+        if columnar:
+            if fields is None:
+                fields = list(item.keys())
+                buffer.insert(0, '{"fields":' + _dumps(fields) + ',"rows":[')
+            piece = _dumps([item[field] for field in fields])
+        else:
+            piece = _dumps(dict(item))
+
+        if not first:
+            piece = ',' + piece
+        first = False
+        buffer.append(piece)
+        size += len(piece)
+
+        if size >= CHUNK_SIZE:
+            yield ''.join(buffer)
+            buffer = []
+            size = 0
+
+    if columnar:
+        if fields is None:
+            buffer.insert(0, '{"fields":[],"rows":[')
+        buffer.append(']}')
+    else:
+        buffer.append(']')
+    yield ''.join(buffer)
+
+
+def stream_json(items, fields=None, columnar=False, on_close=None, status=200):
+    """Stream a JSON list without holding the whole body in memory.
+
+    items is any iterable of dicts or sqlite3.Rows, including a live cursor.
+    The default body is a JSON array of objects. With columnar=True it is
+    {"fields": [...], "rows": [[...], ...]}, so field names are sent once.
+    on_close runs once the body is sent or the client disconnects. Pass
+    conn.close there when items is a cursor.
+    """
+    if fields is not None:
+        fields = list(fields)
+
+    def generate():
+        try:
+            if columnar and fields is not None:
+                yield '{"fields":' + _dumps(fields) + ',"rows":['
+                yield from _chunks(items, fields, True)
+            elif columnar:
+                yield from _chunks(items, None, True)
+            else:
+                yield '['
+                yield from _chunks(items, None, False)
+        finally:
+            if on_close:
+                on_close()
+
+    return Response(generate(), status=status, mimetype='application/json')
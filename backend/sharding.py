@@ -0,0 +1,385 @@
+"""Optional regional sharding of users, businesses and their rows.
+
+With SHARDING=1 each region in REGIONS has its own database file under
+SHARD_DIR. A business lives in the region of its coordinates, together with
+its services, photos and bookings. A user lives in the region of their last
+known location (DEFAULT_REGION when unknown), together with their favorites,
+notifications and activity. Writes in different regions then take
+different SQLite write locks.
+
+Every shard hands out ids from its own range (shard n starts at
+n * ID_RANGE), so ids stay globally unique and an id tells which shard
+created it. Inserts into ID_TABLES take their id from next_id(): rows
+the rebalancer moved in keep ids from another shard's range, and plain
+AUTOINCREMENT would continue after the largest of them. Users and businesses the rebalancer moved elsewhere are
+recorded in shard_directory in the primary database.db, which also keeps
+the non-regional tables. With sharding off every helper here resolves to
+the primary database and behaves exactly as before.
+
+Rebalancing is an offline step: run it with the app stopped. Workers
+cache shard_directory for DIRECTORY_TTL_SECONDS and could otherwise keep
+writing a moved user's rows to the old shard. Until the first rebalance,
+reads also visit the primary so rows from before sharding stay visible.
+
+    python sharding.py init        # create shard files
+    python sharding.py rebalance   # move rows to the shard their location maps to
+"""
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import database
+
+# Longitude bands, west to east: (name, west edge inclusive, east edge exclusive)
+REGIONS = (
+    ('west', -180.0, -110.0),      # BC, AB, YT, NT
+    ('prairies', -110.0, -89.0),   # SK, MB, NU (west)
+    ('central', -89.0, -74.5),     # ON
+    ('east', -74.5, 180.0),        # QC, Atlantic provinces
+)
+REGION_NAMES = tuple(name for name, _, _ in REGIONS)
+DEFAULT_REGION = 'central'
+
+ID_RANGE = 1 << 40
+# Tables whose AUTOINCREMENT ids are allocated per shard
+ID_TABLES = ('users', 'businesses', 'services', 'business_photos', 'bookings',
+             'favorites', 'user_activity', 'notifications')
+
+DIRECTORY_TTL_SECONDS = 30
+MAX_SCATTER_THREADS = len(REGIONS) + 1  # shards plus the primary before the first rebalance
+
+
+def enabled():
+    return database.SHARDING_ENABLED
+
+
+_primary_checked_at = None
+_primary_has_rows = True
+_primary_lock = threading.Lock()
+
+
+def primary_pending():
+    """True while the primary still holds users or businesses that rebalance hasn't moved.
+
+    Rows created before sharding was switched on stay in database.db until
+    the first rebalance, and reads keep visiting the primary until then.
+    Rechecked every DIRECTORY_TTL_SECONDS, and never again once it is empty.
+    """
+    global _primary_checked_at, _primary_has_rows
+    with _primary_lock:
+        has_rows, checked_at = _primary_has_rows, _primary_checked_at
+    if not has_rows:
+        return False
+    if checked_at is None or time.monotonic() - checked_at > DIRECTORY_TTL_SECONDS:
+        conn = database.get_read_db(max_staleness=0)
+        try:
+            row = conn.execute(
+                'SELECT EXISTS (SELECT 1 FROM users) OR EXISTS (SELECT 1 FROM businesses)'
+            ).fetchone()
+        finally:
+            conn.close()
+        has_rows = bool(row[0])
+        with _primary_lock:
+            _primary_has_rows = has_rows
+            _primary_checked_at = time.monotonic()
+    return has_rows
+
+
+def regions():
+    """Every region to visit for a global query; [None] (the primary) when sharding is off"""
+    if not enabled():
+        return [None]
+    return ([None] if primary_pending() else []) + list(REGION_NAMES)
+
+
+def all_databases():
+    """The primary plus every shard, for jobs that touch each database file"""
+    return [None] + list(REGION_NAMES) if enabled() else [None]
+
+
+def location_region(latitude, longitude):
+    """Region a coordinate belongs to (None when sharding is off)"""
+    if not enabled():
+        return None
+    if latitude is None or longitude is None:
+        return DEFAULT_REGION
+    longitude = float(longitude)
+    for name, west, east in REGIONS:
+        if west <= longitude < east:
+            return name
+    return REGIONS[-1][0]
+
+
+def regions_for_bbox(min_lat, max_lat, min_lon, max_lon):
+    """Regions whose band overlaps a bounding box"""
+    if not enabled():
+        return [None]
+    overlapping = [name for name, west, east in REGIONS if min_lon < east and max_lon >= west]
+    return ([None] if primary_pending() else []) + overlapping
+
+
+def id_region(entity_id):
+    """Region that allocated an id, or None for ids created before sharding"""
+    if not enabled() or entity_id is None:
+        return None
+    index = int(entity_id) // ID_RANGE
+    if 1 <= index <= len(REGIONS):
+        return REGIONS[index - 1][0]
+    return None
+
+
+def next_id(conn, table):
+    """Id for a new row in one of ID_TABLES, from the sequence of the shard conn writes to.
+
+    SQLite's AUTOINCREMENT continues after the largest id in the table, and
+    moved rows keep ids from their old shard's range, so inserts pass this
+    id explicitly instead. Must run in the inserting transaction. None (let
+    SQLite choose) when sharding is off or the table has no sequence yet.
+    """
+    if not enabled():
+        return None
+    conn.execute('UPDATE sqlite_sequence SET seq = seq + 1 WHERE name = ?', (table,))
+    row = conn.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (table,)).fetchone()
+    return row[0] if row else None
+
+
+class _Directory:
+    """Cached copy of shard_directory (entities that no longer live in their id's shard)"""
+
+    def __init__(self):
+        self._entries = {}
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def lookup(self, entity, entity_id):
+        if time.monotonic() - self._loaded_at > DIRECTORY_TTL_SECONDS:
+            self.reload()
+        return self._entries.get((entity, int(entity_id)))
+
+    def reload(self):
+        conn = database.get_db()
+        rows = conn.execute('SELECT entity, entity_id, region FROM shard_directory').fetchall()
+        conn.close()
+        with self._lock:
+            self._entries = {(row['entity'], row['entity_id']): row['region'] for row in rows}
+            self._loaded_at = time.monotonic()
+
+
+directory = _Directory()
+
+
+def user_region(user_id):
+    """Shard holding a user and their favorites, notifications and activity"""
+    if not enabled() or user_id is None:
+        return None
+    return directory.lookup('user', user_id) or id_region(user_id)
+
+
+def business_region(business_id):
+    """Shard holding a business and its services, photos and bookings"""
+    if not enabled() or business_id is None:
+        return None
+    return directory.lookup('business', business_id) or id_region(business_id)
+
+
+def scatter(fn, target_regions=None, read=True, max_staleness=None):
+    """Run fn(conn, region) against several shards in parallel and return the results in order.
+
+    Each call gets its own connection (read-only when read=True), closed
+    afterwards. With a single region it runs inline.
+    """
+    target_regions = regions() if target_regions is None else list(target_regions)
+
+    def run(region):
+        conn = database.get_read_db(max_staleness, region) if read else database.get_db(region)
+        try:
+            return fn(conn, region)
+        finally:
+            conn.close()
+
+    if len(target_regions) <= 1:
+        return [run(region) for region in target_regions]
+    with ThreadPoolExecutor(max_workers=min(MAX_SCATTER_THREADS, len(target_regions))) as pool:
+        return list(pool.map(run, target_regions))
+
+
+def email_taken(table, email):
+    """True if any shard already has this email in users/businesses"""
+    def check(conn, region):
+        return conn.execute(f'SELECT 1 FROM {table} WHERE email = ?', (email,)).fetchone() is not None
+    return any(scatter(check, max_staleness=0))
+
+
+def find_by_email(query, params):
+    """Run a lookup-by-email query on every shard and return the first matching row"""
+    def lookup(conn, region):
+        row = conn.execute(query, params).fetchone()
+        return (dict(row), region) if row else None
+    for result in scatter(lookup, max_staleness=0):
+        if result:
+            return result
+    return None, None
+
+
+def write_by_id(record_id, fn):
+    """Run a write fn(conn, region) -> rowcount against the shard that owns a record id.
+
+    Tries the shard that allocated the id first; rows moved by the
+    rebalancer keep their ids, so on a miss the other shards are tried.
+    """
+    first = id_region(record_id)
+    affected = scatter(fn, [first], read=False)[0]
+    if affected or not enabled():
+        return affected
+    for region in REGION_NAMES:
+        if region != first:
+            affected = scatter(fn, [region], read=False)[0]
+            if affected:
+                return affected
+    return 0
+
+
+def init_shards():
+    """Create every shard file, migrate it and seed its id range"""
+    if not enabled():
+        return
+    os.makedirs(database.SHARD_DIR, exist_ok=True)
+    for index, name in enumerate(REGION_NAMES, start=1):
+        database.ensure_schema(name)
+        conn = database.get_db(name)
+        start = index * ID_RANGE
+        for table in ID_TABLES:
+            row = conn.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (table,)).fetchone()
+            if row is None:
+                conn.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)', (table, start))
+            elif row['seq'] < start:
+                conn.execute('UPDATE sqlite_sequence SET seq = ? WHERE name = ?', (start, table))
+        conn.commit()
+        conn.close()
+
+
+# ============ REBALANCING ============
+# Child rows that move with their owner: (table, owner column, extra filter)
+BUSINESS_CHILDREN = (
+    ('services', 'business_id', ''),
+    ('business_photos', 'business_id', ''),
+    ('business_photo_variants', 'business_id', ''),
+    ('bookings', 'business_id', ''),
+    ('user_activity', 'user_id', "AND user_type = 'business'"),
+)
+USER_CHILDREN = (
+    ('favorites', 'user_id', ''),
+    ('notifications', 'user_id', ''),
+    ('user_activity', 'user_id', "AND user_type = 'user'"),
+)
+
+
+def _copy_rows(source, target, table, where, params):
+    rows = source.execute(f'SELECT * FROM {table} WHERE {where}', params).fetchall()
+    if rows:
+        columns = rows[0].keys()
+        target.executemany(
+            f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+            [tuple(row) for row in rows])
+    return len(rows)
+
+
+def _move(source_region, target_region, entity, entity_id, table, children):
+    """Copy an entity and its children to another shard, record it, then delete the originals.
+
+    The source's write lock is held from the copy to the delete, so rows
+    written for the entity in between can't be lost. Ids are kept, so
+    clients holding them are unaffected; the target's sequences are put
+    back afterwards so its new ids stay in its own range. The copy uses
+    INSERT OR REPLACE, so re-running after a crash between steps is safe.
+    """
+    source = database.get_db(source_region)
+    target = database.get_db(target_region)
+    try:
+        source.execute('BEGIN IMMEDIATE')
+        target.execute('BEGIN IMMEDIATE')
+        sequences = target.execute(
+            f"SELECT seq, name FROM sqlite_sequence WHERE name IN ({','.join('?' * len(ID_TABLES))})",
+            ID_TABLES).fetchall()
+        _copy_rows(source, target, table, 'id = ?', (entity_id,))
+        for child, column, extra in children:
+            _copy_rows(source, target, child, f'{column} = ? {extra}', (entity_id,))
+        target.executemany('UPDATE sqlite_sequence SET seq = ? WHERE name = ?', [tuple(row) for row in sequences])
+        target.commit()
+
+        # Leaving the primary, whose write lock source already holds: record it in the same transaction
+        primary = source if source_region is None else database.get_db()
+        if id_region(entity_id) == target_region:
+            primary.execute('DELETE FROM shard_directory WHERE entity = ? AND entity_id = ?', (entity, entity_id))
+        else:
+            primary.execute('''
+                INSERT OR REPLACE INTO shard_directory (entity, entity_id, region) VALUES (?, ?, ?)
+            ''', (entity, entity_id, target_region))
+        if primary is not source:
+            primary.commit()
+            primary.close()
+
+        for child, column, extra in children:
+            source.execute(f'DELETE FROM {child} WHERE {column} = ? {extra}', (entity_id,))
+        source.execute(f'DELETE FROM {table} WHERE id = ?', (entity_id,))
+        source.commit()
+    except Exception:
+        source.rollback()
+        target.rollback()
+        raise
+    finally:
+        source.close()
+        target.close()
+
+
+def rebalance(dry_run=False):
+    """Move every business and user whose location maps to a different shard.
+
+    Also migrates rows from the primary database into the shards the first
+    time sharding is switched on. Returns {(source, target): count}.
+    """
+    global _primary_checked_at
+    if not enabled():
+        raise RuntimeError('Set SHARDING=1 to rebalance')
+    init_shards()
+
+    moves = {}
+    for source_region in [None] + list(REGION_NAMES):
+        conn = database.get_db(source_region)
+        businesses = conn.execute('SELECT id, latitude, longitude FROM businesses').fetchall()
+        users = conn.execute('SELECT id, latitude, longitude FROM users').fetchall()
+        conn.close()
+
+        for entity, table, rows, children in (
+                ('business', 'businesses', businesses, BUSINESS_CHILDREN),
+                ('user', 'users', users, USER_CHILDREN)):
+            for row in rows:
+                target_region = location_region(row['latitude'], row['longitude'])
+                if target_region == source_region:
+                    continue
+                moves[(source_region, target_region)] = moves.get((source_region, target_region), 0) + 1
+                if not dry_run:
+                    _move(source_region, target_region, entity, row['id'], table, children)
+
+    directory.reload()
+    with _primary_lock:
+        _primary_checked_at = None
+    return moves
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'rebalance'
+    if command == 'init':
+        database.ensure_schema()
+        init_shards()
+        print(f'Shards ready in {database.SHARD_DIR}: {", ".join(REGION_NAMES)}')
+    elif command == 'rebalance':
+        database.ensure_schema()
+        dry_run = '--dry-run' in sys.argv
+        for (source, target), count in sorted(rebalance(dry_run).items(), key=str):
+            print(f"{'would move' if dry_run else 'moved'} {count} from {source or 'primary'} to {target}")
+    else:
+        print('Usage: python sharding.py [init | rebalance [--dry-run]]')
+        sys.exit(1)
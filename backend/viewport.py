@@ -0,0 +1,128 @@
+import math
+
+from cache import LRUCache
+from favorites import BUSINESS_SNAPSHOT_COLUMNS
+
+# At or above this zoom the viewport returns individual businesses
+INDIVIDUAL_ZOOM = 13
+MAX_ZOOM = 20
+# Each tile is split into CELLS_PER_TILE x CELLS_PER_TILE cluster cells
+CELLS_PER_TILE = 4
+MAX_VIEWPORT_BUSINESSES = 500
+MAX_TILES_PER_REQUEST = 256
+
+TILE_TTL_SECONDS = 120
+MAX_CACHED_TILES = 20000
+
+
+def tile_size(zoom):
+    """Tile edge in degrees; tiles are square in lat/lon space"""
+    return 360.0 / (2 ** zoom)
+
+
+def tile_range(south, west, north, east, zoom):
+    """Inclusive tile index ranges covering the bounds"""
+    size = tile_size(zoom)
+    tx0 = int(math.floor((west + 180) / size))
+    tx1 = int(math.floor((east + 180) / size))
+    ty0 = int(math.floor((south + 90) / size))
+    ty1 = int(math.floor((north + 90) / size))
+    return tx0, tx1, ty0, ty1
+
+
+# Cluster aggregates per (region, zoom, business_type, tx, ty)
+cluster_tiles = LRUCache(MAX_CACHED_TILES, ttl=TILE_TTL_SECONDS)
+
+
+def _load_tiles(conn, region, zoom, business_type, tx0, tx1, ty0, ty1):
+    """Aggregate one rectangle of tiles with a single GROUP BY over cell indices"""
+    size = tile_size(zoom)
+    cell = size / CELLS_PER_TILE
+    query = '''
+        SELECT CAST((b.longitude + 180) / ? AS INTEGER) AS cx,
+               CAST((b.latitude + 90) / ? AS INTEGER) AS cy,
+               COUNT(*) AS count, AVG(b.latitude) AS latitude, AVG(b.longitude) AS longitude,
+               MIN(b.id) AS id, b.business_name, b.business_type, b.address
+        FROM businesses b
+        WHERE b.verified = 1
+        AND b.latitude >= ? AND b.latitude < ?
+        AND b.longitude >= ? AND b.longitude < ?
+    '''
+    params = [cell, cell, ty0 * size - 90, (ty1 + 1) * size - 90, tx0 * size - 180, (tx1 + 1) * size - 180]
+    if business_type:
+        query += ' AND b.business_type = ?'
+        params.append(business_type)
+    query += ' GROUP BY cx, cy'
+
+    tiles = {(region, zoom, business_type, tx, ty): []
+             for tx in range(tx0, tx1 + 1) for ty in range(ty0, ty1 + 1)}
+    for row in conn.execute(query, params):
+        key = (region, zoom, business_type, row['cx'] // CELLS_PER_TILE, row['cy'] // CELLS_PER_TILE)
+        if key not in tiles:
+            continue
+        cluster = {
+            'latitude': round(row['latitude'], 6),
+            'longitude': round(row['longitude'], 6),
+            'count': row['count']
+        }
+        if row['count'] == 1:
+            # A single business renders as a normal marker
+            cluster.update(id=row['id'], business_name=row['business_name'],
+                           business_type=row['business_type'], address=row['address'])
+        tiles[key].append(cluster)
+    return tiles
+
+
+def get_clusters(conn, south, west, north, east, zoom, business_type=None, region=None):
+    """Cluster aggregates for the tiles under the viewport, served from cache where possible.
+
+    region names the shard conn points at, so each shard's tiles are cached separately.
+    """
+    tx0, tx1, ty0, ty1 = tile_range(south, west, north, east, zoom)
+    if (tx1 - tx0 + 1) * (ty1 - ty0 + 1) > MAX_TILES_PER_REQUEST:
+        raise ValueError('Viewport too large for this zoom level')
+
+    clusters = []
+    missing = []
+    for tx in range(tx0, tx1 + 1):
+        for ty in range(ty0, ty1 + 1):
+            cached = cluster_tiles.get((region, zoom, business_type, tx, ty))
+            if cached is None:
+                missing.append((tx, ty))
+            else:
+                clusters.extend(cached)
+
+    if missing:
+        # Load the bounding rectangle of all missing tiles in one query
+        mx0 = min(tx for tx, _ in missing)
+        mx1 = max(tx for tx, _ in missing)
+        my0 = min(ty for _, ty in missing)
+        my1 = max(ty for _, ty in missing)
+        loaded = _load_tiles(conn, region, zoom, business_type, mx0, mx1, my0, my1)
+        cluster_tiles.put_many(loaded)
+        for tx, ty in missing:
+            clusters.extend(loaded[(region, zoom, business_type, tx, ty)])
+
+    return clusters
+
+
+def get_viewport_businesses(conn, south, west, north, east, business_type=None):
+    """Individual businesses inside the bounds, capped at MAX_VIEWPORT_BUSINESSES"""
+    columns = ', '.join(f'b.{column}' for column in BUSINESS_SNAPSHOT_COLUMNS)
+    query = f'''
+        SELECT {columns}
+        FROM businesses b
+        WHERE b.verified = 1
+        AND b.latitude BETWEEN ? AND ?
+        AND b.longitude BETWEEN ? AND ?
+    '''
+    params = [south, north, west, east]
+    if business_type:
+        query += ' AND b.business_type = ?'
+        params.append(business_type)
+    query += ' LIMIT ?'
+    params.append(MAX_VIEWPORT_BUSINESSES + 1)
+
+    businesses = [dict(row) for row in conn.execute(query, params)]
+    truncated = len(businesses) > MAX_VIEWPORT_BUSINESSES
+    return businesses[:MAX_VIEWPORT_BUSINESSES], truncated
@@ -0,0 +1,93 @@
+"""Many clients racing for the same booking slots.
+
+Each client is a separate process with its own connection, like gunicorn
+workers. Every client tries to book every slot of one morning in random
+order; afterwards the bookings table must contain no overlaps.
+
+    python benchmarks/booking_contention.py --clients 16
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from multiprocessing import Pool
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+import database  # noqa: E402
+from booking import DATE_FORMAT, OPEN_HOUR, SlotUnavailable, reserve_slot  # noqa: E402
+
+
+def _client(args):
+    db_path, client_id, business_id, service_id, starts = args
+    database.DATABASE_PATH = db_path
+    conn = database.get_db()
+    random.Random(client_id).shuffle(starts)
+
+    won, lost, latencies = 0, 0, []
+    for start in starts:
+        t0 = time.perf_counter()
+        try:
+            reserve_slot(conn, client_id, business_id, service_id, start)
+            won += 1
+        except SlotUnavailable:
+            lost += 1
+        latencies.append(time.perf_counter() - t0)
+    conn.close()
+    return won, lost, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--slots', type=int, default=12, help='15-minute start times to fight over')
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    database.DATABASE_PATH = db_path
+    database.init_db()
+    database.add_sample_data()
+
+    conn = database.get_db()
+    service = conn.execute('SELECT id, business_id FROM services ORDER BY id LIMIT 1').fetchone()
+    conn.close()
+
+    tomorrow = datetime.now() + timedelta(days=1)
+    first = datetime(tomorrow.year, tomorrow.month, tomorrow.day, OPEN_HOUR)
+    starts = [first + timedelta(minutes=15 * i) for i in range(args.slots)]
+
+    jobs = [(db_path, client_id, service['business_id'], service['id'], list(starts))
+            for client_id in range(1, args.clients + 1)]
+
+    t0 = time.perf_counter()
+    with Pool(args.clients) as pool:
+        results = pool.map(_client, jobs)
+    elapsed = time.perf_counter() - t0
+
+    won = sum(r[0] for r in results)
+    lost = sum(r[1] for r in results)
+    latencies = sorted(l for r in results for l in r[2])
+
+    # Verify no two active bookings overlap (60 minute default duration)
+    conn = database.get_db()
+    rows = conn.execute('''
+        SELECT booking_date FROM bookings
+        WHERE business_id = ? AND status != 'cancelled' ORDER BY booking_date
+    ''', (service['business_id'],)).fetchall()
+    conn.close()
+    booked = [datetime.strptime(r['booking_date'], DATE_FORMAT) for r in rows]
+    overlaps = sum(1 for a, b in zip(booked, booked[1:]) if b < a + timedelta(minutes=60))
+
+    print(f'clients={args.clients} attempts={won + lost} booked={won} rejected={lost}')
+    print(f'elapsed={elapsed:.3f}s throughput={(won + lost) / elapsed:.0f} attempts/s')
+    print(f'latency p50={latencies[len(latencies) // 2] * 1000:.2f}ms '
+          f'p99={latencies[int(len(latencies) * 0.99)] * 1000:.2f}ms')
+    print(f'overlapping bookings: {overlaps}')
+    return 1 if overlaps else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
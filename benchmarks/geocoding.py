@@ -0,0 +1,91 @@
+"""Check and time the offline geocoder against the bundled gazetteer.
+
+Resolves a fixed set of queries (city names, typos, postal codes, sample
+business addresses) with no network access, and fails if any lands further
+than --max-error-km from where it should. Then times cold lookups (gazetteer
+or fuzzy match; the first one also loads the gazetteer), persistent-cache
+lookups (queued cache writes flushed, in-process cache cleared) and
+in-process repeats.
+
+    python benchmarks/geocoding.py
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'backend'))
+
+import database  # noqa: E402
+
+# query -> expected (latitude, longitude)
+EXPECTED = {
+    'Toronto': (43.6532, -79.3832),
+    'toronto, on': (43.6532, -79.3832),
+    'Montréal': (45.5017, -73.5673),
+    'Quebec City, Quebec': (46.8139, -71.2080),
+    'Mississuaga': (43.5890, -79.6441),
+    'St Catherines': (43.1594, -79.2469),
+    "St. John's": (47.5615, -52.7126),
+    'Vancouver BC Canada': (49.2827, -123.1207),
+    'M5V 2A8': (43.6426, -79.3871),
+    'T2P': (51.0480, -114.0700),
+    'H2J 2L3': (45.5234, -73.5800),
+    'R0E': (49.8951, -97.1384),
+    '123 Yonge St, Toronto, ON M5C 1W4': (43.6532, -79.3832),
+    'Halifax': (44.6488, -63.5752),
+    'Whitehorse': (60.7212, -135.0568),
+}
+
+
+def timed(fn, queries):
+    samples = []
+    for query in queries:
+        t0 = time.perf_counter()
+        fn(query)
+        samples.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(samples), max(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--max-error-km', type=float, default=25.0)
+    args = parser.parse_args()
+
+    database.DATABASE_PATH = os.path.join(tempfile.mkdtemp(), 'geocoding.db')
+    database.ensure_schema()
+    database.add_sample_data()
+
+    import geocoding
+    from geo import calculate_distance
+
+    ok = True
+    cold = timed(geocoding.geocode, EXPECTED)
+    for query, (latitude, longitude) in EXPECTED.items():
+        place = geocoding.geocode(query)
+        if place is None:
+            print(f'MISS  {query!r}')
+            ok = False
+            continue
+        error = calculate_distance(latitude, longitude, place['latitude'], place['longitude'])
+        status = 'ok' if error <= args.max_error_km else 'FAR'
+        ok = ok and status == 'ok'
+        print(f"{status:5} {query!r:40} -> {place['label']} ({place['source']}, {error:.1f}km off)")
+
+    repeat = timed(geocoding.geocode, list(EXPECTED) * 20)
+    geocoding.flush_cache_writes()
+    geocoding.recent_lookups.clear()
+    persistent = timed(geocoding.geocode, EXPECTED)
+
+    print(f'cold        p50={cold[0]:.3f}ms max={cold[1]:.3f}ms')
+    print(f'persistent  p50={persistent[0]:.3f}ms max={persistent[1]:.3f}ms')
+    print(f'in-process  p50={repeat[0]:.4f}ms max={repeat[1]:.3f}ms')
+    print('OK' if ok else 'FAILED')
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,186 @@
+"""Offline evaluation and latency benchmark for relevance ranking.
+
+Builds a synthetic city of --businesses businesses, each with a hidden
+quality that drives how many favorites and bookings it gets.
+Popularity is then aggregated by the real refresh_popularity job. For
+--queries random (location, query) pairs, a simulated user's preference
+for each business (closer, better and matching the query) is the graded
+label. NDCG@10 compares distance-only, popularity-only and the combined
+ranking. The labels come from a made-up choice model, so use the numbers to
+compare rankings with each other, not as a measure of real satisfaction.
+
+Latency: rank_businesses for several candidate counts, name search
+through the business_search index, and the nearby endpoint with
+sort=distance vs. sort=relevance.
+
+    python benchmarks/ranking.py --businesses 5000 --queries 200
+"""
+import argparse
+import math
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'backend'))
+
+import database  # noqa: E402
+
+CENTER = (43.6532, -79.3832)
+SPREAD_DEG = 0.25
+TYPES = {
+    'Spa': ['Massage', 'Facial', 'Body Scrub'],
+    'Salon': ['Haircut', 'Coloring', 'Blowout'],
+    'Nails': ['Manicure', 'Pedicure', 'Gel Nails'],
+    'Makeup': ['Bridal Makeup', 'Evening Look', 'Lash Extensions'],
+    'Barber': ['Fade', 'Beard Trim', 'Hot Towel Shave'],
+}
+ADJECTIVES = ['Golden', 'Urban', 'Lotus', 'Maple', 'Harbour', 'Velvet', 'Cedar', 'Bloom', 'Luxe', 'Serene']
+
+
+def build(n, seed):
+    rng = random.Random(seed)
+    conn = database.get_db()
+    conn.execute("INSERT INTO users (name, email, password_hash) VALUES ('bench', 'bench@example.com', 'x')")
+    truth = {}
+    for i in range(n):
+        business_type = rng.choice(list(TYPES))
+        lat = CENTER[0] + rng.uniform(-SPREAD_DEG, SPREAD_DEG)
+        lon = CENTER[1] + rng.uniform(-SPREAD_DEG, SPREAD_DEG)
+        cursor = conn.execute('''
+            INSERT INTO businesses (business_name, owner_name, email, phone, business_type, address,
+                                    latitude, longitude, password_hash, verified)
+            VALUES (?, 'Owner', ?, '555', ?, ?, ?, ?, 'x', 1)
+        ''', (f'{rng.choice(ADJECTIVES)} {business_type} {i}', f'b{i}@example.com', business_type,
+              f'{i} Main St, Toronto, ON', lat, lon))
+        business_id = cursor.lastrowid
+        services = rng.sample(TYPES[business_type], 2)
+        service_ids = []
+        for name in services:
+            service_ids.append(conn.execute('INSERT INTO services (business_id, service_name, price) VALUES (?, ?, 50)',
+                                            (business_id, name)).lastrowid)
+        quality = rng.betavariate(2, 5)
+        truth[business_id] = {'quality': quality, 'lat': lat, 'lon': lon,
+                              'words': {business_type.lower(), *(s.lower() for s in services)}}
+
+        # Engagement grows with hidden quality, with noise
+        for _ in range(int(rng.expovariate(1 / (quality * 20 + 0.01)))):
+            conn.execute("INSERT INTO favorites (user_id, business_id) VALUES (1, ?) ON CONFLICT DO NOTHING",
+                         (business_id,))
+        for k in range(int(rng.expovariate(1 / (quality * 30 + 0.01)))):
+            conn.execute('''
+                INSERT INTO bookings (user_id, business_id, service_id, booking_date, status)
+                VALUES (1, ?, ?, ?, 'confirmed')
+            ''', (business_id, service_ids[0], f'2030-01-01 {k % 24:02d}:{k % 60:02d}:{k:02d}'))
+    conn.commit()
+    conn.close()
+    return truth
+
+
+def ndcg(ranked_ids, gains, k=10):
+    dcg = sum(gains.get(b, 0) / math.log2(i + 2) for i, b in enumerate(ranked_ids[:k]))
+    ideal = sorted(gains.values(), reverse=True)[:k]
+    idcg = sum(g / math.log2(i + 2) for i, g in enumerate(ideal))
+    return dcg / idcg if idcg else 0.0
+
+
+def evaluate(app, truth, queries, seed, radius):
+    import ranking
+    from geo import calculate_distance
+
+    rng = random.Random(seed + 1)
+    words = sorted({w for t in truth.values() for w in t['words']})
+    results = {'distance': [], 'popularity': [], 'relevance': []}
+    client = app.test_client()
+    for _ in range(queries):
+        lat = CENTER[0] + rng.uniform(-SPREAD_DEG / 2, SPREAD_DEG / 2)
+        lon = CENTER[1] + rng.uniform(-SPREAD_DEG / 2, SPREAD_DEG / 2)
+        query = rng.choice(words) if rng.random() < 0.5 else None
+
+        candidates = client.post('/api/businesses/nearby', json={
+            'latitude': lat, 'longitude': lon, 'radius': radius}).get_json()
+        # Simulated preference: nearer, better and matching the query
+        gains = {}
+        for biz in candidates:
+            t = truth[biz['id']]
+            d = calculate_distance(lat, lon, t['lat'], t['lon'])
+            match = 1.0 if query is None or query in t['words'] else 0.1
+            gains[biz['id']] = math.exp(-d / 4) * (0.2 + t['quality']) * match
+
+        scores = ranking.popularity.get()
+        results['distance'].append(ndcg([b['id'] for b in candidates], gains))
+        by_popularity = sorted(candidates, key=lambda b: scores.get(b['id'], 0), reverse=True)
+        results['popularity'].append(ndcg([b['id'] for b in by_popularity], gains))
+        ranked = ranking.rank_businesses([dict(b) for b in candidates], query=query, limit=10)
+        results['relevance'].append(ndcg([b['id'] for b in ranked], gains))
+
+    for name, values in results.items():
+        print(f'NDCG@10 {name:10} {statistics.mean(values):.3f}')
+    return statistics.mean(results['relevance']) >= statistics.mean(results['distance'])
+
+
+def latency(app):
+    import ranking
+
+    rng = random.Random(7)
+    for size in (100, 1000, 10000):
+        candidates = [{'id': i, 'business_name': f'Golden Spa {i}', 'business_type': 'Spa',
+                       'services': 'Massage ($50.0),Facial ($50.0)', 'address': f'{i} Main St',
+                       'distance': rng.uniform(0, 30)} for i in range(size)]
+        samples = []
+        for _ in range(5):
+            batch = [dict(c) for c in candidates]
+            t0 = time.perf_counter()
+            ranking.rank_businesses(batch, query='spa massage', limit=20)
+            samples.append((time.perf_counter() - t0) * 1000)
+        print(f'rank {size:6} candidates top-20 p50={statistics.median(samples):.2f}ms')
+
+    client = app.test_client()
+    for query in ('spa', 'golden spa massage', 'nails on main'):
+        samples = []
+        for _ in range(20):
+            t0 = time.perf_counter()
+            client.get('/api/businesses/search', query_string={'q': query}).get_json()
+            samples.append((time.perf_counter() - t0) * 1000)
+        print(f'search {query!r:22} p50={statistics.median(samples):.2f}ms')
+
+    for sort in ('distance', 'relevance'):
+        samples = []
+        for _ in range(20):
+            t0 = time.perf_counter()
+            client.post('/api/businesses/nearby', json={'latitude': CENTER[0], 'longitude': CENTER[1],
+                                                        'radius': 10, 'sort': sort, 'limit': 50}).get_json()
+            samples.append((time.perf_counter() - t0) * 1000)
+        print(f'nearby sort={sort:9} p50={statistics.median(samples):.2f}ms max={max(samples):.2f}ms')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--businesses', type=int, default=5000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--radius', type=float, default=5.0)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    os.environ.setdefault('MAINTENANCE_ENABLED', '0')
+    database.DATABASE_PATH = os.path.join(tempfile.mkdtemp(), 'ranking.db')
+    database.ensure_schema()
+    truth = build(args.businesses, args.seed)
+
+    import ranking
+    from app import create_app
+    app = create_app()
+    ranking.refresh_popularity()
+    ranking.popularity.reload()
+
+    ok = evaluate(app, truth, args.queries, args.seed, args.radius)
+    latency(app)
+    print('OK' if ok else 'FAILED')
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
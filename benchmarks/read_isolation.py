@@ -0,0 +1,105 @@
+"""Check that discovery reads never wait on a long write transaction.
+
+A writer thread holds a write transaction open (BEGIN IMMEDIATE plus
+inserts) for --hold seconds. Meanwhile readers run the nearby query through
+get_read_db(), once against the primary and once in snapshot mode. The
+script fails if any read takes longer than --max-read-ms, or if a snapshot
+read is staler than its bound.
+
+    python benchmarks/read_isolation.py --hold 2
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'backend'))
+
+import database  # noqa: E402
+
+NEARBY_QUERY = '''
+    SELECT b.id, b.latitude, b.longitude, GROUP_CONCAT(s.service_name) as services
+    FROM businesses b LEFT JOIN services s ON b.id = s.business_id
+    WHERE b.verified = 1 GROUP BY b.id
+'''
+
+
+def hold_write_lock(hold, started):
+    conn = database.get_db()
+    conn.execute('BEGIN IMMEDIATE')
+    conn.execute("INSERT INTO user_activity (user_type, email, action) VALUES ('user', 'w@example.com', 'hold')")
+    started.set()
+    deadline = time.time() + hold
+    while time.time() < deadline:
+        conn.execute("INSERT INTO user_activity (user_type, email, action) VALUES ('user', 'w@example.com', 'hold')")
+        time.sleep(0.01)
+    conn.commit()
+    conn.close()
+
+
+def run(mode, snapshot_age, hold, max_read_ms):
+    database.READ_SNAPSHOT_MAX_AGE = snapshot_age
+    started = threading.Event()
+    writer = threading.Thread(target=hold_write_lock, args=(hold, started))
+    writer.start()
+    started.wait()
+
+    latencies = []
+    while writer.is_alive():
+        t0 = time.perf_counter()
+        conn = database.get_read_db()
+        conn.execute(NEARBY_QUERY).fetchall()
+        conn.close()
+        latencies.append((time.perf_counter() - t0) * 1000)
+    writer.join()
+
+    worst = max(latencies)
+    print(f'{mode:9} reads={len(latencies):5} p50={sorted(latencies)[len(latencies) // 2]:.2f}ms '
+          f'max={worst:.2f}ms (writer held lock {hold:.1f}s)')
+    return worst <= max_read_ms
+
+
+def check_staleness_bound(snapshot_age):
+    """A committed write must be visible through get_read_db within snapshot_age seconds"""
+    database.READ_SNAPSHOT_MAX_AGE = snapshot_age
+    conn = database.get_db()
+    conn.execute("INSERT INTO user_activity (user_type, email, action) VALUES ('user', 's@example.com', 'marker')")
+    conn.commit()
+    marker = conn.execute('SELECT MAX(id) FROM user_activity').fetchone()[0]
+    conn.close()
+
+    committed_at = time.time()
+    while True:
+        conn = database.get_read_db()
+        seen = conn.execute('SELECT MAX(id) FROM user_activity').fetchone()[0]
+        conn.close()
+        if seen >= marker:
+            lag = time.time() - committed_at
+            print(f'snapshot  write visible after {lag:.2f}s (bound {snapshot_age:.1f}s)')
+            return lag <= snapshot_age + 0.5
+        time.sleep(0.05)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--hold', type=float, default=2.0)
+    parser.add_argument('--snapshot-age', type=float, default=1.0)
+    parser.add_argument('--max-read-ms', type=float, default=250.0)
+    args = parser.parse_args()
+
+    database.DATABASE_PATH = os.path.join(tempfile.mkdtemp(), 'isolation.db')
+    database.ensure_schema()
+    database.add_sample_data()
+
+    ok = run('primary', 0, args.hold, args.max_read_ms)
+    ok = run('snapshot', args.snapshot_age, args.hold, args.max_read_ms) and ok
+    ok = check_staleness_bound(args.snapshot_age) and ok
+    print('OK' if ok else 'FAILED')
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,126 @@
+"""Bytes on the wire and peak memory per request for list responses.
+
+Compares the old nearby handler (SELECT b.*, dict(row), jsonify of the whole
+list) with the lean streamed array and the columnar format. Time and memory
+are measured in separate passes: tracemalloc slows every allocation, which
+would penalize whichever path allocates most often rather than most.
+
+With a location, nearby still holds every row inside the radius for the
+distance sort, so streaming mainly saves the response body there. The
+no-location case streams straight from the cursor.
+
+    python benchmarks/response_formats.py --businesses 20000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'backend'))
+
+import database  # noqa: E402
+
+
+def seed(count):
+    conn = database.get_db()
+    rng = random.Random(1)
+    types = ['Spa', 'Salon', 'Nails', 'Makeup', 'Skin Care']
+    for i in range(count):
+        cursor = conn.execute('''
+            INSERT INTO businesses (business_name, owner_name, email, phone, business_type, address,
+                                    latitude, longitude, password_hash, verification_doc, verified)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1)
+        ''', (f'Bench Business {i}', 'Owner Name', f'owner{i}@example.com', '(416) 555-0000',
+              rng.choice(types), f'{i} Bench St, Toronto, ON', 43.0 + rng.random() * 2,
+              -80.5 + rng.random() * 2, 'x' * 64, f'/uploads/businesses/business_{i}_doc.pdf'))
+        for name, price in (('Haircut', 60.0), ('Massage', 120.0)):
+            conn.execute('INSERT INTO services (business_id, service_name, price) VALUES (?, ?, ?)',
+                         (cursor.lastrowid, name, price))
+    conn.commit()
+    conn.close()
+
+
+def register_legacy_route(app_module):
+    """The nearby handler as it was before lean projections and streaming"""
+    from flask import jsonify, request
+
+    @app_module.app.route('/bench/legacy-nearby', methods=['POST'])
+    def legacy_nearby():
+        data = request.get_json()
+        user_lat, user_lon, radius = data['latitude'], data['longitude'], data['radius']
+        conn = database.get_db()
+        rows = conn.execute('''
+            SELECT b.*, GROUP_CONCAT(s.service_name || ' ($' || s.price || ')') as services
+            FROM businesses b LEFT JOIN services s ON b.id = s.business_id
+            WHERE b.verified = 1 GROUP BY b.id
+        ''').fetchall()
+        result = []
+        for biz in rows:
+            biz_dict = dict(biz)
+            distance = app_module.calculate_distance(user_lat, user_lon, biz_dict['latitude'], biz_dict['longitude'])
+            if distance <= radius:
+                biz_dict['distance'] = distance
+                result.append(biz_dict)
+        result.sort(key=lambda x: x['distance'])
+        conn.close()
+        return jsonify(result), 200
+
+
+def fetch(client, path, body):
+    response = client.post(path, json=body, buffered=False)
+    size = sum(len(chunk) for chunk in response.iter_encoded())
+    response.close()
+    return size
+
+
+def measure(client, path, body, runs):
+    """(bytes, peak traced memory, median seconds); timing runs without tracemalloc"""
+    fetch(client, path, body)  # warm up
+    times = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        size = fetch(client, path, body)
+        times.append(time.perf_counter() - t0)
+
+    tracemalloc.start()
+    fetch(client, path, body)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size, peak, statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--businesses', type=int, default=20000)
+    parser.add_argument('--radius', type=float, default=10000)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    database.DATABASE_PATH = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    database.ensure_schema()
+    seed(args.businesses)
+
+    os.chdir(os.path.join(ROOT, 'backend'))
+    import app as app_module
+    register_legacy_route(app_module)
+    client = app_module.app.test_client()
+
+    body = {'latitude': 43.65, 'longitude': -79.38, 'radius': args.radius}
+    cases = [
+        ('legacy b.* + jsonify', '/bench/legacy-nearby', body),
+        ('lean streamed array', '/api/businesses/nearby', body),
+        ('lean streamed columnar', '/api/businesses/nearby', dict(body, format='columnar')),
+        ('lean streamed, no location', '/api/businesses/nearby', {}),
+    ]
+    for label, path, payload in cases:
+        size, peak, elapsed = measure(client, path, payload, args.runs)
+        print(f'{label:26} bytes={size:10,} peak_mem={peak / 1024 / 1024:7.2f}MiB time={elapsed * 1000:7.1f}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""Compare gunicorn sync and gthread workers under concurrent load.
+
+Starts gunicorn with gunicorn.conf.py against a throwaway database for each
+mode, then runs N concurrent clients that mix discovery reads with
+activity-logging writes.
+
+    python benchmarks/serving_modes.py --clients 100 1000
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'backend'))
+
+import database  # noqa: E402
+
+MODES = {
+    'sync': {'GUNICORN_WORKER_CLASS': 'sync', 'GUNICORN_THREADS': '1'},
+    'gthread': {'GUNICORN_WORKER_CLASS': 'gthread', 'GUNICORN_THREADS': '8'},
+}
+
+REQUESTS = [
+    ('POST', '/api/businesses/nearby', {'latitude': 43.65, 'longitude': -79.38, 'radius': 50}),
+    ('GET', '/api/businesses/search?q=spa', None),
+    ('GET', '/api/user/1/notifications/unread', None),
+    ('POST', '/api/user/activity', {'user_id': 1, 'user_type': 'user', 'email': 'bench@example.com',
+                                    'action': 'bench'}),
+]
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _wait_for(port, timeout=20):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('gunicorn did not start')
+
+
+def _client(port, requests_per_client, latencies, errors, lock):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    local = []
+    failed = 0
+    for i in range(requests_per_client):
+        method, path, body = REQUESTS[i % len(REQUESTS)]
+        t0 = time.perf_counter()
+        try:
+            payload = json.dumps(body) if body is not None else None
+            conn.request(method, path, body=payload, headers={'Content-Type': 'application/json'})
+            response = conn.getresponse()
+            response.read()
+            if response.status >= 500:
+                failed += 1
+        except (OSError, http.client.HTTPException):
+            failed += 1
+            conn.close()
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        local.append(time.perf_counter() - t0)
+    conn.close()
+    with lock:
+        latencies.extend(local)
+        errors.append(failed)
+
+
+def run_mode(mode, clients, requests_per_client, workers):
+    db_path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    database.DATABASE_PATH = db_path
+    database.init_db()
+    database.add_sample_data()
+
+    port = _free_port()
+    env = dict(os.environ, PORT=str(port), DATABASE_PATH=db_path, WEB_CONCURRENCY=str(workers),
+               GUNICORN_BACKLOG='4096', **MODES[mode])
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT, 'gunicorn.conf.py')],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        _wait_for(port)
+        latencies, errors, lock = [], [], threading.Lock()
+        threads = [threading.Thread(target=_client, args=(port, requests_per_client, latencies, errors, lock))
+                   for _ in range(clients)]
+        t0 = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - t0
+    finally:
+        server.terminate()
+        server.wait()
+
+    latencies.sort()
+    total = len(latencies)
+    print(f'{mode:8} clients={clients:5} requests={total:6} errors={sum(errors):4} '
+          f'rps={total / elapsed:8.0f} p50={latencies[total // 2] * 1000:7.1f}ms '
+          f'p99={latencies[int(total * 0.99)] * 1000:8.1f}ms')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, nargs='+', default=[100, 1000])
+    parser.add_argument('--requests', type=int, default=20, help='requests per client')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--modes', nargs='+', default=list(MODES), choices=list(MODES))
+    args = parser.parse_args()
+
+    for clients in args.clients:
+        for mode in args.modes:
+            run_mode(mode, clients, args.requests, args.workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Time from process start to the first successfully served request.
+
+Runs gunicorn through gunicorn.conf.py with and without preload, against a
+fresh database (migrations pending) and an existing one.
+
+    python benchmarks/startup_time.py --runs 3
+"""
+import argparse
+import http.client
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'backend'))
+
+import database  # noqa: E402
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def time_to_first_request(db_path, preload, workers, timeout=30):
+    port = _free_port()
+    env = dict(os.environ, PORT=str(port), DATABASE_PATH=db_path, WEB_CONCURRENCY=str(workers),
+               GUNICORN_PRELOAD='1' if preload else '0')
+    t0 = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT, 'gunicorn.conf.py')],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - t0 < timeout:
+            try:
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+                conn.request('GET', '/api/businesses/search?q=spa')
+                status = conn.getresponse().status
+                conn.close()
+                if status == 200:
+                    return time.perf_counter() - t0
+            except OSError:
+                pass
+            time.sleep(0.005)
+        raise RuntimeError('server did not answer in time')
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    for fresh in (True, False):
+        for preload in (False, True):
+            samples = []
+            for _ in range(args.runs):
+                db_path = os.path.join(tempfile.mkdtemp(), 'startup.db')
+                if not fresh:
+                    database.DATABASE_PATH = db_path
+                    database.ensure_schema()
+                    database.add_sample_data()
+                samples.append(time_to_first_request(db_path, preload, args.workers))
+            label = 'fresh db   ' if fresh else 'existing db'
+            print(f'{label} preload={int(preload)} workers={args.workers} '
+                  f'median={statistics.median(samples) * 1000:.0f}ms '
+                  f'min={min(samples) * 1000:.0f}ms max={max(samples) * 1000:.0f}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+"""Gunicorn settings for Book&Bloom.
+
+The default mode runs gthread workers: each worker process serves several
+requests on threads, so a request waiting on a SQLite lock, a file upload
+or the notification fan-out only holds one thread instead of a whole
+process. Every setting can be overridden from the environment, e.g.
+GUNICORN_WORKER_CLASS=sync to get the old one-request-per-process mode.
+"""
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+chdir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend')
+wsgi_app = 'app:create_app()'
+
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.environ.get('WEB_CONCURRENCY', min(multiprocessing.cpu_count() * 2 + 1, 8)))
+threads = int(os.environ.get('GUNICORN_THREADS', 8 if worker_class == 'gthread' else 1))
+
+# Pending connections the kernel queues while all threads are busy
+backlog = int(os.environ.get('GUNICORN_BACKLOG', 2048))
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+# Recycle workers periodically to bound memory growth
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 200))
+
+# Import the app and run schema setup once in the master, then fork workers
+# from the warmed parent. No database connection is held open across fork.
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG') or None
+errorlog = '-'
+
+
+def post_fork(server, worker):
+    """Start per-worker background threads (threads don't survive fork)"""
+    from maintenance import start_scheduler
+    start_scheduler()
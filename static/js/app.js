@@ -29,16 +29,64 @@ function goToProfile() {
         initMap();
 
         // Auto-request location if not already set
-        if (userLocation.lat === null || userLocation.lon === null) {
+        const hasLocation = userLocation.lat !== null && userLocation.lon !== null;
+        if (!hasLocation) {
             enableLocation(true); // true = autoRetry, won't show "Requesting..." toast
-        } else {
-            loadBusinesses();
         }
 
+        loadDashboard(hasLocation);
+    }, 100);
+}
+
+// Profile, notifications, unread count, favorites (and nearby businesses when
+// the location is known) in one request; falls back to separate requests
+async function loadDashboard(withNearby) {
+    if (!currentUser) {
+        if (withNearby) loadBusinesses();
+        return;
+    }
+
+    const requests = [{ op: 'profile' }, { op: 'notifications' }, { op: 'unread' }, { op: 'favorites' }];
+    if (withNearby) requests.push({ op: 'nearby', ...nearbyParams() });
+
+    try {
+        const response = await fetch('/api/batch', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ user_id: currentUser.id, requests })
+        });
+        if (!response.ok) throw new Error(`Batch failed with ${response.status}`);
+
+        const data = await response.json();
+        data.responses.forEach(({ op, status, body }) => {
+            if (status !== 200) {
+                console.error(`Error loading ${op}:`, body.error);
+                return;
+            }
+            if (op === 'profile') {
+                currentUser = { ...currentUser, ...body };
+                localStorage.setItem('currentUser', JSON.stringify(currentUser));
+                updateProfileDisplay();
+            } else if (op === 'notifications') {
+                renderNotifications(body);
+            } else if (op === 'unread') {
+                renderUnreadCount(body.count);
+            } else if (op === 'favorites') {
+                userFavorites = body;
+                renderFavorites();
+            } else if (op === 'nearby') {
+                allBusinesses = body;
+                displayBusinesses(allBusinesses);
+                loadViewport();
+            }
+        });
+    } catch (error) {
+        console.error('Error loading dashboard:', error);
+        if (withNearby) loadBusinesses();
         loadNotifications();
         loadFavorites();
         checkUnreadNotifications();
-    }, 100);
+    }
 }
 
 function showPage(pageId) {
@@ -548,8 +596,16 @@ async function getLocationFromIP() {
     console.log('🌐 [IP-LOCATION] Attempting IP-based geolocation...');
 
     try {
-        const response = await fetch('https://ipapi.co/json/');
-        const data = await response.json();
+        // Our server remembers locations seen from this IP; ask ipapi only if it doesn't know
+        let data;
+        const localResponse = await fetch('/api/geocode/ip');
+        if (localResponse.ok) {
+            const place = await localResponse.json();
+            data = { latitude: place.latitude, longitude: place.longitude, city: place.label, country_name: 'Canada' };
+        } else {
+            const response = await fetch('https://ipapi.co/json/');
+            data = await response.json();
+        }
 
         console.log('✅ [IP-LOCATION] IP geolocation SUCCESS:', data);
 
@@ -619,26 +675,64 @@ function initMap() {
         attribution: '© OpenStreetMap contributors'
     }).addTo(map);
 
+    // Markers follow the visible area: clusters when zoomed out, businesses when zoomed in
+    map.on('moveend', loadViewport);
+
     enableLocation();
 }
 
+async function loadViewport() {
+    if (!map) return;
+
+    const bounds = map.getBounds();
+    const params = new URLSearchParams({
+        north: bounds.getNorth(),
+        south: bounds.getSouth(),
+        east: bounds.getEast(),
+        west: bounds.getWest(),
+        zoom: map.getZoom()
+    });
+    if (currentFilter !== 'All') params.set('business_type', currentFilter);
+
+    try {
+        const response = await fetch(`/api/businesses/viewport?${params}`);
+        if (!response.ok) return;
+        const data = await response.json();
+
+        if (data.mode === 'businesses') {
+            displayBusinessMarkers(data.businesses);
+        } else {
+            displayClusterMarkers(data.clusters);
+        }
+    } catch (error) {
+        console.error('Error loading map viewport:', error);
+    }
+}
+
 // ============ BUSINESSES ============
+function nearbyParams() {
+    return {
+        latitude: userLocation.lat,
+        longitude: userLocation.lon,
+        radius: 10000, // 10,000km radius to show all Canadian businesses
+        business_type: currentFilter === 'All' ? null : currentFilter,
+        user_id: currentUser ? currentUser.id : null,
+        sort: 'relevance', // nearby, popular businesses first
+        limit: 100
+    };
+}
+
 async function loadBusinesses() {
     try {
         const response = await fetch('/api/businesses/nearby', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({
-                latitude: userLocation.lat,
-                longitude: userLocation.lon,
-                radius: 10000, // 10,000km radius to show all Canadian businesses
-                business_type: currentFilter === 'All' ? null : currentFilter
-            })
+            body: JSON.stringify(nearbyParams())
         });
 
         allBusinesses = await response.json();
         displayBusinesses(allBusinesses);
-        displayBusinessMarkers(allBusinesses);
+        loadViewport();
     } catch (error) {
         console.error('Error loading businesses:', error);
     }
@@ -652,17 +746,22 @@ function displayBusinesses(businesses) {
         return;
     }
 
-    grid.innerHTML = businesses.map(biz => `
-        <div class="business-card">
-            <button class="favorite-btn ${isFavorite(biz.id) ? 'active' : ''}" onclick="event.stopPropagation(); toggleFavorite(${biz.id})">
-                ${isFavorite(biz.id) ? '❤️' : '🤍'}
+    grid.innerHTML = businesses.map(biz => {
+        // Nearby results carry is_favorite when the request included user_id
+        const favorited = biz.is_favorite ?? isFavorite(biz.id);
+        return `
+        <div class="business-card" onclick="openGallery(${biz.id})">
+            ${coverImage(biz)}
+            <button class="favorite-btn ${favorited ? 'active' : ''}" onclick="event.stopPropagation(); toggleFavorite(${biz.id})">
+                ${favorited ? '❤️' : '🤍'}
             </button>
             <div class="business-type-badge">${biz.business_type}</div>
             <div class="business-name">${biz.business_name}</div>
             <div class="business-address">📍 ${biz.address}</div>
             ${biz.distance ? `<div class="business-distance">📏 ${formatDistance(biz.distance)}</div>` : ''}
         </div>
-    `).join('');
+    `;
+    }).join('');
 }
 
 function displayBusinessMarkers(businesses) {
@@ -685,6 +784,26 @@ function displayBusinessMarkers(businesses) {
     });
 }
 
+function displayClusterMarkers(clusters) {
+    businessMarkers.forEach(marker => map.removeLayer(marker));
+    businessMarkers = [];
+
+    const singles = clusters.filter(cluster => cluster.count === 1);
+    displayBusinessMarkers(singles);
+
+    clusters.filter(cluster => cluster.count > 1).forEach(cluster => {
+        const marker = L.marker([cluster.latitude, cluster.longitude], {
+            icon: L.divIcon({
+                className: 'cluster-marker',
+                html: `<div>${cluster.count}</div>`,
+                iconSize: [36, 36]
+            })
+        }).addTo(map).on('click', () => map.setView([cluster.latitude, cluster.longitude], map.getZoom() + 2));
+
+        businessMarkers.push(marker);
+    });
+}
+
 function filterBusinesses(type) {
     currentFilter = type;
     document.querySelectorAll('.filter-btn').forEach(btn => btn.classList.remove('active'));
@@ -692,6 +811,12 @@ function filterBusinesses(type) {
     loadBusinesses();
 }
 
+// Listings carry only the cover's small thumbnail; width/height reserve its space before it loads
+function coverImage(biz) {
+    if (!biz.cover_url) return '';
+    return `<img class="business-cover" src="${biz.cover_url}" width="${biz.cover_width}" height="${biz.cover_height}" loading="lazy" alt="">`;
+}
+
 function formatDistance(km) {
     return km < 1 ? `${Math.round(km * 1000)}m` : `${km}km`;
 }
@@ -705,37 +830,44 @@ async function performSearch() {
     showToast('Searching...', 'success');
 
     try {
-        // 1. Try to geocode as a city/location first
-        const geocodeResponse = await fetch(`https://nominatim.openstreetmap.org/search?format=json&q=${encodeURIComponent(query)}`);
-        const geocodeData = await geocodeResponse.json();
+        // One call: the server geocodes the query and returns businesses around it,
+        // or falls back to a name search when it isn't a place
+        const params = new URLSearchParams({ q: query, radius: 10000 });
+        if (currentFilter !== 'All') params.set('business_type', currentFilter);
+        if (currentUser) params.set('user_id', currentUser.id);
+        if (userLocation.lat && userLocation.lon) {
+            // Lets a name search rank closer matches higher
+            params.set('latitude', userLocation.lat);
+            params.set('longitude', userLocation.lon);
+        }
+        const response = await fetch(`/api/search?${params}`);
+        const data = await response.json();
+        const businesses = data.businesses || [];
+        allBusinesses = businesses;
 
-        if (geocodeData && geocodeData.length > 0) {
-            const location = geocodeData[0];
-            const lat = parseFloat(location.lat);
-            const lon = parseFloat(location.lon);
+        if (data.location) {
+            const { latitude: lat, longitude: lon, label } = data.location;
 
             // Update user location context
             userLocation.lat = lat;
             userLocation.lon = lon;
 
-            // Move map
+            displayBusinesses(businesses);
+
+            // Move map (markers follow from the viewport request on moveend)
             if (map) {
                 map.setView([lat, lon], 13);
                 L.popup()
                     .setLatLng([lat, lon])
-                    .setContent(`📍 ${location.display_name.split(',')[0]}`)
+                    .setContent(`📍 ${label.split(',')[0]}`)
                     .openOn(map);
             }
 
-            showToast(`Found ${location.display_name.split(',')[0]}! Searching nearby...`, 'success');
-            loadBusinesses();
+            showToast(`Found ${label.split(',')[0]}! Showing nearby businesses...`, 'success');
             return;
         }
 
-        // 2. Fallback to name search
-        const response = await fetch(`/api/businesses/search?q=${encodeURIComponent(query)}`);
-        const businesses = await response.json();
-        allBusinesses = businesses;
+        // Name search results
         displayBusinesses(businesses);
         displayBusinessMarkers(businesses);
 
@@ -784,53 +916,113 @@ async function deleteAccount() {
     }
 }
 
+// ============ GALLERY ============
+let gallery = { businessId: null, next: null };
+
+async function openGallery(businessId) {
+    const biz = allBusinesses.concat(userFavorites).find(b => b.id === businessId);
+    gallery = { businessId, next: null };
+
+    document.getElementById('gallery-title').textContent = biz ? biz.business_name : '';
+    document.getElementById('gallery-grid').innerHTML = '';
+    document.getElementById('gallery-more').style.display = 'none';
+    document.getElementById('gallery-modal').classList.add('active');
+
+    await loadGalleryPage();
+}
+
+// Thumbnails one page at a time; the medium size is only fetched when a photo is opened
+async function loadGalleryPage() {
+    const businessId = gallery.businessId;
+    const params = new URLSearchParams({ limit: 12 });
+    if (gallery.next) params.set('after', gallery.next);
+
+    try {
+        const response = await fetch(`/api/business/${businessId}/photos?${params}`);
+        const data = await response.json();
+        if (businessId !== gallery.businessId) return; // another gallery was opened meanwhile
+
+        const grid = document.getElementById('gallery-grid');
+        if (!gallery.next && data.photos.length === 0) {
+            grid.innerHTML = '<p style="color: #b8a9d6; text-align: center; padding: 40px;">No photos yet</p>';
+        }
+
+        grid.insertAdjacentHTML('beforeend', data.photos.map(photo => `
+            <img class="gallery-thumb" src="${photo.thumb.url}" width="${photo.thumb.width}" height="${photo.thumb.height}"
+                 loading="lazy" alt="" onclick="viewGalleryPhoto('${photo.medium.url}')">
+        `).join(''));
+
+        gallery.next = data.next;
+        document.getElementById('gallery-more').style.display = data.next ? 'block' : 'none';
+    } catch (error) {
+        console.error('Error loading photos:', error);
+    }
+}
+
+function viewGalleryPhoto(url) {
+    document.getElementById('photo-modal-img').src = url;
+    document.getElementById('photo-modal').classList.add('active');
+}
+
+function closeGallery(event) {
+    if (event.target.id === 'gallery-modal' || event.target.classList.contains('photo-modal-close')) {
+        document.getElementById('gallery-modal').classList.remove('active');
+        gallery = { businessId: null, next: null };
+    }
+}
+
 // ============ NOTIFICATIONS ============
 async function loadNotifications() {
     if (!currentUser) return;
 
     try {
         const response = await fetch(`/api/user/${currentUser.id}/notifications`);
-        const notifications = await response.json();
-
-        const list = document.getElementById('notifications-list');
-
-        if (notifications.length === 0) {
-            list.innerHTML = '<p style="color: #b8a9d6; text-align: center; padding: 40px;">No notifications yet</p>';
-            return;
-        }
-
-        list.innerHTML = notifications.map(notif => `
-            <div class="notification-item ${notif.is_read ? '' : 'unread'}" onclick="markNotificationRead(${notif.id})">
-                <div class="notification-title">${notif.title}</div>
-                <div class="notification-message">${notif.message}</div>
-                <div class="notification-time">${new Date(notif.created_at).toLocaleString()}</div>
-            </div>
-        `).join('');
+        renderNotifications(await response.json());
     } catch (error) {
         console.error('Error loading notifications:', error);
     }
 }
 
+function renderNotifications(notifications) {
+    const list = document.getElementById('notifications-list');
+
+    if (notifications.length === 0) {
+        list.innerHTML = '<p style="color: #b8a9d6; text-align: center; padding: 40px;">No notifications yet</p>';
+        return;
+    }
+
+    list.innerHTML = notifications.map(notif => `
+        <div class="notification-item ${notif.is_read ? '' : 'unread'}" onclick="markNotificationRead(${notif.id})">
+            <div class="notification-title">${notif.title}</div>
+            <div class="notification-message">${notif.message}</div>
+            <div class="notification-time">${new Date(notif.created_at).toLocaleString()}</div>
+        </div>
+    `).join('');
+}
+
 async function checkUnreadNotifications() {
     if (!currentUser) return;
 
     try {
         const response = await fetch(`/api/user/${currentUser.id}/notifications/unread`);
         const data = await response.json();
-
-        const badge = document.getElementById('notification-count');
-
-        if (data.count > 0) {
-            badge.textContent = data.count;
-            badge.classList.add('active');
-        } else {
-            badge.classList.remove('active');
-        }
+        renderUnreadCount(data.count);
     } catch (error) {
         console.error('Error checking notifications:', error);
     }
 }
 
+function renderUnreadCount(count) {
+    const badge = document.getElementById('notification-count');
+
+    if (count > 0) {
+        badge.textContent = count;
+        badge.classList.add('active');
+    } else {
+        badge.classList.remove('active');
+    }
+}
+
 async function markNotificationRead(notificationId) {
     try {
         await fetch(`/api/notifications/${notificationId}/read`, { method: 'POST' });
@@ -848,27 +1040,31 @@ async function loadFavorites() {
     try {
         const response = await fetch(`/api/user/${currentUser.id}/favorites`);
         userFavorites = await response.json();
-
-        const grid = document.getElementById('favorites-grid');
-
-        if (userFavorites.length === 0) {
-            grid.innerHTML = '<div style="grid-column: 1/-1; text-align: center; padding: 40px; color: #b8a9d6;"><p style="font-size: 3rem;">❤️</p><p>No favorites yet</p></div>';
-            return;
-        }
-
-        grid.innerHTML = userFavorites.map(biz => `
-            <div class="business-card">
-                <button class="favorite-btn active" onclick="event.stopPropagation(); toggleFavorite(${biz.id})">❤️</button>
-                <div class="business-type-badge">${biz.business_type}</div>
-                <div class="business-name">${biz.business_name}</div>
-                <div class="business-address">📍 ${biz.address}</div>
-            </div>
-        `).join('');
+        renderFavorites();
     } catch (error) {
         console.error('Error loading favorites:', error);
     }
 }
 
+function renderFavorites() {
+    const grid = document.getElementById('favorites-grid');
+
+    if (userFavorites.length === 0) {
+        grid.innerHTML = '<div style="grid-column: 1/-1; text-align: center; padding: 40px; color: #b8a9d6;"><p style="font-size: 3rem;">❤️</p><p>No favorites yet</p></div>';
+        return;
+    }
+
+    grid.innerHTML = userFavorites.map(biz => `
+        <div class="business-card" onclick="openGallery(${biz.id})">
+            ${coverImage(biz)}
+            <button class="favorite-btn active" onclick="event.stopPropagation(); toggleFavorite(${biz.id})">❤️</button>
+            <div class="business-type-badge">${biz.business_type}</div>
+            <div class="business-name">${biz.business_name}</div>
+            <div class="business-address">📍 ${biz.address}</div>
+        </div>
+    `).join('');
+}
+
 function isFavorite(businessId) {
     return userFavorites.some(fav => fav.id === businessId);
 }
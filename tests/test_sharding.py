@@ -0,0 +1,64 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+os.environ.setdefault('MAINTENANCE_ENABLED', '0')
+
+import app as app_module  # noqa: E402
+import database  # noqa: E402
+import sharding  # noqa: E402
+
+VANCOUVER = (49.2827, -123.1207)
+MONTREAL = (45.5017, -73.5673)
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, 'DATABASE_PATH', str(tmp_path / 'database.db'))
+    monkeypatch.setattr(database, 'SHARD_DIR', str(tmp_path / 'shards'))
+    monkeypatch.setattr(database, 'SHARDING_ENABLED', True)
+    monkeypatch.setattr(sharding, '_primary_checked_at', None)
+    monkeypatch.setattr(sharding, '_primary_has_rows', True)
+    monkeypatch.setattr(app_module, '_app_initialized', False)
+    test_client = app_module.create_app().test_client()
+    yield test_client
+    sharding.directory.reload()
+
+
+def register(client, email, location):
+    response = client.post('/api/user/register', json={
+        'name': email, 'email': email, 'password': 'secret1',
+        'latitude': location[0], 'longitude': location[1]})
+    assert response.status_code == 201
+    return response.get_json()['user']['id']
+
+
+def test_moving_to_a_lower_shard_keeps_new_ids_in_range(client):
+    database.add_sample_data()
+    sharding.rebalance()
+
+    # Registered in Montreal, then seen in Vancouver: east (shard 4) -> west (shard 1)
+    moved_id = register(client, 'moved@example.com', MONTREAL)
+    assert sharding.id_region(moved_id) == 'east'
+    conn = database.get_db('east')
+    conn.execute('UPDATE users SET latitude = ?, longitude = ? WHERE id = ?', (*VANCOUVER, moved_id))
+    conn.commit()
+    conn.close()
+    assert sharding.rebalance() == {('east', 'west'): 1}
+    assert sharding.user_region(moved_id) == 'west'
+
+    west_id = register(client, 'west@example.com', VANCOUVER)
+    east_id = register(client, 'east@example.com', MONTREAL)
+    assert sharding.id_region(west_id) == 'west'
+    assert sharding.id_region(east_id) == 'east'
+    assert len({moved_id, west_id, east_id}) == 3
+
+    conn = database.get_db('west')
+    business_id = conn.execute('SELECT id FROM businesses ORDER BY id LIMIT 1').fetchone()[0]
+    conn.close()
+    for user_id in (west_id, moved_id):
+        assert client.post(f'/api/user/{user_id}/favorites/{business_id}').status_code == 200
+        favorites = client.get(f'/api/user/{user_id}/favorites').get_json()
+        assert [business['id'] for business in favorites] == [business_id]